@@ -0,0 +1,58 @@
+"""bookkeeping for reads from chunked (compressed) images"""
+
+import operator
+from functools import reduce
+
+
+def chunk_aligned(start, count, chunk_shape, sizes):
+    """
+    the (start, count) of the smallest hyperslab made of whole chunks (clipped to
+    an image of the given sizes) that contains the hyperslab start, count
+    """
+    aligned_start = []
+    aligned_count = []
+    for b, c, edge, size in zip(start, count, chunk_shape, sizes):
+        first = b // edge * edge
+        aligned_start.append(first)
+        aligned_count.append(min(size, -(-(b + c) // edge) * edge) - first)
+    return aligned_start, aligned_count
+
+
+class ReadStats(object):
+    """
+    counts what reading hyperslabs from disk cost: requested_bytes is the size of
+    the hyperslabs asked for (in the stored type), decoded_bytes the size of the
+    chunks that had to be decompressed for them. Each read is assumed to decode
+    every chunk it overlaps (i.e. no hits in HDF5's chunk cache), so decoded_bytes
+    is an upper bound. For unchunked images both are the same.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.requested_bytes = 0
+        self.decoded_bytes = 0
+
+    def add(self, start, count, itemsize, chunk_shape=None, sizes=None):
+        """record a read of the hyperslab start, count from an image of the given sizes and chunks"""
+        requested = reduce(operator.mul, count, 1) * itemsize
+        self.reads += 1
+        self.requested_bytes += requested
+        if chunk_shape is None or requested == 0:
+            self.decoded_bytes += requested
+        else:
+            decoded = chunk_aligned(start, count, chunk_shape, sizes)[1]
+            self.decoded_bytes += reduce(operator.mul, decoded, 1) * itemsize
+
+    @property
+    def amplification(self):
+        """decoded bytes per requested byte; 1 means no chunk was decoded in vain"""
+        if self.requested_bytes == 0:
+            return 1.0
+        return self.decoded_bytes / self.requested_bytes
+
+    def __repr__(self):
+        return ("ReadStats(reads=%d, requested=%.1f MB, decoded=%.1f MB, amplification=%.2f)"
+                % (self.reads, self.requested_bytes / 2**20, self.decoded_bytes / 2**20, self.amplification))
@@ -0,0 +1,170 @@
+"""loading many volumes with the same geometry into a single subjects-by-voxels array"""
+
+import sys
+
+import numpy as numpy
+
+from .factory import scan_headers, volumeFromFile
+from .hyperslab import HyperslabPool
+from .libpyminc2 import mincSizes
+from .parallel import can_fork, run_parallel, shared_array, worker_arrays
+from .volumes import getDtype, mincVolume, GeometryMismatchException, _maskBoundingBox
+
+
+def check_geometry(headers):
+    """
+    raises GeometryMismatchException unless all headers (as returned by
+    scan_headers) describe the same sampling grid
+    """
+    first = headers[0]
+    for header in headers[1:]:
+        same = (header["dimnames"] == first["dimnames"] and header["sizes"] == first["sizes"])
+        for key in ["starts", "separations", "x_direction_cosines",
+                    "y_direction_cosines", "z_direction_cosines"]:
+            same = same and numpy.allclose(header[key], first[key])
+        if not same:
+            sys.stderr.write("%s and %s do not have the same geometry\n"
+                             % (first["filename"], header["filename"]))
+            raise GeometryMismatchException
+    return first
+
+
+def cohort_mask(mask, header):
+    """a boolean array of the volume's shape from a mask filename, mincVolume or array"""
+    if isinstance(mask, str):
+        mask_volume = volumeFromFile(mask)
+        check_geometry([header, mask_volume.getHeader()])
+        mask = mask_volume.data
+        mask_volume.closeVolume()
+    elif isinstance(mask, mincVolume):
+        check_geometry([header, mask.getHeader()])
+        mask = mask.data
+    mask = numpy.asarray(mask)
+    if mask.dtype != bool:
+        mask = mask > 0.5
+    if list(mask.shape) != list(header["sizes"]):
+        sys.stderr.write("mask shape %s does not match volume sizes %s\n"
+                         % (mask.shape, header["sizes"]))
+        raise GeometryMismatchException
+    return mask
+
+
+def _mincDtype(dtype):
+    """the mincSizes name of a numpy or minc dtype"""
+    if isinstance(dtype, str) and dtype in mincSizes:
+        return dtype
+    minc_dtype = getDtype(numpy.empty(0, dtype=dtype))
+    if minc_dtype is None:
+        raise ValueError("no MINC type corresponds to dtype %s" % dtype)
+    return minc_dtype
+
+
+def _fillRow(matrix, mask, filename, dtype, row, start=None, count=None):
+    v = mincVolume(filename=filename, dtype=dtype, readonly=True)
+    v.openFile()
+    try:
+        if mask is None:
+            # rows of a C-contiguous matrix are contiguous, so read straight into them
+            sizes = v.sizes[0:v.ndims]
+            v._readHyperslab([0] * v.ndims, sizes, dtype, matrix[row].reshape(sizes))
+        else:
+            # mask is cropped to its bounding box, given by start and count
+            matrix[row] = numpy.asarray(v.getHyperslab(start, count, dtype))[mask]
+    finally:
+        v.closeVolume()
+
+
+def _cohortRow(filename, dtype, row, start, count):
+    """worker for load_cohort: fills one row of the shared matrix"""
+    matrix, mask = worker_arrays()
+    _fillRow(matrix, mask, filename, dtype, row, start, count)
+
+
+def load_cohort(filenames, mask=None, dtype="float32", out="memory", workers=None, cache=None):
+    """
+    reads the volumes in filenames into one (len(filenames), voxels) array, row i
+    holding the flattened (C order) real values of filenames[i]. All files must
+    have the same geometry, which is checked from their headers before any data is
+    read (cache is passed to scan_headers).
+
+    mask (a filename, mincVolume or array of the volume's shape) restricts the
+    columns to the voxels inside the mask, in C order; only the mask's bounding
+    box is read from each file.
+
+    out="memory" keeps the result in RAM; any other value is taken as the path of
+    a .npy file, which is created and returned as a numpy.memmap so that cohorts
+    larger than memory can be loaded.
+
+    With workers > 1 the rows are filled by that many forked processes, each
+    reading its own files straight into the (shared) result.
+
+    Returns the matrix and the header of the first file (see mincVolume.getHeader).
+    """
+    if len(filenames) == 0:
+        raise ValueError("load_cohort needs at least one file")
+    header = check_geometry(scan_headers(filenames, cache=cache))
+    dtype = _mincDtype(dtype)
+    numpy_dtype = numpy.dtype(mincSizes[dtype]["numpy"])
+    start = count = None
+    if mask is not None:
+        mask = cohort_mask(mask, header)
+        voxels = int(mask.sum())
+        # only the bounding box of the mask is read from each file
+        start, count = _maskBoundingBox(mask) or ([0] * mask.ndim, [1] * mask.ndim)
+        mask = mask[tuple(slice(b, b + c) for b, c in zip(start, count))]
+    else:
+        voxels = int(numpy.prod(header["sizes"]))
+    shape = (len(filenames), voxels)
+    parallel = workers is not None and workers > 1 and can_fork()
+    if out != "memory":
+        matrix = numpy.lib.format.open_memmap(out, mode="w+", dtype=numpy_dtype, shape=shape)
+    elif parallel:
+        matrix = shared_array(shape, numpy_dtype)
+    else:
+        matrix = numpy.empty(shape, dtype=numpy_dtype)
+    if parallel:
+        tasks = [(f, dtype, row, start, count) for row, f in enumerate(filenames)]
+        run_parallel(_cohortRow, tasks, workers, shared=(matrix, mask))
+    else:
+        for row, f in enumerate(filenames):
+            _fillRow(matrix, mask, f, dtype, row, start, count)
+    if out != "memory":
+        matrix.flush()
+    return matrix, header
+
+
+def _chunkEdge(filename):
+    """the chunk edge length along the slowest-varying dimension of filename's image"""
+    v = mincVolume(filename=filename, readonly=True)
+    v.openFile()
+    try:
+        return v._chunkEdge(0)
+    finally:
+        v.closeVolume()
+
+
+def iter_cohort_slabs(filenames, slab_size=None, dtype="double", begin=0, end=None):
+    """
+    iterates over files with the same geometry in lockstep, slab by slab along the
+    slowest-varying dimension (from begin to end), yielding (start, count, slabs)
+    where slabs is a (len(filenames),) + count array with the slab of every file.
+    The array is reused for all slabs of the same shape, so only one slab per file
+    is held in memory. By default slab_size is chosen so that this is about
+    DEFAULT_SLAB_BYTES in total, in whole chunks of the first file.
+    """
+    volumes = []
+    try:
+        for f in filenames:
+            v = mincVolume(filename=f, dtype=dtype, readonly=True)
+            v.openFile()
+            volumes.append(v)
+        slab_size = slab_size or volumes[0]._alignSlabSize(0, volumes[0]._defaultSlabSize(0, dtype) // len(volumes))
+        pool = HyperslabPool()
+        for start, count in volumes[0]._slabExtents(0, slab_size, begin, end):
+            slabs = pool.get([len(volumes)] + count, mincSizes[dtype]["numpy"])
+            for i, v in enumerate(volumes):
+                v.getHyperslab(start, count, dtype, out=slabs[i])
+            yield start, count, slabs
+    finally:
+        for v in volumes:
+            v.closeVolume()
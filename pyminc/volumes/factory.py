@@ -1,41 +1,139 @@
 """factories for creating mincVolumes"""
 
-from .volumes import mincVolume, getDtype
+from .volumes import mincVolume, getDtype, IncorrectDimsException
+from .headercache import default_cache
+from .libpyminc2 import mincSizes, hdf5_threadsafe
+from .writer import VolumeWriter
 
 
-def volumeFromFile(filename, dtype="double", readonly=True, labels=False):
-    """creates a new mincVolume from existing file."""
-    v = mincVolume(filename=filename, dtype=dtype, readonly=readonly, labels=labels)
-    v.openFile()
+def volumeFromFile(filename, dtype="double", readonly=True, labels=False, mmap=False,
+                   header_only=False, cache=None, resolution=0):
+    """creates a new mincVolume from existing file.
+
+    With mmap=True, uncompressed files whose real values equal their stored values
+    expose data as a read-only numpy.memmap instead of being read through libminc
+    (see mincVolume.mapData); other files are read as usual.
+
+    With header_only=True only the geometry and data type are read and the file is
+    closed again immediately (see mincVolume.openFile); the data can't be accessed.
+
+    cache can be a HeaderCache (or True for the default one): header only volumes
+    are then created from the cached header without opening the file at all, and
+    the header of every file that does get opened is stored in the cache.
+
+    resolution=k opens the lower resolution level k (see mincVolume.build_pyramid),
+    read-only: sizes, separations and starts are those of the level, whose voxels
+    average blocks of 2**k full resolution voxels."""
+    if cache is True:
+        cache = default_cache()
+    if resolution:
+        # the cache only holds full resolution headers
+        cache = None
+    v = mincVolume(filename=filename, dtype=dtype, readonly=readonly, labels=labels, resolution=resolution)
+    if cache is not None and header_only:
+        header = cache.get(filename)
+        if header is not None:
+            v.setHeader(header)
+            return v
+    v.openFile(header_only=header_only)
+    if cache is not None:
+        cache.put(filename, v.getHeader())
+    if mmap and not header_only:
+        v.mapData()
     return v
 
 
+def peek_header(filename, cache=None):
+    """returns the geometry and data type of a file as a dictionary (see mincVolume.getHeader)"""
+    return volumeFromFile(filename, header_only=True, cache=cache).getHeader()
+
+
+def scan_headers(filenames, cache=None):
+    """
+    returns the headers (see peek_header) of many files, in order. With a
+    HeaderCache (or True for the default one) files whose header is cached and
+    unchanged on disk aren't opened, and the others are added to the cache.
+    """
+    if cache is True:
+        cache = default_cache()
+    if cache is None:
+        return [peek_header(f) for f in filenames]
+    # one transaction for the whole scan instead of a commit per file
+    with cache.batch():
+        return [peek_header(f, cache=cache) for f in filenames]
+
+
+def _streamData(source, target, slab_size=None, prefetch=0):
+    """
+    copies the data of source to the new volume target slab by slab, converting it
+    to the target's volume type on the way, and finishes the target file.
+
+    The writer calls libminc while the next slab would be read, so prefetch is
+    only honoured when HDF5 was built thread-safe.
+    """
+    if source.sizes[0:source.ndims] != target.sizes[0:target.ndims]:
+        raise IncorrectDimsException
+    slab_size = slab_size or source._defaultSlabSize(0, "double")
+    data_range = None
+    if mincSizes[target.volumeType]["type"] != "real":
+        # the header range bounds the data on disk, the range of loaded data is exact
+        data_range = source.getVolumeRange()
+    # in memory there is nothing to prefetch
+    if source.dataLoaded or not hdf5_threadsafe:
+        prefetch = 0
+    slabs = source.iter_slabs(0, slab_size, "double", prefetch=prefetch)
+    try:
+        with VolumeWriter(target, range=data_range) as writer:
+            writer.write_slabs(slabs)
+    finally:
+        # stops the prefetching thread if writing failed
+        slabs.close()
+
+
 def volumeFromInstance(volInstance, outputFilename, dtype="double", data=False,
-                       dims=None, volumeType=None, path=False, labels=False):
-    """creates new mincVolume from another mincVolume"""
+                       dims=None, volumeType=None, path=False, labels=False,
+                       sliceScaled=False, stream=False, slab_size=None, props=None, prefetch=0):
+    """creates new mincVolume from another mincVolume.
+
+    With data=True and stream=True the data isn't loaded and copied in memory but
+    streamed from volInstance to the new file slab by slab (of slab_size slices),
+    so that only one slab is in memory at once. The new file is then complete
+    and the returned volume is closed, as after writeFile. With prefetch > 0 up to
+    that many slabs are read ahead while the current one is converted and written,
+    if HDF5 is thread-safe (libpyminc2.hdf5_threadsafe); otherwise it is ignored.
+
+    props, a VolumeProps, sets the compression and chunking of the new file."""
     v = mincVolume(filename=outputFilename, dtype=dtype, readonly=False, labels=labels)
     v.copyDimensions(volInstance, dims)
-    v.copyDtype(volInstance)
-    v.createVolumeHandle(volumeType or volInstance.volumeType)
+    if not volInstance.native:
+        # a native volume's dtype is its stored type; the copy holds real values
+        v.copyDtype(volInstance)
+    v.createVolumeHandle(volumeType or volInstance.volumeType, sliceScaled=sliceScaled, props=props)
     v.copyHistory(volInstance)
-    if data:
+    if data and not stream:
         if not volInstance.dataLoaded:
             volInstance.loadData()
         v.createVolumeImage()  
-        v.data = volInstance.data.copy()
+        # setdata copies (and converts) the data once
+        v.data = volInstance._realData()
     if path:
         v.copyAttributes(volInstance, path)
+    if data and stream:
+        _streamData(volInstance, v, slab_size, prefetch)
 
     return v
 
 
 def volumeLikeFile(likeFilename, outputFilename, dtype="double", volumeType=None,
-                   labels=False, data=False):
-    """creates a new mincVolume with dimension info taken from an existing file"""
+                   labels=False, data=False, sliceScaled=False, stream=False, slab_size=None,
+                   props=None, prefetch=0):
+    """creates a new mincVolume with dimension info taken from an existing file
+    (see volumeFromInstance for data, stream and prefetch)"""
     lf = volumeFromFile(filename=likeFilename, dtype=dtype, labels=labels)
     v = volumeFromInstance(volInstance=lf, outputFilename=outputFilename, 
                            dtype=dtype, volumeType=volumeType,
-                           labels=labels, data=data)
+                           labels=labels, data=data, sliceScaled=sliceScaled,
+                           stream=stream, slab_size=slab_size, props=props, prefetch=prefetch)
     lf.closeVolume()
     return v
 
@@ -44,12 +142,14 @@ def volumeFromDescription(outputFilename, dimnames, sizes, starts, steps, volume
                           dtype="double", labels=False,
                           x_dir_cosines=(1.0,0.0,0.0),
                           y_dir_cosines=(0.0,1.0,0.0),
-                          z_dir_cosines=(0.0,0.0,1.0)):
-    """creates a new mincVolume given starts, steps, sizes, and dimension names"""
+                          z_dir_cosines=(0.0,0.0,1.0),
+                          sliceScaled=False, props=None):
+    """creates a new mincVolume given starts, steps, sizes, and dimension names;
+    props, a VolumeProps, sets the compression and chunking of the file"""
     v = mincVolume(filename=outputFilename, dtype=dtype, readonly=False, labels=labels)
     v.createNewDimensions(dimnames, sizes, starts, steps, 
                           x_dir_cosines, y_dir_cosines, z_dir_cosines)
-    v.createVolumeHandle(volumeType)
+    v.createVolumeHandle(volumeType, sliceScaled=sliceScaled, props=props)
     v.createVolumeImage()
     return v
 
@@ -59,8 +159,12 @@ def volumeFromData(outputFilename, data, dimnames=("xspace", "yspace", "zspace")
                    volumeType="ushort", dtype=None, labels=False,
                    x_dir_cosines=(1.0,0.0,0.0),
                    y_dir_cosines=(0.0,1.0,0.0),
-                   z_dir_cosines=(0.0,0.0,1.0)):
-    """creates a mincVolume from a given array"""
+                   z_dir_cosines=(0.0,0.0,1.0),
+                   sliceScaled=False, copy=True, props=None):
+    """creates a mincVolume from a given array.
+
+    With copy=False the volume uses data itself, without a copy, if it already has
+    the volume's dtype and is C-contiguous (see mincVolume.setdata)."""
     # deal with the dtype. If the dtype was not set, use the dtype of the 
     # data block. If that is not possible, default to double.
     if dtype == None:
@@ -73,6 +177,7 @@ def volumeFromData(outputFilename, data, dimnames=("xspace", "yspace", "zspace")
                               volumeType=volumeType, dtype=dtype, labels=labels,
                               x_dir_cosines=x_dir_cosines,
                               y_dir_cosines=y_dir_cosines,
-                              z_dir_cosines=z_dir_cosines)
-    v.data = data
+                              z_dir_cosines=z_dir_cosines,
+                              sliceScaled=sliceScaled, props=props)
+    v.setdata(data, copy=copy)
     return v
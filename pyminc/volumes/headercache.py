@@ -0,0 +1,198 @@
+"""persistent on-disk cache of MINC file headers
+
+Opening a MINC file through libminc/HDF5 just to find its geometry is slow when
+it's done for thousands of files. A HeaderCache stores the dictionaries
+returned by mincVolume.getHeader in a small SQLite database, keyed on the
+absolute path of the file together with its size and modification time, so
+that a file which has changed on disk is never served from the cache.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_MAX_ENTRIES = 100000
+
+
+def default_cache_path():
+    """$PYMINC_HEADER_CACHE if set, otherwise ~/.cache/pyminc/headers.sqlite"""
+    path = os.environ.get("PYMINC_HEADER_CACHE")
+    if path:
+        return path
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "pyminc", "headers.sqlite")
+
+
+def _fileKey(filename):
+    st = os.stat(filename)
+    return os.path.abspath(filename), st.st_size, st.st_mtime_ns
+
+
+class HeaderCache(object):
+    """
+    a size-bounded cache of file headers. Entries are keyed on (path, size, mtime);
+    stale entries are dropped when they are looked up, and once more than
+    max_entries headers are stored the least recently used ones are evicted.
+
+    The cache can be shared between processes; sqlite takes care of locking.
+    Lookups only read the database: the time a header was last used is kept in
+    memory and written in bulk on eviction, at the end of a batch() and on close().
+    Other changes are committed straight away unless they are made inside batch(),
+    which writes all of them in one short transaction at its end.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        self._batching = 0
+        # rows to store (None to delete) by path, and last_used times of lookups
+        self._pending = {}
+        self._used = {}
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS headers ("
+                                     "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                                     "header TEXT, last_used REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS headers_last_used ON headers (last_used)")
+
+    def get(self, filename):
+        """the cached header of filename, or None if it isn't cached or the file has changed"""
+        path, size, mtime_ns = _fileKey(filename)
+        if path in self._pending:
+            row = self._pending[path]
+            row = None if row is None else row[1:4]
+        else:
+            row = self._connection.execute("SELECT size, mtime_ns, header FROM headers WHERE path = ?",
+                                           (path,)).fetchone()
+        if row is None:
+            return None
+        if (row[0], row[1]) != (size, mtime_ns):
+            self._change(path, None)
+            return None
+        self._used[path] = time.time()
+        header = json.loads(row[2])
+        header["filename"] = filename
+        return header
+
+    def put(self, filename, header):
+        """store the header (as returned by mincVolume.getHeader) of filename"""
+        path, size, mtime_ns = _fileKey(filename)
+        self._change(path, (path, size, mtime_ns, json.dumps(header), time.time()))
+        if not self._batching:
+            self.evict()
+
+    def _change(self, path, row):
+        """stores row for path (or deletes its entry if row is None), straight away unless a batch is open"""
+        self._used.pop(path, None)
+        self._pending[path] = row
+        if not self._batching:
+            self._flush()
+
+    def _flush(self):
+        """writes the pending changes and last_used times in one transaction"""
+        pending, self._pending = self._pending, {}
+        used, self._used = self._used, {}
+        if not (pending or used):
+            return
+        with self._connection:
+            self._connection.executemany("DELETE FROM headers WHERE path = ?",
+                                         [(path,) for path, row in pending.items() if row is None])
+            self._connection.executemany("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?)",
+                                         [row for row in pending.values() if row is not None])
+            self._connection.executemany("UPDATE headers SET last_used = ? WHERE path = ?",
+                                         [(t, path) for path, t in used.items()])
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        collects the changes made inside the with block (e.g. while scanning many
+        files) and writes them in one transaction, followed by a single eviction, at
+        its end. The database isn't locked while the block runs.
+        """
+        self._batching += 1
+        try:
+            yield self
+        finally:
+            self._batching -= 1
+            if not self._batching:
+                self.evict()
+
+    def invalidate(self, filename=None):
+        """remove the entry for filename, or all entries if no filename is given"""
+        if filename is None:
+            self._pending.clear()
+            self._used.clear()
+            with self._connection:
+                self._connection.execute("DELETE FROM headers")
+        else:
+            self._change(os.path.abspath(filename), None)
+
+    def evict(self, max_entries=None):
+        """drop the least recently used entries until at most max_entries remain"""
+        self._flush()
+        max_entries = self.max_entries if max_entries is None else max_entries
+        if len(self) <= max_entries:
+            return
+        with self._connection:
+            self._connection.execute("DELETE FROM headers WHERE path IN "
+                                     "(SELECT path FROM headers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                     (max_entries,))
+
+    def close(self):
+        """writes what is pending and closes the database"""
+        if self._connection is not None:
+            self._flush()
+            self._connection.close()
+            self._connection = None
+
+    @property
+    def closed(self):
+        return self._connection is None
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_default_cache = None
+_default_pid = None
+
+
+def default_cache():
+    """
+    the HeaderCache at default_cache_path() used for cache=True: opened on first
+    use and shared from then on, and closed when the interpreter exits
+    """
+    global _default_cache, _default_pid
+    path = default_cache_path()
+    if _default_pid != os.getpid():
+        # a forked process must not use (or close) its parent's connection
+        _default_cache = None
+    elif _default_cache is not None and (_default_cache.path != path or _default_cache.closed):
+        _default_cache.close()
+        _default_cache = None
+    if _default_cache is None:
+        _default_cache = HeaderCache(path)
+        _default_pid = os.getpid()
+    return _default_cache
+
+
+def _closeDefaultCache():
+    if _default_cache is not None and _default_pid == os.getpid():
+        _default_cache.close()
+
+
+atexit.register(_closeDefaultCache)
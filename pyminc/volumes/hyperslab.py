@@ -1,5 +1,8 @@
 import numpy as np
 
+# stands in for per-slice scale/offset arrays that no longer line up with the data
+_LOST_SCALING = object()
+
 
 class HyperSlab(np.ndarray):
     """an ndarray with location and voxel-to-world mapping information"""
@@ -39,6 +42,50 @@ class HyperSlab(np.ndarray):
         self.separations = getattr(obj, 'separations', [])
         self.dimnames = getattr(obj, 'dimnames', [])
         self.count = getattr(obj, 'count', [])
+        # for stored (native) voxel values: real = voxel * scale + offset. Only views
+        # of the same stored values keep it; the results of arithmetic, astype or
+        # copy are new arrays whose values needn't be stored values any more
+        scale = offset = None
+        base = self.base
+        if base is not None and (base is obj or base is getattr(obj, 'base', None)):
+            scale = getattr(obj, 'scale', None)
+            offset = getattr(obj, 'offset', None)
+            if (np.ndim(scale) > 0 and
+                    (getattr(obj, 'shape', None) != self.shape or getattr(obj, 'strides', None) != self.strides)):
+                # per-slice scaling can't follow reshapes or transposes;
+                # indexing (see __getitem__) takes it along
+                scale = offset = _LOST_SCALING
+        self.scale = scale
+        self.offset = offset
+
+    def __getitem__(self, index):
+        result = super(HyperSlab, self).__getitem__(index)
+        if isinstance(result, HyperSlab) and self.scale is not None:
+            if np.ndim(self.scale) > 0:
+                # select the per-slice scale and offset of the selected voxels
+                result.scale = np.broadcast_to(self.scale, self.shape)[index]
+                result.offset = np.broadcast_to(self.offset, self.shape)[index]
+            else:
+                # fancy indexing copies, but the values are still stored values
+                result.scale, result.offset = self.scale, self.offset
+        return result
+
+    def real_values(self, dtype=np.float64):
+        """
+        the real values of a hyperslab holding stored voxel values (see dtype="native"
+        in mincVolume.getHyperslab), computed on demand; other hyperslabs already
+        hold real values and are returned unchanged
+        """
+        if self.scale is None:
+            return self
+        if self.scale is _LOST_SCALING:
+            raise ValueError("this array was derived from a slice scaled hyperslab in a way that loses "
+                             "the per-slice scaling; index the hyperslab or call real_values() first")
+        real = HyperSlab(np.asarray(self, dtype=dtype) * self.scale + self.offset,
+                         start=self.start, separations=self.separations,
+                         count=self.count, dimnames=self.dimnames)
+        real.scale = real.offset = None
+        return real
 
     def __repr__(self):
         desc = """
@@ -48,3 +95,31 @@ class HyperSlab(np.ndarray):
         separations=%(seps)s, dimnames=%(dims)s"""
         return desc % {'data': str(self), 'start': self.start, 'count': self.count,
                        'seps': self.separations, 'dims': self.dimnames}
+
+
+class HyperslabPool(object):
+    """
+    a pool of reusable output buffers for mincVolume.getHyperslab, keyed on
+    (count, dtype). Asking twice for the same shape and type returns the same
+    array, so a loop reading many equally shaped hyperslabs allocates only once;
+    the flip side is that each result is overwritten by the next read of the
+    same shape.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, count, dtype):
+        """return the buffer for hyperslabs of shape count and numpy type dtype"""
+        key = (tuple(int(c) for c in count), np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = np.empty(key[0], dtype=key[1])
+            self._buffers[key] = buf
+        return buf
+
+    def clear(self):
+        """release all buffers"""
+        self._buffers.clear()
+
+    def __len__(self):
+        return len(self._buffers)
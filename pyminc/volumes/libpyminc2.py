@@ -3,7 +3,7 @@
 from ctypes import (cdll,
                     c_byte, c_double, c_float, c_int, c_short,
                     c_ubyte, c_uint, c_ulong, c_ulonglong, c_ushort,
-                    c_char_p, c_void_p, POINTER, Structure)
+                    c_char_p, c_longlong, c_size_t, c_void_p, POINTER, Structure)
 import locale
 import sys
 import os
@@ -80,6 +80,9 @@ MI_DIMORDER_APPARENT = c_int(0)
 MI2_OPEN_READ = c_int(1)
 MI2_OPEN_RDWR = c_int(2)
 
+# the deepest lower resolution level of an image (/minc-2.0/image/<level>)
+MI2_MAX_RESOLUTION_GROUP = 16
+
 MI_CLASS_REAL = c_int(0)
 
 MI_TYPE_ORIGINAL = c_int(0)     # < MI_ORIGINAL_TYPE
@@ -106,6 +109,7 @@ mitype_t = c_int
 # opaque minc structs can be represented as pointers
 mihandle = c_void_p
 midimhandle = c_void_p
+mivolumeprops = c_void_p
 
 # some type information
 dimensions = c_void_p * 5
@@ -141,6 +145,10 @@ c_stringy = c_py3_unicode_p
 
 MI_ROOT_PATH_FOR_IMAGE_ATTR = c_stringy("/minc-2.0/image/0/image")
 
+# micompression_t
+MI_COMPRESS_NONE = 0
+MI_COMPRESS_ZLIB = 1
+
 
 # python declaration of the VIO_Transform struct
 class Transform(Structure):
@@ -191,12 +199,21 @@ libminc.micopy_dimension.argtypes = [c_void_p, POINTER(c_void_p)]
 libminc.micreate_volume.argtypes = [c_stringy, c_int, dimensions, c_int, c_int,
                                     c_void_p, POINTER(mihandle)]
 libminc.micreate_volume_image.argtypes = [mihandle]
+libminc.minew_volume_props.argtypes = [POINTER(mivolumeprops)]
+libminc.mifree_volume_props.argtypes = [mivolumeprops]
+libminc.miset_props_compression_type.argtypes = [mivolumeprops, c_int]
+libminc.miset_props_zlib_compression.argtypes = [mivolumeprops, c_int]
+libminc.miset_props_blocking.argtypes = [mivolumeprops, c_int, POINTER(c_int)]
+libminc.miset_props_multi_resolution.argtypes = [mivolumeprops, mibool, c_int]
+libminc.miselect_resolution.argtypes = [mihandle, c_int]
 libminc.miset_volume_valid_range.argtypes = [mihandle, c_double, c_double]
 libminc.miget_volume_valid_range.argtypes = [mihandle, POINTER(c_double), POINTER(c_double)]
 libminc.miset_volume_range.argtypes = [mihandle, c_double, c_double]
 libminc.miget_volume_range.argtypes = [mihandle, POINTER(c_double), POINTER(c_double)]
 libminc.miget_slice_scaling_flag.argtypes = [mihandle, POINTER(mibool)]
 libminc.miset_slice_scaling_flag.argtypes = [mihandle, mibool]
+libminc.miget_slice_range.argtypes = [mihandle, misize_t_sizes, c_size_t, POINTER(c_double), POINTER(c_double)]
+libminc.miset_slice_range.argtypes = [mihandle, misize_t_sizes, c_size_t, c_double, c_double]
 #libminc.miset_real_value_hyperslab.argtypes = [mihandle, c_int, misize_t_sizes,
 #                                               misize_t_sizes, POINTER(c_double)]
 libminc.miclose_volume.argtypes = [mihandle]
@@ -211,6 +228,7 @@ libminc.miset_dimension_start.argtypes = [c_void_p, c_double]
 libminc.miadd_history_attr.argtypes = [mihandle, c_uint, c_void_p]
 # retrieve history of file to append to history of new file
 libminc.miget_attr_values.argtypes = [mihandle, c_int, c_stringy, c_stringy, c_uint, c_void_p]
+libminc.miget_attr_length.argtypes = [mihandle, c_stringy, c_stringy, POINTER(misize_t)]
 # apparent dimension order
 libminc.miset_apparent_dimension_order_by_name.argtypes = [mihandle, c_int, POINTER(c_stringy)]
 # copying attributes in path from one file to another
@@ -247,3 +265,71 @@ libminc.transform_vector.argtypes = [POINTER(Transform), c_double, c_double, c_d
 
 libminc.get_linear_transform_ptr.argtypes = [POINTER(GeneralTransform)]
 libminc.get_linear_transform_ptr.restype = POINTER(Transform)
+
+# VIO_Transform_types, as returned by get_transform_type
+LINEAR_TRANSFORM = 0
+THIN_PLATE_SPLINE_TRANSFORM = 1
+USER_TRANSFORM = 2
+CONCATENATED_TRANSFORM = 3
+GRID_TRANSFORM = 4
+
+libminc.get_transform_type.argtypes = [POINTER(GeneralTransform)]
+libminc.get_transform_type.restype = c_int
+libminc.get_n_concated_transforms.argtypes = [POINTER(GeneralTransform)]
+libminc.get_n_concated_transforms.restype = c_int
+libminc.get_nth_general_transform.argtypes = [POINTER(GeneralTransform), c_int]
+libminc.get_nth_general_transform.restype = POINTER(GeneralTransform)
+
+# a few HDF5 functions, used to find where uncompressed image data lives in a file
+# so it can be memory mapped, and how compressed image data is chunked. They are
+# resolved through libminc's own HDF5; if libminc doesn't make them available, the
+# memory mapping fast path and chunk aligned reads are disabled.
+H5P_DEFAULT = 0
+H5F_ACC_RDONLY = 0
+H5D_CONTIGUOUS = 1
+H5D_CHUNKED = 2
+H5T_ORDER_LE = 0
+H5T_ORDER_BE = 1
+HADDR_UNDEF = c_ulonglong(-1).value
+
+try:
+    _h5_major, _h5_minor, _h5_release = c_uint(), c_uint(), c_uint()
+    libminc.H5get_libversion.argtypes = [POINTER(c_uint), POINTER(c_uint), POINTER(c_uint)]
+    libminc.H5get_libversion(_h5_major, _h5_minor, _h5_release)
+    # hid_t became 64 bits wide in HDF5 1.10
+    hid_t = c_longlong if (_h5_major.value, _h5_minor.value) >= (1, 10) else c_int
+    libminc.H5Fopen.argtypes = [c_stringy, c_uint, hid_t]
+    libminc.H5Fopen.restype = hid_t
+    libminc.H5Fclose.argtypes = [hid_t]
+    libminc.H5Dopen2.argtypes = [hid_t, c_stringy, hid_t]
+    libminc.H5Dopen2.restype = hid_t
+    libminc.H5Dclose.argtypes = [hid_t]
+    libminc.H5Dget_offset.argtypes = [hid_t]
+    libminc.H5Dget_offset.restype = c_ulonglong
+    libminc.H5Dget_create_plist.argtypes = [hid_t]
+    libminc.H5Dget_create_plist.restype = hid_t
+    libminc.H5Dget_type.argtypes = [hid_t]
+    libminc.H5Dget_type.restype = hid_t
+    libminc.H5Pget_layout.argtypes = [hid_t]
+    libminc.H5Pget_nfilters.argtypes = [hid_t]
+    libminc.H5Pget_chunk.argtypes = [hid_t, c_int, POINTER(c_ulonglong)]
+    libminc.H5Pclose.argtypes = [hid_t]
+    libminc.H5Tget_order.argtypes = [hid_t]
+    libminc.H5Tget_size.argtypes = [hid_t]
+    libminc.H5Tget_size.restype = c_size_t
+    libminc.H5Tclose.argtypes = [hid_t]
+    hdf5_available = True
+except AttributeError:
+    hdf5_available = False
+
+# whether the HDF5 under libminc may be called from several threads at once;
+# hbool_t is a bool or an unsigned int depending on the HDF5 version
+_threadsafe = c_uint(0)
+try:
+    libminc.H5is_library_threadsafe.argtypes = [POINTER(c_uint)]
+    libminc.H5is_library_threadsafe.restype = c_int
+    hdf5_threadsafe = (libminc.H5is_library_threadsafe(_threadsafe) >= 0
+                       and _threadsafe.value != 0)
+except AttributeError:
+    # older HDF5 releases can't tell, so assume they aren't
+    hdf5_threadsafe = False
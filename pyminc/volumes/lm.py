@@ -0,0 +1,133 @@
+"""mass-univariate linear models: the same design fitted at every voxel of a cohort"""
+
+import numpy as numpy
+
+from .cohort import check_geometry, iter_cohort_slabs, _chunkEdge
+from .factory import scan_headers, volumeLikeFile
+from .parallel import can_fork, partition, run_parallel, shared_array, worker_arrays
+
+
+class LinearModel(object):
+    """
+    ordinary least squares fits of one design matrix (subjects by columns) to
+    many response vectors at once. The pseudo-inverse of the design is computed
+    once; fitting a block of voxels is then a single matrix product.
+
+    If the design has a constant column the F-statistic and R^2 are those of the
+    model against the intercept only model (as reported by RMINC's mincLm),
+    otherwise against the empty model.
+    """
+
+    def __init__(self, design):
+        design = numpy.asarray(design, dtype=numpy.float64)
+        if design.ndim == 1:
+            design = design[:, numpy.newaxis]
+        self.design = design
+        self.pinv = numpy.linalg.pinv(design)
+        self.rank = numpy.linalg.matrix_rank(design)
+        self.df = design.shape[0] - self.rank
+        if self.df <= 0:
+            raise ValueError("a design with %d subjects and rank %d leaves no residual degrees of freedom"
+                             % (design.shape[0], self.rank))
+        # the diagonal of (X'X)^-1, i.e. the variance of each beta divided by sigma^2
+        self.unscaled_variance = numpy.einsum("ij,ij->i", self.pinv, self.pinv)
+        self.intercept = bool(numpy.any(numpy.all(design == design[0], axis=0) & (design[0] != 0)))
+        self.df_model = self.rank - 1 if self.intercept else self.rank
+
+    @property
+    def columns(self):
+        return self.design.shape[1]
+
+    def fit(self, responses):
+        """
+        fits responses, an array whose first dimension has one entry per subject;
+        returns a dictionary with "beta" and "tvalue" (columns by voxels) and "F"
+        and "R2" (voxels), where voxels is the shape of the remaining dimensions.
+        Statistics that are undefined, e.g. at voxels which are constant across
+        subjects, are 0.
+        """
+        responses = numpy.asarray(responses, dtype=numpy.float64)
+        shape = responses.shape[1:]
+        y = responses.reshape(responses.shape[0], -1)
+        beta = self.pinv @ y
+        residuals = y - self.design @ beta
+        sse = numpy.einsum("ij,ij->j", residuals, residuals)
+        if self.intercept:
+            y = y - y.mean(axis=0)
+        sst = numpy.einsum("ij,ij->j", y, y)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            sigma2 = sse / self.df
+            tvalue = beta / numpy.sqrt(numpy.outer(self.unscaled_variance, sigma2))
+            r2 = 1 - sse / sst
+            if self.df_model > 0:
+                f = (sst - sse) / self.df_model / sigma2
+            else:
+                f = numpy.zeros_like(sse)
+        results = {"beta": beta, "tvalue": tvalue, "F": f, "R2": r2}
+        for name, value in results.items():
+            value[~numpy.isfinite(value)] = 0
+            results[name] = value.reshape(value.shape[:-1] + shape)
+        return results
+
+
+def _fitSlabs(model, filenames, slab_size, results, begin=0, end=None):
+    for start, count, slabs in iter_cohort_slabs(filenames, slab_size, "double", begin, end):
+        region = tuple(slice(b, b + c) for b, c in zip(start, count))
+        for name, value in model.fit(slabs).items():
+            results[name][(Ellipsis,) + region] = value
+
+
+def _lmPartition(model, filenames, slab_size, offset, length):
+    """worker for voxel_lm: one block of the slowest-varying dimension"""
+    beta, tvalue, f, r2 = worker_arrays()
+    _fitSlabs(model, filenames, slab_size, {"beta": beta, "tvalue": tvalue, "F": f, "R2": r2},
+              offset, offset + length)
+
+
+def voxel_lm(filenames, design, output_prefix=None, names=None, volumeType="float",
+             slab_size=None, workers=None, cache=None):
+    """
+    fits the linear model given by design (one row per file) at every voxel of the
+    files, which need to have the same geometry.
+
+    The files are read in lockstep in slabs of slab_size slices (see
+    iter_cohort_slabs) and all voxels of a slab are solved together; with
+    workers > 1 blocks of slabs are fitted by that many forked processes.
+
+    Returns a dictionary of arrays: "beta" and "tvalue" with one volume per column
+    of the design, "F" and "R2" (see LinearModel). With an output_prefix they are
+    also written, like the first file, to <prefix>_beta-<name>.mnc,
+    <prefix>_tvalue-<name>.mnc, <prefix>_F.mnc and <prefix>_R2.mnc, where the
+    column names default to their index.
+    """
+    model = LinearModel(design)
+    if model.design.shape[0] != len(filenames):
+        raise ValueError("the design has %d rows for %d files" % (model.design.shape[0], len(filenames)))
+    names = names or [str(j) for j in range(model.columns)]
+    if len(names) != model.columns:
+        raise ValueError("expected %d column names, got %d" % (model.columns, len(names)))
+    sizes = check_geometry(scan_headers(filenames, cache=cache))["sizes"]
+    parallel = workers is not None and workers > 1 and can_fork()
+    allocate = shared_array if parallel else numpy.empty
+    results = {"beta": allocate([model.columns] + sizes, numpy.float64),
+               "tvalue": allocate([model.columns] + sizes, numpy.float64),
+               "F": allocate(sizes, numpy.float64),
+               "R2": allocate(sizes, numpy.float64)}
+    if parallel:
+        tasks = [(model, filenames, slab_size, offset, length)
+                 for offset, length in partition(sizes[0], workers, _chunkEdge(filenames[0]))]
+        run_parallel(_lmPartition, tasks, workers,
+                     shared=(results["beta"], results["tvalue"], results["F"], results["R2"]))
+    else:
+        _fitSlabs(model, filenames, slab_size, results)
+    if output_prefix:
+        outputs = [("%s_F.mnc" % output_prefix, results["F"]), ("%s_R2.mnc" % output_prefix, results["R2"])]
+        for j, name in enumerate(names):
+            outputs.append(("%s_beta-%s.mnc" % (output_prefix, name), results["beta"][j]))
+            outputs.append(("%s_tvalue-%s.mnc" % (output_prefix, name), results["tvalue"][j]))
+        for outputFilename, data in outputs:
+            v = volumeLikeFile(filenames[0], outputFilename, volumeType=volumeType)
+            v.data = data
+            v.writeFile()
+            v.closeVolume()
+    return results
@@ -0,0 +1,72 @@
+"""process-based parallel reading
+
+HDF5, and therefore libminc, can't decompress with more than one core within a
+single process: thread-safe builds serialise every call behind a global lock and
+other builds must not be called from several threads at all. Parallel reads
+therefore use forked worker processes, each opening its own read-only handle and
+writing straight into anonymous shared memory inherited from the parent, so
+nothing has to be pickled back.
+"""
+
+import mmap
+import multiprocessing
+import operator
+from functools import reduce
+
+import numpy as numpy
+
+# arrays shared with the current worker process, set by the pool initializer
+_worker_arrays = ()
+
+
+def can_fork():
+    """whether worker processes can inherit shared memory from this process"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def shared_array(shape, dtype):
+    """allocate an array in anonymous memory that is shared with forked workers"""
+    dtype = numpy.dtype(dtype)
+    length = reduce(operator.mul, shape, 1)
+    buf = mmap.mmap(-1, max(1, length * dtype.itemsize))
+    return numpy.frombuffer(buf, dtype=dtype, count=length).reshape(shape)
+
+
+def partition(size, parts, align=1):
+    """
+    split range(size) into at most `parts` contiguous (offset, length) blocks of
+    near-equal length, all starting at multiples of align (e.g. a chunk edge, so
+    that no two blocks share a chunk)
+    """
+    units = -(-size // align)
+    parts = max(1, min(parts, units))
+    base, extra = divmod(units, parts)
+    blocks = []
+    offset = 0
+    for i in range(parts):
+        length = min((base + (1 if i < extra else 0)) * align, size - offset)
+        blocks.append((offset, length))
+        offset += length
+    return blocks
+
+
+def _initWorker(arrays):
+    global _worker_arrays
+    _worker_arrays = arrays
+
+
+def worker_arrays():
+    """the shared arrays passed to run_parallel, as seen from inside a worker"""
+    return _worker_arrays
+
+
+def run_parallel(func, tasks, workers, shared=()):
+    """
+    call func(*task) for every task in a pool of `workers` forked processes and
+    return the results in order. Arrays created with shared_array and passed as
+    `shared` are available (writable, without copying) to func via worker_arrays().
+    """
+    context = multiprocessing.get_context("fork")
+    with context.Pool(min(workers, len(tasks)) or 1, initializer=_initWorker,
+                      initargs=(tuple(shared),)) as pool:
+        return pool.starmap(func, tasks)
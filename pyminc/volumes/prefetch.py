@@ -0,0 +1,135 @@
+"""background prefetching of hyperslabs"""
+
+import queue
+import threading
+import time
+import weakref
+
+
+class _PrefetchState(object):
+    """what the worker thread shares with its SlabPrefetcher; holds no reference to the prefetcher"""
+
+    def __init__(self, volume, extents, dtype, depth):
+        self.volume = volume
+        self.extents = extents
+        self.dtype = dtype
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.read_time = 0.0
+
+    def put(self, item):
+        # don't block forever on a full queue once the caller has given up
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+def _prefetchWorker(state, done):
+    try:
+        for start, count in state.extents:
+            if state.stop.is_set():
+                return
+            t0 = time.perf_counter()
+            slab = state.volume.getHyperslab(start, count, state.dtype)
+            state.read_time += time.perf_counter() - t0
+            if not state.put(slab):
+                return
+    except BaseException as e:
+        state.put(e)
+        return
+    state.put(done)
+
+
+def _stopWorker(state, thread):
+    """stops the worker thread and waits for its current read to finish"""
+    state.stop.set()
+    if thread is not threading.current_thread():
+        thread.join()
+    # the volume may be closed (or collected) from now on
+    state.volume = None
+
+
+class SlabPrefetcher(object):
+    """
+    iterates over (start, count) extents of a mincVolume, reading up to `depth`
+    hyperslabs ahead in a worker thread. ctypes releases the GIL while libminc
+    reads and decompresses, so the read of slab k+1 overlaps with whatever the
+    caller does with slab k.
+
+    HDF5 builds that aren't thread-safe must not be called from two threads at
+    once, so while the worker is reading no libminc (or HDF5) function may be
+    called from any other thread of the process, on any volume, until iteration
+    has finished or close() has been called. Only the caller's numpy processing
+    of the slabs overlaps with the reads.
+
+    The worker is stopped (and waited for) when iteration ends, on close(), when
+    the volume is closed, and when the prefetcher is abandoned and collected.
+
+    After (or during) iteration the following timings are available, in seconds:
+      read_time -- time the worker spent inside getHyperslab
+      wait_time -- time the caller spent blocked waiting for a slab
+      overlap   -- fraction of read_time hidden behind the caller's processing
+    """
+
+    _done = object()
+
+    def __init__(self, volume, extents, dtype=None, depth=2):
+        if depth < 1:
+            raise ValueError("prefetch depth must be at least 1, got %s" % depth)
+        self.dtype = dtype
+        self.depth = depth
+        self.wait_time = 0.0
+        self.slabs = 0
+        self._state = _PrefetchState(volume, extents, dtype, depth)
+        thread = threading.Thread(target=_prefetchWorker, args=(self._state, self._done), daemon=True)
+        self._thread = thread
+        self._finalizer = weakref.finalize(self, _stopWorker, self._state, thread)
+        volume._prefetchers.add(self)
+        thread.start()
+
+    @property
+    def read_time(self):
+        return self._state.read_time
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._state.stop.is_set():
+            raise StopIteration
+        t0 = time.perf_counter()
+        item = self._state.queue.get()
+        self.wait_time += time.perf_counter() - t0
+        if item is self._done:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+        self.slabs += 1
+        return item
+
+    @property
+    def overlap(self):
+        """fraction of the worker's read time that was hidden from the caller"""
+        if self.read_time == 0:
+            return 0.0
+        return max(0.0, min(1.0, 1.0 - self.wait_time / self.read_time))
+
+    def close(self):
+        """stop prefetching and wait for the worker thread to finish"""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return ("SlabPrefetcher(depth=%d, slabs=%d, read_time=%.3fs, wait_time=%.3fs, overlap=%.0f%%)"
+                % (self.depth, self.slabs, self.read_time, self.wait_time, 100 * self.overlap))
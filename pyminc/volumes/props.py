@@ -0,0 +1,60 @@
+"""creation properties (compression, chunking, resolution levels) of new volumes"""
+
+from ctypes import byref, c_int
+
+from .libpyminc2 import (libminc, mibool, mivolumeprops,
+                         MI_COMPRESS_NONE, MI_COMPRESS_ZLIB)
+from .volumes import testMincReturn
+
+
+class VolumeProps(object):
+    """
+    the properties libminc creates a new volume with, passed to createVolumeHandle
+    and the factories as props:
+
+      compression      -- "zlib" (libminc's default) or None for an uncompressed
+                          image, which is faster to write and can be memory mapped
+      zlib_level       -- 1 (fastest) to 9 (smallest), None for libminc's default
+      chunks           -- HDF5 chunk edge lengths, one per dimension (in the order
+                          of the dimensions), or None for libminc's default
+      multi_resolution -- number of extra, lower resolution, levels to allocate
+
+    For example VolumeProps(compression=None) for scratch files, or
+    VolumeProps(zlib_level=1, chunks=(32, 32, 32)).
+    """
+
+    def __init__(self, compression="zlib", zlib_level=None, chunks=None, multi_resolution=0):
+        if compression not in ["zlib", None]:
+            raise ValueError("compression has to be \"zlib\" or None, got %s" % compression)
+        if zlib_level is not None and not 0 <= zlib_level <= 9:
+            raise ValueError("zlib_level has to be between 0 and 9, got %s" % zlib_level)
+        if zlib_level and compression is None:
+            raise ValueError("a zlib_level can't be used without compression")
+        self.compression = compression
+        self.zlib_level = zlib_level
+        self.chunks = None if chunks is None else tuple(int(c) for c in chunks)
+        self.multi_resolution = multi_resolution
+        self.handle = mivolumeprops()
+        testMincReturn(libminc.minew_volume_props(byref(self.handle)))
+        testMincReturn(libminc.miset_props_compression_type(
+            self.handle, MI_COMPRESS_ZLIB if compression == "zlib" else MI_COMPRESS_NONE))
+        if zlib_level is not None:
+            testMincReturn(libminc.miset_props_zlib_compression(self.handle, zlib_level))
+        if self.chunks is not None:
+            edges = (c_int * len(self.chunks))(*self.chunks)
+            testMincReturn(libminc.miset_props_blocking(self.handle, len(self.chunks), edges))
+        if multi_resolution:
+            testMincReturn(libminc.miset_props_multi_resolution(self.handle, mibool(1), multi_resolution))
+
+    def free(self):
+        """release the libminc properties object"""
+        if self.handle is not None:
+            libminc.mifree_volume_props(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self.free()
+
+    def __repr__(self):
+        return ("VolumeProps(compression=%r, zlib_level=%r, chunks=%r, multi_resolution=%r)"
+                % (self.compression, self.zlib_level, self.chunks, self.multi_resolution))
@@ -0,0 +1,115 @@
+"""voxel-wise summary statistics over many files, streamed slab by slab"""
+
+import numpy as numpy
+
+from .cohort import check_geometry, iter_cohort_slabs, _chunkEdge
+from .factory import scan_headers, volumeLikeFile
+from .parallel import can_fork, partition, run_parallel, shared_array, worker_arrays
+
+
+class RunningMoments(object):
+    """
+    weighted running mean and variance of equally shaped arrays, accumulated in
+    float64 one array at a time with the weighted form of Welford's update
+    (West 1979). Two accumulators can be combined with merge (Chan et al. 1979).
+    Non-finite values are skipped; count holds the number of values that
+    contributed to each element and weight their total weight.
+    """
+
+    def __init__(self, shape):
+        self.count = numpy.zeros(shape, dtype=numpy.int64)
+        self.weight = numpy.zeros(shape, dtype=numpy.float64)
+        self.mean = numpy.zeros(shape, dtype=numpy.float64)
+        self.m2 = numpy.zeros(shape, dtype=numpy.float64)
+
+    def update(self, x, weight=1.0):
+        """add the array x with the given (non-negative) weight"""
+        if weight == 0:
+            return
+        x = numpy.asarray(x, dtype=numpy.float64)
+        valid = numpy.isfinite(x)
+        w = numpy.where(valid, float(weight), 0.0)
+        x = numpy.where(valid, x, 0.0)
+        new_weight = self.weight + w
+        delta = x - self.mean
+        self.mean += delta * numpy.divide(w, new_weight, out=numpy.zeros_like(w), where=new_weight > 0)
+        self.m2 += w * delta * (x - self.mean)
+        self.weight = new_weight
+        self.count += valid
+
+    def merge(self, other):
+        """combine with the moments of another, disjoint, set of arrays"""
+        weight = self.weight + other.weight
+        delta = other.mean - self.mean
+        ratio = numpy.divide(other.weight, weight, out=numpy.zeros_like(weight), where=weight > 0)
+        self.mean += delta * ratio
+        self.m2 += other.m2 + delta ** 2 * self.weight * ratio
+        self.weight = weight
+        self.count += other.count
+
+    def variance(self, ddof=1):
+        """the variance, treating the weights as frequencies; 0 where weight <= ddof"""
+        denominator = self.weight - ddof
+        return numpy.divide(self.m2, denominator, out=numpy.zeros_like(self.m2), where=denominator > 0)
+
+    def sd(self, ddof=1):
+        """the standard deviation (see variance)"""
+        return numpy.sqrt(numpy.maximum(self.variance(ddof), 0))
+
+
+def _accumulate(mean, sd, count, filenames, weights, ddof, slab_size, begin=0, end=None):
+    for start, extent, slabs in iter_cohort_slabs(filenames, slab_size, "double", begin, end):
+        moments = RunningMoments(extent)
+        for i in range(len(filenames)):
+            moments.update(slabs[i], 1.0 if weights is None else weights[i])
+        region = tuple(slice(b, b + c) for b, c in zip(start, extent))
+        mean[region] = moments.mean
+        sd[region] = moments.sd(ddof)
+        count[region] = moments.count
+
+
+def _statsPartition(filenames, weights, ddof, slab_size, offset, length):
+    """worker for voxel_stats: one block of the slowest-varying dimension"""
+    mean, sd, count = worker_arrays()
+    _accumulate(mean, sd, count, filenames, weights, ddof, slab_size, offset, offset + length)
+
+
+def voxel_stats(filenames, weights=None, mean=None, sd=None, count=None, volumeType="float",
+                ddof=1, slab_size=None, workers=None, cache=None):
+    """
+    computes the voxel-wise (optionally weighted) mean and standard deviation, and
+    the number of finite values, of files with the same geometry.
+
+    The files are read in lockstep one slab at a time (see iter_cohort_slabs), so
+    only about one slab per file is in memory; with workers > 1 blocks of slabs
+    are processed by that many forked processes. Weights are frequency weights:
+    the variance is sum(w * (x - mean)**2) / (sum(w) - ddof).
+
+    mean, sd and count are optional output filenames; the volumes are created like
+    the first input file with the given volumeType. Returns the mean, sd and
+    count arrays.
+    """
+    if len(filenames) == 0:
+        raise ValueError("voxel_stats needs at least one file")
+    if weights is not None:
+        weights = [float(w) for w in weights]
+        if len(weights) != len(filenames) or min(weights) < 0:
+            raise ValueError("expected %d non-negative weights, got %s" % (len(filenames), weights))
+    header = check_geometry(scan_headers(filenames, cache=cache))
+    sizes = header["sizes"]
+    parallel = workers is not None and workers > 1 and can_fork()
+    allocate = shared_array if parallel else numpy.empty
+    results = (allocate(sizes, numpy.float64), allocate(sizes, numpy.float64), allocate(sizes, numpy.int64))
+    if parallel:
+        tasks = [(filenames, weights, ddof, slab_size, offset, length)
+                 for offset, length in partition(sizes[0], workers, _chunkEdge(filenames[0]))]
+        run_parallel(_statsPartition, tasks, workers, shared=results)
+    else:
+        _accumulate(*results, filenames, weights, ddof, slab_size)
+    for outputFilename, data in zip((mean, sd, count), results):
+        if outputFilename:
+            v = volumeLikeFile(filenames[0], outputFilename, volumeType=volumeType)
+            v.data = data
+            v.writeFile()
+            v.closeVolume()
+    return results
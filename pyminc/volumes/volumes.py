@@ -1,5 +1,5 @@
-from ctypes import (byref,
-                    c_double, c_int,
+from ctypes import (byref, pointer,
+                    c_double, c_int, c_ulonglong,
                     c_char_p, c_void_p,
                     POINTER, create_string_buffer)
 from .libpyminc2 import (c_stringy,
@@ -11,18 +11,33 @@ from .libpyminc2 import (c_stringy,
                          MI_DIMATTR_ALL, MI_DIMCLASS_ANY,
                          MI_DIMORDER_APPARENT,
                          voxel_coord, world_coord, MI_CLASS_REAL, MI2_OPEN_RDWR, MI2_OPEN_READ, MI_DIMCLASS_SPATIAL,
+                         MI2_MAX_RESOLUTION_GROUP,
                          MI_DIMCLASS_RECORD, MI_DIMATTR_REGULARLY_SAMPLED, int_sizes, MI_ROOT_PATH_FOR_IMAGE_ATTR,
-                         dimensions, double_sizes, encoding, c_py3_unicode_p)
-from .hyperslab import HyperSlab
+                         dimensions, double_sizes, encoding, c_py3_unicode_p,
+                         hdf5_available, H5D_CHUNKED, H5D_CONTIGUOUS, H5F_ACC_RDONLY, H5P_DEFAULT,
+                         H5T_ORDER_BE, H5T_ORDER_LE, HADDR_UNDEF,
+                         LINEAR_TRANSFORM, CONCATENATED_TRANSFORM)
+from .chunks import ReadStats
+from .hyperslab import HyperSlab, HyperslabPool
+from .parallel import can_fork, partition, run_parallel, shared_array, worker_arrays
+from .prefetch import SlabPrefetcher
 import operator
 import os
 import sys
 import datetime as datetime
-from functools import reduce
+from functools import lru_cache, reduce
 import subprocess
+import weakref
 import numpy as numpy
 
 
+# the amount of data read at a time by operations that stream a volume in slabs
+DEFAULT_SLAB_BYTES = 64 * 2**20
+# elements per block when finding the minimum and maximum of an array; small enough
+# for a block to still be in cache when its maximum is taken after its minimum
+MINMAX_BLOCK = 2**15
+
+
 class mincException(Exception): pass
 class NoDataException(Exception): pass
 class IncorrectDimsException(Exception): pass
@@ -30,6 +45,7 @@ class NoDataTypeException(Exception): pass
 class mincTypeNotDetermined(Exception): pass
 class volumeTypeNotDetermined(Exception): pass
 class directionCosinesNotDetermined(Exception): pass
+class GeometryMismatchException(Exception): pass
 
 
 def testMincReturn(value):
@@ -47,44 +63,131 @@ def getDtype(data):
     return dtype
 
 
+class XfmTransform(object):
+    """
+    a transformation read once from an .xfm file, for transforming many points.
+
+    The transformation is split into stages: runs of linear transforms (also
+    those concatenated with each other) are multiplied into one 4x4 matrix and
+    applied to all points with numpy, only nonlinear transforms (grids, thin
+    plate splines) are applied by libminc point by point. linear is True (and
+    matrix the 4x4 matrix) if there are no nonlinear transforms at all.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._transform = GeneralTransform()
+        testMincReturn(libminc.input_transform_file(filename, self._transform))
+        self._loaded = True
+        stages = []
+        for stage in self._split(pointer(self._transform)):
+            if isinstance(stage, numpy.ndarray) and stages and isinstance(stages[-1], numpy.ndarray):
+                stages[-1] = stage @ stages[-1]
+            else:
+                stages.append(stage)
+        self._stages = stages
+        self._inverse_stages = self._invert(stages)
+        self.linear = all(isinstance(stage, numpy.ndarray) for stage in stages)
+        self.matrix = None
+        if self.linear:
+            self.matrix = stages[0] if stages else numpy.eye(4)
+
+    def _split(self, transform):
+        """
+        the stages of a transform: a 4x4 matrix for a linear transform, or a
+        (transform, inverse) pair for libminc to apply
+        """
+        kind = libminc.get_transform_type(transform)
+        if kind == LINEAR_TRANSFORM:
+            # takes the inverse flag into account; VIO stores the transpose of the matrix
+            m = libminc.get_linear_transform_ptr(transform).contents.m
+            return [numpy.array([row[:] for row in m]).T]
+        if kind == CONCATENATED_TRANSFORM:
+            stages = []
+            for i in range(libminc.get_n_concated_transforms(transform)):
+                stages += self._split(libminc.get_nth_general_transform(transform, i))
+            return self._invert(stages) if transform.contents.inverse_flag else stages
+        return [(transform, False)]
+
+    @staticmethod
+    def _invert(stages):
+        """the stages of the inverse transformation"""
+        inverse = []
+        for stage in reversed(stages):
+            if isinstance(stage, numpy.ndarray):
+                inverse.append(numpy.linalg.inv(stage))
+            else:
+                inverse.append((stage[0], not stage[1]))
+        return inverse
+
+    def transform(self, points, inverse=False):
+        """
+        transforms points, an (N, 3) array of world coordinates (or a single
+        point), returning an array of the same shape
+        """
+        points = numpy.asarray(points, dtype=numpy.float64)
+        if points.shape[-1:] != (3,):
+            raise ValueError("expected points with 3 coordinates, got an array of shape %s" % (points.shape,))
+        if not self._loaded:
+            raise ValueError("the transformation from %s has been closed" % self.filename)
+        shape = points.shape
+        points = points.reshape(-1, 3)
+        for stage in (self._inverse_stages if inverse else self._stages):
+            if isinstance(stage, numpy.ndarray):
+                points = points @ stage[:3, :3].T + stage[:3, 3]
+            else:
+                points = self._libmincTransform(points, *stage)
+        return points.reshape(shape)
+
+    @staticmethod
+    def _libmincTransform(points, transform, inverse):
+        apply_point = libminc.general_inverse_transform_point if inverse else libminc.general_transform_point
+        result = numpy.empty_like(points)
+        new_x, new_y, new_z = c_double(), c_double(), c_double()
+        for i, (x, y, z) in enumerate(points.tolist()):
+            testMincReturn(apply_point(transform, x, y, z, byref(new_x), byref(new_y), byref(new_z)))
+            result[i] = new_x.value, new_y.value, new_z.value
+        return result
+
+    def close(self):
+        """release the transformation read by libminc"""
+        if self._loaded:
+            libminc.delete_general_transform(self._transform)
+            self._loaded = False
+
+    def __del__(self):
+        if getattr(self, "_loaded", False):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@lru_cache(maxsize=16)
+def _cachedXfm(path, mtime_ns, size):
+    return XfmTransform(path)
+
+
+def _loadXfm(xfm_filename):
+    """an XfmTransform for a file, only read again once the file has changed"""
+    stat = os.stat(xfm_filename)
+    return _cachedXfm(os.path.abspath(xfm_filename), stat.st_mtime_ns, stat.st_size)
+
+
 def transform_multiple_xyz_coordinates_using_xfm(xfm_filename, x_coor, y_coor, z_coor, use_inverse=False):
     # make sure we have the same number of input coordinates for x y and z
     if len(x_coor) != len(y_coor) or len(y_coor) != len(z_coor):
         raise ValueError("The function transform_multiple_xyz_coordinates_using_xfm was provided with incorrect coordinate data. The length of the lists differ.")
-
-    # read the transformation file
-    handle_for_transform = GeneralTransform()
-    r = libminc.input_transform_file(xfm_filename, handle_for_transform)
-    testMincReturn(r)
-
-    # return arrays
-    ret_x = []
-    ret_y = []
-    ret_z = []
-
-    # holders for the transformed coordinates
-    new_x = c_double()
-    new_y = c_double()
-    new_z = c_double()
-
-    for i in range(len(x_coor)):
-        if use_inverse:
-            r = libminc.general_inverse_transform_point(handle_for_transform,
-                                                        c_double(x_coor[i]), c_double(y_coor[i]), c_double(z_coor[i]),
-                                                        byref(new_x), byref(new_y), byref(new_z))
-        else:
-            r = libminc.general_transform_point(handle_for_transform,
-                                                c_double(x_coor[i]), c_double(y_coor[i]), c_double(z_coor[i]),
-                                                byref(new_x), byref(new_y), byref(new_z))
-        testMincReturn(r)
-        ret_x += [new_x.value]
-        ret_y += [new_y.value]
-        ret_z += [new_z.value]
-
-    # free up memory
-    libminc.delete_general_transform(handle_for_transform)
+    # the transformation is read once and kept (see XfmTransform) for later calls
+    points = numpy.column_stack([numpy.asarray(x_coor, dtype=numpy.float64),
+                                 numpy.asarray(y_coor, dtype=numpy.float64),
+                                 numpy.asarray(z_coor, dtype=numpy.float64)])
+    points = _loadXfm(xfm_filename).transform(points, inverse=use_inverse)
     # return transformed values
-    return (ret_x, ret_y, ret_z)
+    return (points[:, 0].tolist(), points[:, 1].tolist(), points[:, 2].tolist())
 
 
 def transform_xyz_coordinates_using_xfm(xfm_filename, x_coor, y_coor, z_coor, use_inverse=False):
@@ -96,8 +199,139 @@ def transform_xyz_coordinates_using_xfm(xfm_filename, x_coor, y_coor, z_coor, us
     return ret_x_array[0], rey_y_array[0], rey_z_array[0]
 
 
+def _normalizeInto(real, dtype, out):
+    """
+    converts real values into out, an array of the integer mincSizes type dtype, the
+    same way miget_hyperslab_normalized does for the [type min, type max] range that
+    getHyperslab asks for: the mapping is the identity, so values are rounded to the
+    nearest integer and clipped to the range of the type
+    """
+    if real.dtype.kind in "iu":
+        numpy.clip(real, mincSizes[dtype]["min"], mincSizes[dtype]["max"], out=out, casting="unsafe")
+    else:
+        numpy.rint(numpy.clip(real, mincSizes[dtype]["min"], mincSizes[dtype]["max"]),
+                   out=out, casting="unsafe")
+
+
+def _minMax(data):
+    """
+    the (min, max) of an array in a single pass over memory: both are taken
+    block by block, so every block is read from main memory only once. As with
+    data.min() and data.max(), a NaN anywhere makes both NaN.
+    """
+    data = numpy.asarray(data)
+    if not data.flags["C_CONTIGUOUS"] or data.size <= MINMAX_BLOCK:
+        return data.min(), data.max()
+    flat = data.reshape(-1)
+    data_min = data_max = flat[0]
+    for i in range(0, flat.size, MINMAX_BLOCK):
+        block = flat[i:i + MINMAX_BLOCK]
+        # unlike the builtin min and max, these propagate NaN whichever block it is in
+        data_min = numpy.minimum(data_min, block.min())
+        data_max = numpy.maximum(data_max, block.max())
+    return data_min, data_max
+
+
+def _indexToHyperslab(index, sizes):
+    """
+    translates a basic numpy index (integers, slices and at most one Ellipsis) into
+    the (start, count) of the smallest hyperslab containing the selection, plus the
+    step of each axis and the index that extracts the selection from that hyperslab.
+    Returns None for anything else (fancy or boolean indexing, newaxis, ...).
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    if sum(i is Ellipsis for i in index) > 1:
+        return None
+    if Ellipsis in index:
+        e = index.index(Ellipsis)
+        index = index[:e] + (slice(None),) * (len(sizes) - len(index) + 1) + index[e+1:]
+    if len(index) > len(sizes):
+        raise IndexError("too many indices for volume: volume is %d-dimensional, "
+                         "but %d were indexed" % (len(sizes), len(index)))
+    index = index + (slice(None),) * (len(sizes) - len(index))
+    start, count, steps, post = [], [], [], []
+    for i, n in zip(index, sizes):
+        if isinstance(i, slice):
+            r = range(*i.indices(n))
+            if len(r) == 0:
+                start.append(0)
+                count.append(0)
+                steps.append(r.step)
+                post.append(slice(0, 0))
+            else:
+                lo, hi = min(r[0], r[-1]), max(r[0], r[-1])
+                start.append(lo)
+                count.append(hi - lo + 1)
+                steps.append(r.step)
+                post.append(slice(None, None, r.step))
+        elif isinstance(i, (int, numpy.integer)) and not isinstance(i, bool):
+            j = i + n if i < 0 else i
+            if not 0 <= j < n:
+                raise IndexError("index %d is out of bounds for axis with size %d" % (i, n))
+            start.append(j)
+            count.append(1)
+            steps.append(1)
+            post.append(0)
+        else:
+            return None
+    return start, count, steps, tuple(post)
+
+
+def _maskBoundingBox(mask):
+    """start and count of the smallest hyperslab holding all true voxels of mask, or None if there are none"""
+    start = []
+    count = []
+    for axis in range(mask.ndim):
+        others = tuple(a for a in range(mask.ndim) if a != axis)
+        inside = numpy.flatnonzero(mask.any(axis=others))
+        if len(inside) == 0:
+            return None
+        start.append(int(inside[0]))
+        count.append(int(inside[-1] - inside[0] + 1))
+    return start, count
+
+
+def _slabsRange(slabs):
+    """the (min, max) over an iterable of slabs"""
+    lo, hi = numpy.inf, -numpy.inf
+    for slab in slabs:
+        lo = min(lo, float(slab.min()))
+        hi = max(hi, float(slab.max()))
+    return lo, hi
+
+
+def _rangePartition(filename, offset, length, slab_size, resolution=0):
+    """worker for mincVolume.getVolumeRange(workers=N): the (min, max) of one block of the
+    slowest-varying dimension, streamed through a fresh read-only handle"""
+    v = mincVolume(filename=filename, dtype="double", readonly=True, resolution=resolution)
+    v.openFile()
+    try:
+        extents = v._slabExtents(0, slab_size, offset, offset + length)
+        pool = HyperslabPool()
+        return _slabsRange(v.getHyperslab(start, count, pool=pool) for start, count in extents)
+    finally:
+        v.closeVolume()
+
+
+def _loadPartition(filename, dtype, offset, length, resolution=0):
+    """worker for mincVolume.loadData(workers=N): reads one block of the slowest-varying
+    dimension through a fresh read-only handle into the shared output array"""
+    data = worker_arrays()[0]
+    v = mincVolume(filename=filename, dtype=dtype, readonly=True, resolution=resolution)
+    v.openFile()
+    try:
+        start = [0] * v.ndims
+        count = v.sizes[0:v.ndims]
+        start[0] = offset
+        count[0] = length
+        v._readHyperslab(start, count, dtype, data[offset:offset + length])
+    finally:
+        v.closeVolume()
+
+
 class mincVolume(object):
-    def __init__(self, filename=None, dtype=None, readonly=True, labels=False):
+    def __init__(self, filename=None, dtype=None, readonly=True, labels=False, resolution=0):
         self.volPointer = mihandle() # holds the pointer to the mihandle
         self.dims = dimensions()     # holds the actual pointers to dimensions
         self.ndims = 0               # number of dimensions in this volume
@@ -111,13 +345,21 @@ class mincVolume(object):
         self.readonly = readonly     # flag indicating that volume is for reading only
         self.labels = labels         # whether it contains labels - affects how ranges are set
         self.history = create_string_buffer(b"") # string holding the history information of the file (type = ctypes array of c_char)
+        self.headerOnly = False      # opened with openFile(header_only=True): geometry only, no data
+        self.chunkShape = None       # HDF5 chunk shape of the image, if it is chunked
+        self.resolution = resolution # resolution level of the image to read: 0 is full resolution, k is 2**k times coarser
+        self.readStats = ReadStats() # requested versus decoded bytes of the reads from disk
         self.historyupdated = False  # does the history contain information about what pyminc has done?
         self.order = "C"
         self.debug = "PYMINCDEBUG" in os.environ
         self._x_direction_cosines = None
         self._y_direction_cosines = None
         self._z_direction_cosines = None
+        self._affine = None          # cached voxel to world transformation, see _worldAffine
         self._data_written_to_file = False
+        self.native = False          # dtype "native": data holds stored voxel values, see getHyperslab
+        self._cachedSliceRanges = None    # cached per-slice (min, max) arrays of slice scaled volumes
+        self._prefetchers = weakref.WeakSet() # SlabPrefetchers still reading from this volume
 
 
     def numpy_type_to_string(self, dtype_in_numpy_form):
@@ -209,8 +451,14 @@ class mincVolume(object):
         else:
             raise NoDataException
 
-    def setdata(self, newdata):
-        """sets the data attribute"""
+    def setdata(self, newdata, copy=True):
+        """
+        sets the data attribute. By default the volume gets its own copy of newdata.
+        With copy=False an array that already has the volume's dtype and is
+        C-contiguous is used as it is, without copying: the volume and the caller
+        then share the buffer, so later changes by either are seen by both (and end
+        up in the file if made before writeFile). Other arrays are still converted.
+        """
         if self.debug:
             print("setting data")
         if newdata.shape != tuple(self.sizes[0:self.ndims]):
@@ -223,18 +471,29 @@ class mincVolume(object):
             # that won't confuse numpy. If you supply "float" to
             # astype(), it'll default to "float64" which we actually
             # consider to be "double".
-            self._data = newdata.astype(self.get_numpy_dtype())
+            self._data = newdata.astype(self.get_numpy_dtype(), order="C", copy=copy)
             self.dataLoaded = True
             if self.debug:
                 print("New Shape: " + str(self.data.shape))
 
-    def loadData(self):
-        """loads the data from file into the data attribute"""
+    def loadData(self, workers=None):
+        """
+        loads the data from file into the data attribute.
+
+        With workers > 1 (and a volume opened read-only from a file) the slowest-varying
+        dimension is split into that many parts, each read and decompressed by its own
+        process with an independent handle, directly into one shared preallocated array.
+        """
         if self.debug:
             print("size: "  + str(self.sizes[:]))
-        if self.dataLoadable:
+        if self.headerOnly:
+            raise NoDataException("volume %s was opened header only" % self.filename)
+        if self.dataLoadable and workers and workers > 1 and self.readonly and can_fork():
+            self._data = self._loadDataParallel(workers)
+            self.dataLoaded = True
+        elif self.dataLoadable:
             self._data = self.getHyperslab(int_sizes(), self.sizes[0:self.ndims],
-                                           self.dtype)
+                                           "native" if self.native else self.dtype)
             self._data.shape = self.sizes[0:self.ndims]
             self.dataLoaded = True
         elif self.ndims > 0:
@@ -244,13 +503,52 @@ class mincVolume(object):
         else:
             raise NoDataException
 
-    def getHyperslab(self, start, count, dtype=None):
+    def _loadDataParallel(self, workers):
+        """reads the whole volume with `workers` processes; see loadData"""
+        dtype = self.dtype
+        if type(dtype) != str:
+            dtype = self.get_string_form_of_numpy_dtype(dtype)
+        sizes = self.sizes[0:self.ndims]
+        data = shared_array(sizes, mincSizes[dtype]["numpy"])
+        if self.native:
+            dtype = "native"
+        tasks = [(self.filename, dtype, offset, length, self.resolution)
+                 for offset, length in partition(sizes[0], workers, self._chunkEdge(0))]
+        run_parallel(_loadPartition, tasks, workers, shared=(data,))
+        data = HyperSlab(data, start=numpy.zeros(self.ndims, dtype=int),
+                         count=numpy.array(sizes), separations=self.separations)
+        if self.native:
+            data.scale, data.offset = self._voxelScaling(data.start, data.count)
+        return data
+
+    def _realData(self):
+        """the real values of the data in memory, which hold stored voxel values if the volume is native"""
+        if not self.native:
+            return self.data
+        start = [0] * self.ndims
+        count = self.sizes[0:self.ndims]
+        scale, offset = self._voxelScaling(start, count)
+        return numpy.asarray(self.data) * scale + offset
+
+    def getHyperslab(self, start, count, dtype=None, out=None, pool=None):
         """
         given starts and counts returns the corresponding array.  This is read
         either from memory or disk depending on the state of the dataLoaded variable.
+
+        The values can be read into a caller supplied array `out` (C-contiguous,
+        writeable, of shape count and the numpy type of dtype), or into a buffer
+        taken from `pool`, a HyperslabPool, so that repeated reads don't allocate.
+        The returned HyperSlab is then a view of that buffer.
+
+        dtype="native" (the default for volumes opened with dtype="native") returns
+        the voxel values as stored on disk, in the volume's own type, without
+        converting them to real values. The HyperSlab's scale and offset attributes
+        give the conversion (real = voxel * scale + offset), which its real_values()
+        method applies on demand.
         """
 
-        dtype_to_get = dtype or self.dtype
+        native = dtype == "native" or (dtype is None and self.native)
+        dtype_to_get = self.volumeType if native else (dtype or self.dtype)
         if not dtype_to_get:
             sys.stderr.write("dtype unknown in getHyperslab...")
             raise NoDataTypeException
@@ -269,41 +567,388 @@ class mincVolume(object):
         size = reduce(operator.mul, count)
         if self.debug:
             print(start[:], count[:], size)
-        a = HyperSlab(numpy.zeros(count, dtype=mincSizes[dtype_to_get]["numpy"], order=self.order),
-                      start=start, count=count, separations=self.separations)
+        np_dtype = numpy.dtype(mincSizes[dtype_to_get]["numpy"])
+        if out is None and pool is not None:
+            out = pool.get(count, np_dtype)
+        if out is None:
+            # every element is overwritten below, so there is no need to zero the buffer
+            out = numpy.empty(count, dtype=np_dtype, order=self.order)
+        elif (out.shape != tuple(count) or out.dtype != np_dtype
+              or not out.flags["C_CONTIGUOUS"] or not out.flags["WRITEABLE"]):
+            raise ValueError("out must be a writeable C-contiguous array of shape %s and dtype %s, "
+                             "got shape %s and dtype %s" % (tuple(count), np_dtype, out.shape, out.dtype))
+        a = HyperSlab(out, start=start, count=count, separations=self.separations)
 
         if self.dataLoaded:
             slices = tuple(map(lambda x, y: slice(x, x+y), start, count))
-            if dtype_to_get == "float" or dtype_to_get == "double":
-                a[...] = self.data[slices]
+            source = self.data[slices]
+            if native and not self.native:
+                # real values in memory, stored values wanted
+                scale, offset = self._voxelScaling(start, count)
+                self._realToVoxelInto(source, scale, offset, a)
             else:
-                raise RuntimeError("get hyperslab for integer datatypes not yet implemented"
-                                   " when volume is already loaded into memory")
+                if self.native and not native:
+                    # stored values in memory, real values wanted
+                    scale, offset = self._voxelScaling(start, count)
+                    source = numpy.asarray(source) * scale + offset
+                if native or dtype_to_get == "float" or dtype_to_get == "double" or source.dtype == a.dtype:
+                    a[...] = source
+                else:
+                    _normalizeInto(source, dtype_to_get, a)
         else:  # if data not already loaded
-            ctype_start = misize_t_sizes(*start)
-            ctype_count = misize_t_sizes(*count)
             if self.debug:
                 print(start[:], count[:], size)
-            r = 0
-            if dtype_to_get == "float" or dtype_to_get == "double":
-                # return real values if datatpye is floating point
-                r = libminc.miget_real_value_hyperslab(
-                    self.volPointer,
-                    mincSizes[dtype_to_get]["minc"],
-                    ctype_start, ctype_count,
-                    a.ctypes.data_as(POINTER(mincSizes[dtype_to_get]["ctype"])))
-            else :
-                # return normalized values if datatype is integer
-                r = libminc.miget_hyperslab_normalized(
-                    self.volPointer,
-                    mincSizes[dtype_to_get]["minc"],
-                    ctype_start, ctype_count,
-                    c_double(mincSizes[dtype_to_get]["min"]),
-                    c_double(mincSizes[dtype_to_get]["max"]),
-                    a.ctypes.data_as(POINTER(mincSizes[dtype_to_get]["ctype"])))
-            testMincReturn(r)
+            self._readHyperslab(start, count, "native" if native else dtype_to_get, a)
+        if native:
+            a.scale, a.offset = self._voxelScaling(start, count)
         return a
 
+    def _voxelScaling(self, start, count):
+        """
+        returns (scale, offset) converting the stored voxel values of the hyperslab
+        given by start and count to real values: real = voxel * scale + offset
+        """
+        if mincSizes[self.volumeType]["type"] == "real":
+            return 1.0, 0.0
+        if self.isSliceScaled():
+            # one scale and offset per slice, shaped to broadcast over the hyperslab
+            nslice = self._sliceDimensionCount()
+            mins, maxs = self._sliceRanges()
+            selection = tuple(slice(s, s + c) for s, c in zip(start[:nslice], count[:nslice]))
+            shape = tuple(count[:nslice]) + (1,) * (self.ndims - nslice)
+            valid_max, valid_min = self.getValidRange()
+            if valid_max == valid_min:
+                return numpy.zeros(shape), mins[selection].reshape(shape)
+            scale = ((maxs[selection] - mins[selection]) / (valid_max - valid_min)).reshape(shape)
+            return scale, mins[selection].reshape(shape) - valid_min * scale
+        volume_max, volume_min = c_double(), c_double()
+        testMincReturn(libminc.miget_volume_range(self.volPointer, byref(volume_max), byref(volume_min)))
+        valid_max, valid_min = self.getValidRange()
+        if valid_max == valid_min:
+            return 0.0, volume_min.value
+        scale = (volume_max.value - volume_min.value) / (valid_max - valid_min)
+        return scale, volume_min.value - valid_min * scale
+
+    def _sliceDimensionCount(self):
+        """number of (slowest varying) dimensions that image-min/image-max vary over
+        when the volume is slice scaled; the remaining image dimensions share one range"""
+        image_dims = 3 if self.dimnames and self.dimnames[-1] == "vector_dimension" else 2
+        return max(0, self.ndims - image_dims)
+
+    def _sliceRanges(self):
+        """
+        returns arrays (mins, maxs) holding the real range of every slice of a slice
+        scaled volume, indexed by the slice dimensions. They are only queried once.
+        """
+        if self._cachedSliceRanges is None:
+            nslice = self._sliceDimensionCount()
+            shape = tuple(self.sizes[0:nslice])
+            mins, maxs = numpy.empty(shape), numpy.empty(shape)
+            position = misize_t_sizes()
+            slice_max, slice_min = c_double(), c_double()
+            for index in numpy.ndindex(*shape):
+                position[0:nslice] = index
+                r = libminc.miget_slice_range(self.volPointer, position, self.ndims,
+                                              byref(slice_max), byref(slice_min))
+                testMincReturn(r)
+                mins[index], maxs[index] = slice_min.value, slice_max.value
+            self._cachedSliceRanges = (mins, maxs)
+        return self._cachedSliceRanges
+
+    def _writeSliceScaled(self, data, start, count):
+        """
+        writes real valued data to a slice scaled volume with an integer type: the
+        range of every slice is computed from the data in one vectorised pass, stored
+        with miset_slice_range, and the data quantised against it in numpy and written
+        as voxel values. The hyperslab has to cover whole slices.
+        """
+        nslice = self._sliceDimensionCount()
+        sizes = self.sizes[0:self.ndims]
+        start, count = list(start[:self.ndims]), list(count[:self.ndims])
+        if count[nslice:] != list(sizes[nslice:]) or any(start[nslice:]):
+            raise ValueError("hyperslabs written to slice scaled volumes have to cover whole slices")
+        data = numpy.asarray(data).reshape(count)
+        rows = data.reshape(-1, reduce(operator.mul, count[nslice:], 1))
+        slice_min = rows.min(axis=1).astype(numpy.float64)
+        slice_max = rows.max(axis=1).astype(numpy.float64)
+        valid_min = mincSizes[self.volumeType]["min"]
+        valid_max = mincSizes[self.volumeType]["max"]
+        testMincReturn(libminc.miset_volume_valid_range(self.volPointer, valid_max, valid_min))
+        position = misize_t_sizes(*start)
+        for i, index in enumerate(numpy.ndindex(*count[:nslice])):
+            position[0:nslice] = [s + j for s, j in zip(start, index)]
+            r = libminc.miset_slice_range(self.volPointer, position, self.ndims,
+                                          slice_max[i], slice_min[i])
+            testMincReturn(r)
+        shape = tuple(count[:nslice]) + (1,) * (self.ndims - nslice)
+        scale = ((slice_max - slice_min) / (valid_max - valid_min)).reshape(shape)
+        offset = slice_min.reshape(shape) - valid_min * scale
+        voxels = numpy.empty(count, dtype=mincSizes[self.volumeType]["numpy"])
+        self._realToVoxelInto(data, scale, offset, voxels)
+        self._writeVoxels(start, count, voxels)
+        self._cachedSliceRanges = None
+
+    def _writeQuantised(self, data):
+        """
+        writes data, the real values of the whole volume: the range is set from one
+        pass over the data, which is then converted to the volume type in numpy and
+        written as voxel values a slab at a time through one reusable buffer
+        """
+        data_min, data_max = _minMax(data)
+        self._setVolumeAndValidRange(data_min, data_max)
+        sizes = self.sizes[0:self.ndims]
+        scale, offset = self._voxelScaling([0] * self.ndims, sizes)
+        stored = numpy.dtype(mincSizes[self.volumeType]["numpy"])
+        identity = numpy.all(scale == 1) and numpy.all(offset == 0)
+        pool = HyperslabPool()
+        for start, count in self._slabExtents(0, self._defaultSlabSize(0, "double")):
+            chunk = data[start[0]:start[0] + count[0]]
+            if identity and chunk.dtype == stored and chunk.flags["C_CONTIGUOUS"]:
+                # already the stored values, no conversion needed
+                voxels = chunk
+            else:
+                voxels = pool.get(count, stored)
+                scratch = None if mincSizes[self.volumeType]["type"] == "real" else pool.get(count, numpy.float64)
+                self._realToVoxelInto(chunk, scale, offset, voxels, scratch)
+            self._writeVoxels(start, count, voxels)
+
+    def _writeVoxels(self, start, count, voxels):
+        """writes voxels, a C-contiguous array of the volume's stored type, as they are"""
+        r = libminc.miset_voxel_value_hyperslab(
+            self.volPointer, mincSizes[self.volumeType]["minc"],
+            misize_t_sizes(*start), misize_t_sizes(*count),
+            voxels.ctypes.data_as(POINTER(mincSizes[self.volumeType]["ctype"])))
+        testMincReturn(r)
+        self._data_written_to_file = True
+
+    def _hasIntegerSliceScaling(self):
+        """whether writes have to go through _writeSliceScaled"""
+        return mincSizes[self.volumeType]["type"] != "real" and bool(self.isSliceScaled())
+
+    def _realToVoxelInto(self, real, scale, offset, out, scratch=None):
+        """inverse of the scaling from _voxelScaling: converts real values to the
+        volume's stored type, rounding and clipping to its range, writing into out.
+        scratch, a float64 array of the same shape, avoids allocating a temporary."""
+        if mincSizes[self.volumeType]["type"] == "real":
+            out[...] = real
+            return
+        if scratch is None:
+            scratch = numpy.empty(out.shape, dtype=numpy.float64)
+        numpy.subtract(real, offset, out=scratch)
+        numpy.divide(scratch, scale, out=scratch, where=numpy.asarray(scale) != 0)
+        numpy.clip(scratch, mincSizes[self.volumeType]["min"], mincSizes[self.volumeType]["max"], out=scratch)
+        numpy.rint(scratch, out=out, casting="unsafe")
+
+    def _readHyperslab(self, start, count, dtype, buffer):
+        """
+        reads the hyperslab given by start and count from disk into buffer, a
+        C-contiguous array of the numpy type corresponding to dtype (a mincSizes key,
+        or "native" for stored values in the numpy type of the volume type)
+        """
+        ctype_start = misize_t_sizes(*start)
+        ctype_count = misize_t_sizes(*count)
+        self.readStats.add(start[:self.ndims], count[:self.ndims],
+                           numpy.dtype(mincSizes[self.volumeType]["numpy"]).itemsize,
+                           self.chunkShape, self.sizes[0:self.ndims])
+        if dtype == "native":
+            # return the voxel values as they are stored in the file
+            r = libminc.miget_voxel_value_hyperslab(
+                self.volPointer,
+                mincSizes[self.volumeType]["minc"],
+                ctype_start, ctype_count,
+                buffer.ctypes.data_as(POINTER(mincSizes[self.volumeType]["ctype"])))
+        elif dtype == "float" or dtype == "double":
+            # return real values if datatpye is floating point
+            r = libminc.miget_real_value_hyperslab(
+                self.volPointer,
+                mincSizes[dtype]["minc"],
+                ctype_start, ctype_count,
+                buffer.ctypes.data_as(POINTER(mincSizes[dtype]["ctype"])))
+        else :
+            # return normalized values if datatype is integer
+            r = libminc.miget_hyperslab_normalized(
+                self.volPointer,
+                mincSizes[dtype]["minc"],
+                ctype_start, ctype_count,
+                c_double(mincSizes[dtype]["min"]),
+                c_double(mincSizes[dtype]["max"]),
+                buffer.ctypes.data_as(POINTER(mincSizes[dtype]["ctype"])))
+        testMincReturn(r)
+
+    def _slabExtents(self, axis=0, slab_size=1, begin=0, end=None):
+        """
+        returns an iterator of (start, count) pairs covering the whole volume in
+        slabs of at most slab_size voxels along axis (the last slab may be thinner).
+        begin and end restrict the slabs to that part of axis.
+        """
+        if self.ndims == 0:
+            raise NoDataException
+        if not 0 <= axis < self.ndims:
+            raise IndexError("axis %d out of range for volume with %d dimensions" % (axis, self.ndims))
+        if slab_size < 1:
+            raise ValueError("slab_size must be a positive integer, got %s" % slab_size)
+        sizes = self.sizes[0:self.ndims]
+        end = sizes[axis] if end is None else min(end, sizes[axis])
+
+        def extents():
+            for i in range(begin, end, slab_size):
+                start = [0] * self.ndims
+                count = list(sizes)
+                start[axis] = i
+                count[axis] = min(slab_size, end - i)
+                yield start, count
+        return extents()
+
+    def _defaultSlabSize(self, axis=0, dtype="double"):
+        """the number of slices along axis that fit into DEFAULT_SLAB_BYTES when read as
+        dtype, as a whole number of chunks (see _alignSlabSize)"""
+        sizes = self.sizes[0:self.ndims]
+        slice_bytes = (reduce(operator.mul, sizes, 1) // max(1, sizes[axis])
+                       * numpy.dtype(mincSizes[dtype]["numpy"]).itemsize)
+        return self._alignSlabSize(axis, DEFAULT_SLAB_BYTES // max(1, slice_bytes))
+
+    def _chunkEdge(self, axis):
+        """the chunk edge length along axis, 1 if the image isn't chunked"""
+        return self.chunkShape[axis] if self.chunkShape else 1
+
+    def _alignSlabSize(self, axis, slab_size):
+        """
+        rounds slab_size down to a multiple of the chunk edge along axis (but to at
+        least one edge): slabs of whole chunks, which cover the other dimensions
+        completely, decompress every chunk of the image exactly once
+        """
+        edge = self._chunkEdge(axis)
+        return max(edge, slab_size - slab_size % edge)
+
+    def iter_slabs(self, axis=0, slab_size=1, dtype=None, prefetch=0, pool=None):
+        """
+        iterates over the volume as consecutive HyperSlabs of at most slab_size
+        voxels along axis. Only one slab is read (via getHyperslab) at a time, so the
+        whole volume never has to be held in memory.
+
+        slab_size=None picks a size of about DEFAULT_SLAB_BYTES made of whole HDF5
+        chunks, so that each chunk of a compressed image is only decoded once (see
+        readStats for how many bytes were decoded for those requested).
+
+        With prefetch > 0 up to that many slabs are read ahead in a background
+        thread and a SlabPrefetcher is returned; its read_time, wait_time and
+        overlap attributes report how much of the reading was hidden.
+
+        With a HyperslabPool as pool, slabs of the same shape are read into the same
+        buffer, i.e. each slab is only valid until the next one is read. This can't
+        be combined with prefetching, where several slabs are alive at once.
+        """
+        if slab_size is None:
+            slab_size = self._defaultSlabSize(axis, "double" if dtype in [None, "native"] else dtype)
+        extents = self._slabExtents(axis, slab_size)
+        if prefetch:
+            if pool is not None:
+                raise ValueError("a buffer pool can't be used together with prefetching")
+            return SlabPrefetcher(self, extents, dtype=dtype, depth=prefetch)
+        return (self.getHyperslab(start, count, dtype, pool=pool) for start, count in extents)
+
+    def write_slabs(self, slabs):
+        """
+        write-side counterpart of iter_slabs: consumes an iterable of HyperSlabs
+        (e.g. a generator transforming the output of iter_slabs) and writes each one
+        to file at its own start/count via setHyperslab.
+
+        setHyperslab widens the range of integer volumes as it goes, which would
+        change the meaning of the slabs already written, so those (unless slice
+        scaled or loaded in memory) have to be written with a VolumeWriter instead.
+        """
+        if (not self.dataLoaded and mincSizes[self.volumeType]["type"] != "real"
+                and not self._hasIntegerSliceScaling()):
+            sys.stderr.write("Writing integer volume %s slab by slab needs its range\n" % self.filename)
+            raise ValueError("write slabs to %s volumes with a VolumeWriter" % self.volumeType)
+        for slab in slabs:
+            self.setHyperslab(slab)
+
+    def _asMask(self, mask):
+        """mask as a boolean array of the volume's shape"""
+        mask = numpy.asarray(mask)
+        if mask.dtype != bool:
+            mask = mask > 0.5
+        if list(mask.shape) != list(self.sizes[0:self.ndims]):
+            sys.stderr.write("mask shape %s does not match volume sizes %s\n"
+                             % (mask.shape, self.sizes[0:self.ndims]))
+            raise IncorrectDimsException
+        return mask
+
+    def read_masked(self, mask, dtype=None):
+        """
+        returns the values of the voxels inside mask (an array of the volume's shape)
+        as a 1-D array, in C order. Only the bounding box of the mask is read.
+        """
+        mask = self._asMask(mask)
+        box = _maskBoundingBox(mask)
+        # an empty mask still reads one voxel, so that the result has the usual dtype
+        start, count = box if box is not None else ([0] * self.ndims, [1] * self.ndims)
+        slices = tuple(slice(b, b + c) for b, c in zip(start, count))
+        return numpy.asarray(self.getHyperslab(start, count, dtype))[mask[slices]]
+
+    def write_masked(self, values, mask, fill=0):
+        """
+        scatters values, a 1-D array as returned by read_masked, into the voxels
+        inside mask. If the data has been loaded only those voxels change.
+
+        Otherwise the other voxels are set to fill. For float and double volumes
+        with fill=0 only the mask's bounding box is written, since the voxels outside
+        it already hold 0 in newly created volumes. For integer volumes a stored 0
+        decodes through the range to some other real value, so the whole volume is
+        written a slab at a time, quantised against the range of values and fill.
+        """
+        mask = self._asMask(mask)
+        values = numpy.asarray(values)
+        if values.shape != (int(mask.sum()),):
+            raise ValueError("expected %d values for the voxels in the mask, got shape %s"
+                             % (mask.sum(), values.shape))
+        if self.dataLoaded:
+            self.data[mask] = values
+            return
+        if self.readonly:
+            raise IOError("Writing to file %s which has been opened in readonly mode" % self.filename)
+        if mincSizes[self.volumeType]["type"] != "real" or fill != 0:
+            self._writeMaskedVolume(values, mask, fill)
+            return
+        box = _maskBoundingBox(mask)
+        if box is None:
+            return
+        start, count = box
+        slices = tuple(slice(b, b + c) for b, c in zip(start, count))
+        slab = numpy.full(count, fill, dtype=numpy.float64)
+        slab[mask[slices]] = values
+        self.setHyperslab(slab, start, count)
+
+    def _writeMaskedVolume(self, values, mask, fill):
+        """
+        writes the whole volume a slab at a time, values inside mask and fill
+        everywhere else. The range is set from values and fill before the first slab
+        is quantised, so all slabs are stored against the same range.
+        """
+        if not self.dataLoadable:
+            self.createVolumeImage()
+        slice_scaled = self._hasIntegerSliceScaling()
+        if not slice_scaled:
+            low, high = _minMax(values) if values.size else (fill, fill)
+            self._setVolumeAndValidRange(min(float(low), fill), max(float(high), fill))
+            scale, offset = self._voxelScaling([0] * self.ndims, self.sizes[0:self.ndims])
+        # index into values of the first masked voxel of every slice along axis 0
+        first = numpy.concatenate([[0], numpy.cumsum(mask.reshape(mask.shape[0], -1).sum(axis=1))])
+        pool = HyperslabPool()
+        for start, count in self._slabExtents(0, self._defaultSlabSize(0, "double")):
+            begin, end = start[0], start[0] + count[0]
+            slab = pool.get(count, numpy.float64)
+            slab.fill(fill)
+            slab[mask[begin:end]] = values[first[begin]:first[end]]
+            if slice_scaled:
+                # slabs along the first dimension cover whole slices
+                self._writeSliceScaled(slab, start, count)
+            else:
+                voxels = pool.get(count, mincSizes[self.volumeType]["numpy"])
+                self._realToVoxelInto(slab, scale, offset, voxels, scratch=slab)
+                self._writeVoxels(start, count, voxels)
+
     def setHyperslab(self, data, start=None, count=None):
         """write hyperslab back to file"""
 
@@ -317,8 +962,10 @@ class mincVolume(object):
             start = data.start
 
         if self.dataLoaded:
-            slices = list(map(lambda x, y: slice(x, x+y), start, count))
+            slices = tuple(map(lambda x, y: slice(x, x+y), start, count))
             self.data[slices] = data
+        elif self._hasIntegerSliceScaling():
+            self._writeSliceScaled(data, start, count)
         else: # if data is not in memory write hyperslab to disk
             ctype_start = misize_t_sizes(*start[:self.ndims])
             ctype_count = misize_t_sizes(*count[:self.ndims])
@@ -344,9 +991,7 @@ class mincVolume(object):
         """write the current data array to file"""
         if self.readonly:
             raise IOError("Writing to file %s which has been opened in readonly mode" % self.filename)
-        if not self.historyupdated:
-            addToHist = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " >>> (default history added after pyminc usage) " + " ".join(sys.argv) + "\n"
-            self.appendAndWriteHistory(history=addToHist)
+        self._addDefaultHistory()
         if not self.dataLoadable:  # if file doesn't yet exist on disk
             self.createVolumeImage()
         if self.dataLoaded:  # only write if data is in memory
@@ -356,93 +1001,131 @@ class mincVolume(object):
                self.dtype == None) :
                 sys.stderr.write("dtype unknown in writeFile...")
                 raise NoDataTypeException
-            self.setVolumeRanges(self._data)
 
             if type(self.dtype) != str:
                 self.dtype = self.get_string_form_of_numpy_dtype(self.dtype)
 
-            arr = self._data if self._data.flags["C_CONTIGUOUS"] else self._data.copy()
-
-            r = libminc.miset_real_value_hyperslab(
-                self.volPointer, mincSizes[self.dtype]["minc"],
-                misize_t_sizes(), misize_t_sizes(*self.sizes[:]),
-                arr.ctypes.data_as(POINTER(mincSizes[self.dtype]["ctype"])))
-            testMincReturn(r)
+            if self.native:
+                # the data holds stored voxel values: write them as they are, keeping
+                # the file's (slice) ranges that turn them into real values
+                self._writeVoxels([0] * self.ndims, self.sizes[0:self.ndims],
+                                  numpy.ascontiguousarray(self._data, dtype=mincSizes[self.volumeType]["numpy"]))
+            elif self._hasIntegerSliceScaling():
+                self._writeSliceScaled(self._data, [0] * self.ndims, self.sizes[0:self.ndims])
+            else:
+                self._writeQuantised(self._data)
             self._data_written_to_file = True
 
-            # set the complete flag of the volume. Depending on which version
-            # of libminc is being used, we can call miset_attr_values() (which
-            # is the correct function to use) or miset_attribute() (which is 
-            # a private function and should not be used). 
-            # 
-            # However, until the fix made on June 17, 2016:
-            # https://github.com/BIC-MNI/libminc/commit/3ca34259f7d5bdae11bf77226492457cb7a1922a 
-            # it is not possible to set the image:complete flag using miset_attr_values.
-            # 
-            # Right now we don't know yet which version of libminc has the fix, so
-            # the version check will always fail. We should update this when the 
-            # fix has made it into a new release of libminc.
-            # 
-            miget_version = libminc.miget_version
-            miget_version.restype = c_char_p
-            libminc_version = miget_version().decode()
-            libminc_version_major = int(libminc_version.split('.')[0])
-            libminc_version_minor = int(libminc_version.split('.')[1])
-            libminc_version_patch = int(libminc_version.split('.')[2])
-            # this "correct" version 3.5.99 is fictive, and to be determined.
-            if (libminc_version_major >= 2 and
-                libminc_version_minor >= 4 and
-                libminc_version_patch >= 3):
-                r = libminc.miset_attr_values(self.volPointer,
-                                              MI_TYPE_STRING,
-                                              c_stringy("image"),
-                                              c_stringy("complete"),
-                                              5,
-                                              c_stringy("true_"))
-                testMincReturn(r)
-            else:
-                try:
-                    r = libminc.miset_attribute(self.volPointer,
-                                                MI_ROOT_PATH_FOR_IMAGE_ATTR,
-                                                c_stringy("complete"),
-                                                MI_TYPE_STRING,
-                                                5,
-                                                c_stringy("true_"))
-                    testMincReturn(r)
-                except mincException:
-                    print("Warning/Info: could not set the image:complete flag for file: " + self.filename +
-                          " even though the file was written out successfully. Perhaps you need to update"
-                          " your libminc libraries.")
+            self._setImageComplete()
             # also close the volume, that way it can be used directly after
             self.closeVolume()
 
 
 
+    def build_pyramid(self, levels):
+        """
+        adds lower resolution versions of the image to the file: level k (1 to
+        levels) averages blocks of 2**k voxels along every dimension, dropping the
+        voxels at the far ends that don't fill a block. libminc computes each level
+        from the full resolution image 2**k slices at a time, so the image is
+        streamed rather than held in memory. Data in memory that hasn't been written
+        yet is written first. A level is read with volumeFromFile(..., resolution=k).
+        """
+        if self.readonly:
+            raise IOError("Writing to file %s which has been opened in readonly mode" % self.filename)
+        if not 1 <= levels <= MI2_MAX_RESOLUTION_GROUP:
+            raise ValueError("levels has to be between 1 and %d, got %s" % (MI2_MAX_RESOLUTION_GROUP, levels))
+        sizes = self.sizes[0:self.ndims]
+        if min(sizes) >> levels == 0:
+            raise ValueError("a volume of sizes %s is too small for %d resolution levels" % (sizes, levels))
+        if self.dataLoaded and not self._data_written_to_file:
+            self.writeFile()
+        if self.volPointer is None and self._data_written_to_file:
+            # writeFile (or a VolumeWriter) closed the volume
+            self.volPointer = mihandle()
+            self.openFile()
+        if not self.dataLoadable:
+            sys.stderr.write("No image data in %s to build resolution levels from\n" % self.filename)
+            raise NoDataException
+        for level in range(1, levels + 1):
+            # selecting a level that doesn't exist yet makes libminc compute it
+            testMincReturn(libminc.miselect_resolution(self.volPointer, level))
+        testMincReturn(libminc.miselect_resolution(self.volPointer, 0))
+        self._data_written_to_file = True
+
+    def _addDefaultHistory(self):
+        """adds the command line to the history unless the history has been updated"""
+        if not self.historyupdated:
+            addToHist = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " >>> (default history added after pyminc usage) " + " ".join(sys.argv) + "\n"
+            self.appendAndWriteHistory(history=addToHist)
+
+    def _setImageComplete(self):
+        """sets the image:complete flag once all the data has been written"""
+        # set the complete flag of the volume. Depending on which version
+        # of libminc is being used, we can call miset_attr_values() (which
+        # is the correct function to use) or miset_attribute() (which is 
+        # a private function and should not be used). 
+        # 
+        # However, until the fix made on June 17, 2016:
+        # https://github.com/BIC-MNI/libminc/commit/3ca34259f7d5bdae11bf77226492457cb7a1922a 
+        # it is not possible to set the image:complete flag using miset_attr_values.
+        # 
+        # Right now we don't know yet which version of libminc has the fix, so
+        # the version check will always fail. We should update this when the 
+        # fix has made it into a new release of libminc.
+        # 
+        miget_version = libminc.miget_version
+        miget_version.restype = c_char_p
+        libminc_version = miget_version().decode()
+        libminc_version_major = int(libminc_version.split('.')[0])
+        libminc_version_minor = int(libminc_version.split('.')[1])
+        libminc_version_patch = int(libminc_version.split('.')[2])
+        # this "correct" version 3.5.99 is fictive, and to be determined.
+        if (libminc_version_major >= 2 and
+            libminc_version_minor >= 4 and
+            libminc_version_patch >= 3):
+            r = libminc.miset_attr_values(self.volPointer,
+                                          MI_TYPE_STRING,
+                                          c_stringy("image"),
+                                          c_stringy("complete"),
+                                          5,
+                                          c_stringy("true_"))
+            testMincReturn(r)
+        else:
+            try:
+                r = libminc.miset_attribute(self.volPointer,
+                                            MI_ROOT_PATH_FOR_IMAGE_ATTR,
+                                            c_stringy("complete"),
+                                            MI_TYPE_STRING,
+                                            5,
+                                            c_stringy("true_"))
+                testMincReturn(r)
+            except mincException:
+                print("Warning/Info: could not set the image:complete flag for file: " + self.filename +
+                      " even though the file was written out successfully. Perhaps you need to update"
+                      " your libminc libraries.")
+
     def setVolumeRanges(self, data):
         """sets volume and voxel ranges to use the maximum voxel range and the minumum necessary volume range.  This combination is makes optimal use of real valued data and integer volume types."""
         # ignore slice scaling for the moment
 
         count = reduce(operator.mul, data.shape)
         volumeCount = reduce(operator.mul, self.sizes[0:self.ndims])
-        max, min = 0.0, 0.0
-        if count == volumeCount:
-            # if data encompasses entire volume, min and max is based solely on data
-            max = data.max()
-            min = data.min()
-        else:
+        min, max = _minMax(data)
+        if count != volumeCount:
             # if data is only part of the volume, only update min and max if they
             # exceed the current range
             currentMin = c_double()
             currentMax = c_double()
             r = libminc.miget_volume_range(self.volPointer, currentMax, currentMin)
-            if data.max() > currentMax.value:
-                max = data.max()
-            else:
+            if max <= currentMax.value:
                 max = currentMax.value
-            if data.min() < currentMin.value:
-                min = data.min()
-            else:
+            if min >= currentMin.value:
                 min = currentMin.value
+        self._setVolumeAndValidRange(min, max)
+
+    def _setVolumeAndValidRange(self, min, max):
+        """sets the volume range to min, max and the valid range to match the volume type"""
         if(self.volumeType == "float" or self.volumeType == "double"):
             # there is no defined minimum or maximum to the float/double range
             # in this case, the volume and voxel range should be the same
@@ -471,23 +1154,58 @@ class mincVolume(object):
                                             volume_max, volume_min)
         testMincReturn(status)
 
-    def getVolumeRange(self):
+    def getVolumeRange(self, exact=False, slab_size=None, workers=None):
         """
         This method gets the range (min and max) scale value for the volume.
+
+        If the data is loaded this is its minimum and maximum in memory. Otherwise it
+        is by default the range stored in the file header (for slice scaled volumes
+        the union of the slice ranges); for integer types that bounds the data, but
+        the data need not reach it. With exact=True, or when the header holds no
+        usable range, the actual minimum and maximum of the data on disk are computed
+        instead in one streaming pass over slabs of slab_size slices (default:
+        DEFAULT_SLAB_BYTES worth), optionally split across `workers` processes, using
+        only O(slab) memory.
         """
-        if self.isSliceScaled:
-            if self.debug:
-                print("Slice scaling is enabled, will determine the range based on the data loaded")
-            if not self.dataLoaded:
-                self.loadData()
-            return float(self.data.min()), float(self.data.max())
-        else:
+        if self.dataLoaded:
+            data = self.data.real_values() if self.native else self.data
+            return float(data.min()), float(data.max())
+        if not exact:
+            if self.isSliceScaled():
+                if self.debug:
+                    print("Slice scaling is enabled, will determine the range from the slice ranges")
+                mins, maxs = self._sliceRanges()
+                return float(mins.min()), float(maxs.max())
             volume_max, volume_min = c_double(), c_double()
             status = libminc.miget_volume_range(self.volPointer,
                                                 byref(volume_max),
                                                 byref(volume_min))
-            testMincReturn(status)
-            return volume_min.value, volume_max.value
+            if status >= 0 and volume_min.value <= volume_max.value:
+                return volume_min.value, volume_max.value
+            if not self.dataLoadable:
+                testMincReturn(status)
+            if self.debug:
+                print("No usable range in the file header, will determine the range from the data")
+        return self._streamRange(slab_size, workers)
+
+    def _streamRange(self, slab_size=None, workers=None):
+        """computes the real (min, max) of the data on disk one slab at a time"""
+        slab_size = slab_size or self._defaultSlabSize(0, "double")
+        if workers and workers > 1 and self.readonly and can_fork():
+            tasks = [(self.filename, offset, length, slab_size, self.resolution)
+                     for offset, length in partition(self.sizes[0], workers, self._chunkEdge(0))]
+            ranges = run_parallel(_rangePartition, tasks, workers)
+        else:
+            ranges = [_slabsRange(self.iter_slabs(0, slab_size, "double", pool=HyperslabPool()))]
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def setSliceScaling(self, flag=True):
+        """
+        turns slice scaling (a separate real range per slice) on or off for a new
+        volume. It has to be set before the volume image is created.
+        """
+        status = libminc.miset_slice_scaling_flag(self.volPointer, mibool(flag))
+        testMincReturn(status)
 
     def isSliceScaled(self):
         "return slice_scaling_flag for volume"
@@ -562,25 +1280,19 @@ class mincVolume(object):
         raise directionCosinesNotDetermined
 
 
-    def openFile(self):
-        """reads information from MINC file"""
-        r = libminc.miopen_volume(self.filename, (MI2_OPEN_RDWR, MI2_OPEN_READ)[self.readonly],
-                                  self.volPointer)
-        testMincReturn(r)
-        # get information about the data type of the input file
-        file_datatype = mitype_t()
-        r = libminc.miget_data_type(self.volPointer, file_datatype)
-        testMincReturn(r)
-        self.volumeType = self.getMincSizesFromMincType(file_datatype)
-        if self.debug:
-            print("Datatype of the input file: " + str(self.volumeType))
+    def _resolveDtype(self):
+        """determines the dtype to use for the data once the volumeType of the file is known"""
+        # "native" means: read the voxel values as stored, in the type of the file
+        if self.dtype == "native":
+            self.native = True
+            self.dtype = self.volumeType
         # if the dtype was not explicitly set, set it to double in order
         # not to lose any precision while working with the data
         # unless we are reading in labels (a segmentation) file. In
         # which case we should read that in as ushort (i.e. integers)
         if not self.dtype and not self.labels:
             self.dtype = "double"
-        if self.labels and self.dtype not in ["ubyte", "ushort", "uint"]:
+        if self.labels and not self.native and self.dtype not in ["ubyte", "ushort", "uint"]:
             # the dtype should reflect integers of some sort. This
             # should also be unsigned, because negative label values
             # don't make sense
@@ -594,6 +1306,32 @@ class mincVolume(object):
                 if self.debug:
                     print("Changed the dtype of the data being to be " + str(self.dtype) + " to reflect label/segmentation data.")
 
+    def openFile(self, header_only=False):
+        """
+        reads information from MINC file.
+
+        With header_only=True only the geometry and data type are read, through a
+        read-only handle that is closed again straight away; the volume's data can't
+        be accessed. This makes scanning many files for their geometry cheap.
+        """
+        if header_only:
+            self.readonly = True
+            self.headerOnly = True
+        if self.resolution and not self.readonly:
+            raise ValueError("lower resolution levels can only be opened read-only")
+        r = libminc.miopen_volume(self.filename, (MI2_OPEN_RDWR, MI2_OPEN_READ)[self.readonly],
+                                  self.volPointer)
+        testMincReturn(r)
+        if self.resolution:
+            testMincReturn(libminc.miselect_resolution(self.volPointer, self.resolution))
+        # get information about the data type of the input file
+        file_datatype = mitype_t()
+        r = libminc.miget_data_type(self.volPointer, file_datatype)
+        testMincReturn(r)
+        self.volumeType = self.getMincSizesFromMincType(file_datatype)
+        if self.debug:
+            print("Datatype of the input file: " + str(self.volumeType))
+        self._resolveDtype()
         if self.debug:
             print("Datatype of the numpy array: " + str(self.dtype))
         ndims = c_int(0)
@@ -626,6 +1364,8 @@ class mincVolume(object):
         self.starts = starts[0:self.ndims]
         if self.debug:
             print("starts: " + str(self.starts))
+        if self.resolution:
+            self._scaleToResolution()
         self.dimnames = []
         for i in range(self.ndims):
             name = c_stringy("")
@@ -633,15 +1373,8 @@ class mincVolume(object):
             self.dimnames.append(name.value.decode(encoding))  # FIXME # TODO: mifree_name(name)
         if self.debug:
             print("dimnames: " + str(self.dimnames))
-        try:
-            self.history = self.getHistory(size=999999)  # FIXME ...
-        except mincException:
-            # some programs do not properly initialize the minc history attribute
-            # (for example RMINC (july 2014)). Running getHistory() on one of those files will
-            # generate a mincException. However, we can ignore that and simply
-            # leave the current history of the input file initialized at ""
-            if self.debug:
-                print("MINC file does not have a history attribute, creating one")
+        # the history is only read from the file when it is first needed
+        self._history = None
         #
         # Direction cosines
         #
@@ -649,12 +1382,205 @@ class mincVolume(object):
         self._y_direction_cosines = self.get_direction_cosines('yspace')
         self._z_direction_cosines = self.get_direction_cosines('zspace')
 
-        self.dataLoadable = True
+        if header_only:
+            self.closeVolume()
+        else:
+            self.chunkShape = self._imageChunkShape()
+            self.dataLoadable = True
+
+    def _scaleToResolution(self):
+        """
+        turns the geometry read from the dimensions, which is that of the full
+        resolution image, into that of the selected resolution level: level k
+        averages blocks of f = 2**k voxels, dropping incomplete blocks at the ends
+        """
+        f = 2 ** self.resolution
+        for i in range(self.ndims):
+            # the first voxel is centred on the first block of f full resolution voxels
+            self.starts[i] += (f - 1) / 2.0 * self.separations[i]
+            self.separations[i] *= f
+            self.sizes[i] //= f
+
+    def gethistory(self):
+        """called when history attribute requested; reads the history of a file on first access"""
+        if self._history is None:
+            self._history = create_string_buffer(b"")
+            try:
+                if self.volPointer:
+                    self._history = self.getHistory()
+                else:
+                    # the volume has been closed (or was opened header only) since
+                    handle = mihandle()
+                    testMincReturn(libminc.miopen_volume(self.filename, MI2_OPEN_READ, handle))
+                    try:
+                        self._history = self.getHistory(handle=handle)
+                    finally:
+                        libminc.miclose_volume(handle)
+            except mincException:
+                # some programs do not properly initialize the minc history attribute
+                # (for example RMINC (july 2014)). Running getHistory() on one of those files will
+                # generate a mincException. However, we can ignore that and simply
+                # leave the current history of the input file initialized at ""
+                if self.debug:
+                    print("MINC file does not have a history attribute, creating one")
+        return self._history
+
+    def sethistory(self, history):
+        """sets the history attribute"""
+        self._history = history
+
+    def setHeader(self, header):
+        """
+        initialises a volume from a dictionary as returned by getHeader, without
+        opening the file: the volume is header only (see openFile)
+        """
+        self.readonly = True
+        self.headerOnly = True
+        self.volumeType = header["volumeType"]
+        self._resolveDtype()
+        self.ndims = len(header["dimnames"])
+        self.ndims_misize_t = misize_t(self.ndims)
+        self.sizes = int_sizes(*header["sizes"])
+        self.starts = list(header["starts"])
+        self.separations = list(header["separations"])
+        self.dimnames = list(header["dimnames"])
+        self._x_direction_cosines = direction_cosines_array(*header["x_direction_cosines"])
+        self._y_direction_cosines = direction_cosines_array(*header["y_direction_cosines"])
+        self._z_direction_cosines = direction_cosines_array(*header["z_direction_cosines"])
+        self._history = None
+        self.volPointer = None
+
+    def getHeader(self):
+        """returns the geometry and data type of the volume as a dictionary of plain values"""
+        return {"filename": self.filename,
+                "volumeType": self.volumeType,
+                "dimnames": list(self.dimnames),
+                "sizes": list(self.sizes[0:self.ndims]),
+                "starts": list(self.starts[0:self.ndims]),
+                "separations": list(self.separations[0:self.ndims]),
+                "x_direction_cosines": list(self._x_direction_cosines),
+                "y_direction_cosines": list(self._y_direction_cosines),
+                "z_direction_cosines": list(self._z_direction_cosines)}
+
+    def _withImageDataset(self, func):
+        """
+        opens the HDF5 dataset of the image read-only and returns func(dataset_id),
+        or None if HDF5 isn't available or the dataset can't be opened
+        """
+        if not hdf5_available:
+            return None
+        file_id = libminc.H5Fopen(self.filename, H5F_ACC_RDONLY, H5P_DEFAULT)
+        if file_id < 0:
+            return None
+        try:
+            dataset_id = libminc.H5Dopen2(file_id, "/minc-2.0/image/%d/image" % self.resolution, H5P_DEFAULT)
+            if dataset_id < 0:
+                return None
+            try:
+                return func(dataset_id)
+            finally:
+                libminc.H5Dclose(dataset_id)
+        finally:
+            libminc.H5Fclose(file_id)
+
+    def _contiguousImageOffset(self):
+        """
+        returns the byte offset of the image data in the file if it is stored as a
+        single uncompressed, unchunked block in native byte order (i.e. can be memory
+        mapped), and None otherwise
+        """
+        if self.volumeType is None:
+            return None
+
+        def offset(dataset_id):
+            plist_id = libminc.H5Dget_create_plist(dataset_id)
+            if plist_id < 0:
+                return None
+            layout = libminc.H5Pget_layout(plist_id)
+            nfilters = libminc.H5Pget_nfilters(plist_id)
+            libminc.H5Pclose(plist_id)
+            if layout != H5D_CONTIGUOUS or nfilters != 0:
+                return None
+            type_id = libminc.H5Dget_type(dataset_id)
+            if type_id < 0:
+                return None
+            order = libminc.H5Tget_order(type_id)
+            itemsize = libminc.H5Tget_size(type_id)
+            libminc.H5Tclose(type_id)
+            np_dtype = numpy.dtype(mincSizes[self.volumeType]["numpy"])
+            native_order = (H5T_ORDER_BE, H5T_ORDER_LE)[sys.byteorder == "little"]
+            if itemsize != np_dtype.itemsize or (itemsize > 1 and order != native_order):
+                return None
+            image_offset = libminc.H5Dget_offset(dataset_id)
+            if image_offset == HADDR_UNDEF:
+                return None
+            return image_offset
+        return self._withImageDataset(offset)
+
+    def _imageChunkShape(self):
+        """the HDF5 chunk shape of the image (one edge length per dimension), or None if it isn't chunked"""
+        def chunk_shape(dataset_id):
+            plist_id = libminc.H5Dget_create_plist(dataset_id)
+            if plist_id < 0:
+                return None
+            try:
+                if libminc.H5Pget_layout(plist_id) != H5D_CHUNKED:
+                    return None
+                edges = (c_ulonglong * self.ndims)()
+                if libminc.H5Pget_chunk(plist_id, self.ndims, edges) != self.ndims:
+                    return None
+                return tuple(int(e) for e in edges)
+            finally:
+                libminc.H5Pclose(plist_id)
+        return self._withImageDataset(chunk_shape)
+
+    def mapData(self):
+        """
+        exposes the image as a read-only numpy.memmap over the file instead of reading
+        it through libminc, if that gives exactly the values loadData would: the volume
+        is open read-only, stored uncompressed and contiguously, dtype matches the type
+        on disk and real values equal stored values (floating point types, or integer
+        types whose volume range equals their valid range) or the volume was opened
+        with dtype="native". Returns True if the data was mapped, False if the volume
+        is left to be read the normal way.
+        """
+        dtype = self.dtype
+        if dtype is not None and type(dtype) != str:
+            dtype = self.get_string_form_of_numpy_dtype(dtype)
+        if not self.readonly or not self.dataLoadable or dtype != self.volumeType:
+            return False
+        if not self.native and mincSizes[self.volumeType]["type"] != "real":
+            if self.isSliceScaled():
+                return False
+            volume_max, volume_min = c_double(), c_double()
+            testMincReturn(libminc.miget_volume_range(self.volPointer, byref(volume_max), byref(volume_min)))
+            valid_max, valid_min = self.getValidRange()
+            if (volume_min.value, volume_max.value) != (valid_min, valid_max):
+                return False
+        offset = self._contiguousImageOffset()
+        if offset is None:
+            return False
+        self._data = numpy.memmap(self.filename, dtype=mincSizes[self.volumeType]["numpy"],
+                                  mode="r", offset=offset, shape=tuple(self.sizes[0:self.ndims]))
+        self.dataLoaded = True
+        return True
 
     def copyDimensions(self, otherInstance, dims=None):
         """create new local dimensions info copied from another instance"""
         if not dims:
             dims = otherInstance.dimnames
+        if otherInstance.resolution:
+            # the dimension handles of a lower resolution level still describe the
+            # full resolution image, so create new ones with the level's geometry
+            keep = [i for i in range(otherInstance.ndims) if otherInstance.dimnames[i] in dims]
+            self.createNewDimensions([otherInstance.dimnames[i] for i in keep],
+                                     [otherInstance.sizes[i] for i in keep],
+                                     [otherInstance.starts[i] for i in keep],
+                                     [otherInstance.separations[i] for i in keep],
+                                     list(otherInstance._x_direction_cosines),
+                                     list(otherInstance._y_direction_cosines),
+                                     list(otherInstance._z_direction_cosines))
+            return
         self.ndims = c_int(len(dims))
         self.starts = list(range(self.ndims.value))
         self.separations = list(range(self.ndims.value))
@@ -700,8 +1626,9 @@ class mincVolume(object):
         """copy the history information to use for this instance from another instance"""
         self.history = otherInstance.history
 
-    def createVolumeHandle(self, volumeType=None):
-        """creates a new volume on disk"""
+    def createVolumeHandle(self, volumeType=None, sliceScaled=False, props=None):
+        """creates a new volume on disk, with the compression and chunking of props
+        (a VolumeProps; libminc's defaults if it is None)"""
         self.volPointer = mihandle()
         if not volumeType and not self.volumeType:
             sys.stderr.write("volumeType passed along to createVolumeHandle is None "
@@ -713,8 +1640,11 @@ class mincVolume(object):
             print("Number of dimensions: " + str(self.ndims) + " " + str(self.dims[0:self.ndims]))
         r = libminc.micreate_volume(self.filename, self.ndims, self.dims,
                                     mincSizes[volumeType]["minc"], MI_CLASS_REAL,
-                                    None, self.volPointer)
+                                    props.handle if props is not None else None,
+                                    self.volPointer)
         testMincReturn(r)
+        if sliceScaled:
+            self.setSliceScaling(True)
         r = libminc.miget_dimension_sizes(self.dims, self.ndims, self.sizes)
         if self.debug:
             print("sizes: " + str(self.sizes[0:self.ndims]))
@@ -760,6 +1690,8 @@ class mincVolume(object):
                                                                                             z_dir_cosines[2]))
                     testMincReturn(r)
         self.dims = dimensions(*tmpdims[0:self.ndims])
+        self.dimnames = list(dimnames)
+        self.starts = list(starts)
         self.separations = steps
         self._x_direction_cosines = x_dir_cosines
         self._y_direction_cosines = y_dir_cosines
@@ -774,6 +1706,9 @@ class mincVolume(object):
                 print("Removing file " + str(self.filename) + " created on disk, because data was not written out")
             subprocess.check_call(("rm -f %s" % self.filename).split())
         """close volume and release all pointer memory"""
+        # a prefetching thread mustn't read from the handle while it's being freed
+        for prefetcher in list(self._prefetchers):
+            prefetcher.close()
         if self.volPointer is not None:  # avoid freeing memory twice
             # in the current version of miclose_volume, the dimension
             # handles are all freed as well
@@ -791,7 +1726,30 @@ class mincVolume(object):
         self.dataLoadable = False
 
     def __getitem__(self, i):
-        return self.data[i]
+        """
+        indexes the volume like its data array. If the data is not loaded yet, basic
+        indices (integers, slices, Ellipsis) only read the region they select from disk;
+        the result is a HyperSlab whose start, count and separations describe the
+        selected voxels. Other kinds of indexing load the whole volume.
+        """
+        if self.dataLoaded or not self.dataLoadable:
+            return self.data[i]
+        hyperslab = _indexToHyperslab(i, self.sizes[0:self.ndims])
+        if hyperslab is None:
+            return self.data[i]
+        start, count, steps, post = hyperslab
+        if 0 in count:
+            region = HyperSlab(numpy.zeros(count, dtype=self.get_numpy_dtype()))
+        else:
+            region = self.getHyperslab(start, count)
+        result = region[post]
+        # describe the selected voxels rather than the region that was read
+        if isinstance(result, HyperSlab):
+            result.start = numpy.array([b if s > 0 else b + c - 1 for b, c, s in zip(start, count, steps)])
+            result.count = numpy.array([len(range(0, c, abs(s))) for c, s in zip(count, steps)])
+            result.separations = [sep * s for sep, s in zip(self.separations, steps)]
+            result.dimnames = list(self.dimnames)
+        return result
 
     def __del__(self):
         "close file and release memory from libminc"
@@ -799,6 +1757,7 @@ class mincVolume(object):
 
     # define access functions for getting and setting the data attribute
     data = property(getdata, setdata, None, doc="The voxel data of the volume")
+    history = property(gethistory, sethistory, None, doc="The history attribute of the volume")
 
     #adding history to minc files, history should be a string
     def appendAndWriteHistory(self, history):
@@ -811,9 +1770,16 @@ class mincVolume(object):
         self.historyupdated = True
 
     #retrieve history of file 
-    def getHistory(self, size, history=None):
+    def getHistory(self, size=None, history=None, handle=None):
+        handle = handle or self.volPointer
+        if size is None:
+            # size the buffer exactly, leaving room for the terminating NUL and the newline added below
+            length = misize_t()
+            r = libminc.miget_attr_length(handle, "", "history", byref(length))
+            testMincReturn(r)
+            size = length.value + 2
         history = create_string_buffer(size)
-        r = libminc.miget_attr_values(self.volPointer, MI_TYPE_STRING, "", "history", len(history), history)
+        r = libminc.miget_attr_values(handle, MI_TYPE_STRING, "", "history", len(history), history)
         testMincReturn(r)
         # add a new line to the history to ensure that this command is seen as a new
         # command in the MINC history (i.e., is not simply concatenated into a big
@@ -837,6 +1803,61 @@ class mincVolume(object):
         r = libminc.micopy_attr(otherInstance.volPointer, path, self.volPointer)
         testMincReturn(r)
 
+    def _worldAffine(self):
+        """
+        returns (M, origin, inverse) such that world = voxels @ M.T + origin for
+        voxel coordinates in the order of the dimensions, and voxels =
+        (world - origin) @ inverse.T. Built like libminc builds its transformation,
+        from the starts, separations and (normalised) direction cosines of the
+        spatial dimensions; other dimensions (time, vector_dimension) don't move a
+        voxel in the world. Cached until the geometry of the volume changes.
+        """
+        cosines = {"xspace": self._x_direction_cosines,
+                   "yspace": self._y_direction_cosines,
+                   "zspace": self._z_direction_cosines}
+        key = (tuple(self.dimnames[0:self.ndims]), tuple(self.starts[0:self.ndims]),
+               tuple(self.separations[0:self.ndims])) + tuple(tuple(c) for c in cosines.values())
+        if self._affine is None or self._affine[0] != key:
+            M = numpy.zeros((3, self.ndims))
+            origin = numpy.zeros(3)
+            for i, name in enumerate(self.dimnames[0:self.ndims]):
+                if name in cosines:
+                    c = numpy.array(cosines[name][0:3], dtype=numpy.float64)
+                    norm = numpy.sqrt(c @ c)
+                    if norm > 0:
+                        c /= norm
+                    M[:, i] = c * self.separations[i]
+                    origin += c * self.starts[i]
+            self._affine = (key, M, origin, numpy.linalg.pinv(M))
+        return self._affine[1:]
+
+    def convertVoxelsToWorld(self, voxels):
+        """Convert voxel locations to world coordinates with a single matrix product.
+
+        voxels : (N, ndims) array (or one point of length ndims)
+        returns an (N, 3) array, the same as convertVoxelToWorld gives for each point
+        """
+        voxels = numpy.asarray(voxels, dtype=numpy.float64)
+        if voxels.shape[-1:] != (self.ndims,):
+            sys.stderr.write("expected voxel coordinates with %d columns, got shape %s\n"
+                             % (self.ndims, voxels.shape))
+            raise IncorrectDimsException
+        M, origin, _ = self._worldAffine()
+        return voxels @ M.T + origin
+
+    def convertWorldToVoxels(self, world):
+        """Convert world locations to voxel coordinates with a single matrix product.
+
+        world : (N, 3) array (or one point of length 3)
+        returns an (N, ndims) array, the same as convertWorldToVoxel gives for each point
+        """
+        world = numpy.asarray(world, dtype=numpy.float64)
+        if world.shape[-1:] != (3,):
+            sys.stderr.write("expected world coordinates with 3 columns, got shape %s\n" % (world.shape,))
+            raise IncorrectDimsException
+        _, origin, inverse = self._worldAffine()
+        return (world - origin) @ inverse.T
+
     def convertVoxelToWorld(self, voxel):
         """Convert voxel location to corresponding point in world coordinates.
 
@@ -844,7 +1865,9 @@ class mincVolume(object):
         """
         c_voxel = voxel_coord()
         c_world = world_coord()
-        c_voxel[:self.ndims] = voxel
+        f = 2 ** self.resolution
+        # libminc converts full resolution voxel coordinates
+        c_voxel[:self.ndims] = [v * f + (f - 1) / 2.0 for v in voxel[:self.ndims]]
         status = libminc.miconvert_voxel_to_world(self.volPointer, c_voxel, c_world)
         testMincReturn(status)
         return numpy.array(c_world[:])
@@ -871,7 +1894,8 @@ class mincVolume(object):
         c_world[:] = world
         status = libminc.miconvert_world_to_voxel(self.volPointer, c_world, c_voxel)
         testMincReturn(status)
-        return numpy.array(c_voxel[:self.ndims])
+        f = 2 ** self.resolution
+        return (numpy.array(c_voxel[:self.ndims]) - (f - 1) / 2.0) / f
 
 
 
@@ -0,0 +1,141 @@
+"""writing new volumes of any type one hyperslab at a time"""
+
+import os
+import sys
+import tempfile
+
+import numpy as numpy
+
+from .hyperslab import HyperslabPool
+from .libpyminc2 import mincSizes
+from .volumes import _minMax
+
+
+class VolumeWriter(object):
+    """
+    writes the data of a new mincVolume hyperslab by hyperslab, for any volume
+    type. Real values are converted to the stored type in numpy and written as
+    voxel values, so the range used for a slab never changes after it has been
+    written (as it can with setHyperslab, which widens the range as it goes).
+
+    Integer volumes need their real range before the first slab is quantised:
+      - declare it with range=(min, max); values outside it are clipped, or
+      - pass two_pass=True: slabs are spilled to a temporary file (in tempdir) as
+        spill_dtype while their range is tracked, and quantised and written in a
+        second pass when the writer is closed.
+    Slice scaled integer volumes need neither since every slab, which has to cover
+    whole slices, gets its own slice ranges. float and double volumes are written
+    as they are, and get the range of the data written unless one is declared.
+
+    close() (or the end of a with block) finishes the file like writeFile does:
+    it sets the range if needed and the image:complete flag, and closes the
+    volume. Voxels that were never written keep the file's fill value.
+    """
+
+    def __init__(self, volume, range=None, two_pass=False, tempdir=None, spill_dtype="float64",
+                 slab_size=None):
+        if volume.readonly:
+            raise IOError("Writing to file %s which has been opened in readonly mode" % volume.filename)
+        self.volume = volume
+        self.sizes = volume.sizes[0:volume.ndims]
+        self.min = numpy.inf
+        self.max = -numpy.inf
+        self.slab_size = slab_size
+        self._real = mincSizes[volume.volumeType]["type"] == "real"
+        self._pool = HyperslabPool()
+        self._spill = None
+        self._spill_name = None
+        self._slice_scaled = volume._hasIntegerSliceScaling()
+        self._range = None if self._slice_scaled else range
+        needs_range = self._range is None and not (self._real or self._slice_scaled)
+        if needs_range and not two_pass:
+            sys.stderr.write("Writing integer volume %s slab by slab needs its range\n" % volume.filename)
+            raise ValueError("declare the range of the data with range=(min, max) or use two_pass=True")
+        volume._addDefaultHistory()
+        if not volume.dataLoadable:
+            volume.createVolumeImage()
+        if needs_range:
+            handle, self._spill_name = tempfile.mkstemp(prefix="pyminc-spill-", suffix=".dat", dir=tempdir)
+            os.close(handle)
+            self._spill = numpy.memmap(self._spill_name, dtype=spill_dtype, mode="w+", shape=tuple(self.sizes))
+        elif self._range is not None:
+            self._setRange(*self._range)
+        elif self._real:
+            self._scale, self._offset = 1.0, 0.0
+
+    def _setRange(self, min, max):
+        self.volume._setVolumeAndValidRange(min, max)
+        self._scale, self._offset = self.volume._voxelScaling([0] * len(self.sizes), self.sizes)
+
+    def _quantiseAndWrite(self, data, start, count):
+        voxels = self._pool.get(count, mincSizes[self.volume.volumeType]["numpy"])
+        scratch = None if self._real else self._pool.get(count, numpy.float64)
+        self.volume._realToVoxelInto(data, self._scale, self._offset, voxels, scratch)
+        self.volume._writeVoxels(start, count, voxels)
+
+    def write(self, data, start=None, count=None):
+        """
+        writes data, real values, at start (of shape count); both default to
+        those of data if it is a HyperSlab
+        """
+        if start is None:
+            start = data.start
+        if count is None:
+            count = data.count
+        start = [int(i) for i in start[:len(self.sizes)]]
+        count = [int(i) for i in count[:len(self.sizes)]]
+        data = numpy.asarray(data).reshape(count)
+        if data.size:
+            data_min, data_max = _minMax(data)
+            self.min = min(self.min, float(data_min))
+            self.max = max(self.max, float(data_max))
+        if self._slice_scaled:
+            self.volume._writeSliceScaled(data, start, count)
+        elif self._spill is not None:
+            self._spill[tuple(slice(b, b + c) for b, c in zip(start, count))] = data
+        else:
+            self._quantiseAndWrite(data, start, count)
+
+    def write_slabs(self, slabs):
+        """writes each HyperSlab of an iterable (e.g. a transformed iter_slabs) at its own position"""
+        for slab in slabs:
+            self.write(slab)
+
+    def close(self):
+        """writes the spilled data, sets the range and completes and closes the file"""
+        try:
+            if self.volume.volPointer is None:
+                return
+            have_data = self.min <= self.max
+            if self._spill is not None:
+                if have_data:
+                    self._setRange(self.min, self.max)
+                else:
+                    self._setRange(0.0, 0.0)
+                slab_size = self.slab_size or self.volume._defaultSlabSize(0, "double")
+                for start, count in self.volume._slabExtents(0, slab_size):
+                    region = tuple(slice(b, b + c) for b, c in zip(start, count))
+                    self._quantiseAndWrite(self._spill[region], start, count)
+            elif self._real and self._range is None and have_data:
+                self.volume._setVolumeAndValidRange(self.min, self.max)
+            self.volume._data_written_to_file = True
+            self.volume._setImageComplete()
+            self.volume.closeVolume()
+        finally:
+            self._removeSpill()
+
+    def _removeSpill(self):
+        if self._spill is not None:
+            self._spill = None
+            os.remove(self._spill_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't complete a file whose writing failed
+            self._removeSpill()
+            self.volume.closeVolume()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""simple timing benchmarks for pyminc I/O paths"""
+
+from argparse import ArgumentParser
+import os
+import tempfile
+import time
+
+import numpy
+
+from pyminc.volumes.cohort import load_cohort
+from pyminc.volumes.factory import peek_header, volumeFromFile, volumeFromInstance
+from pyminc.volumes.libpyminc2 import mincSizes
+from pyminc.volumes.lm import voxel_lm
+from pyminc.volumes.props import VolumeProps
+
+
+def bench_load(args):
+    """time mincVolume.loadData for increasing numbers of worker processes"""
+    max_workers = args.workers or os.cpu_count()
+    baseline = None
+    print("workers  seconds  speedup")
+    for workers in range(1, max_workers + 1):
+        best = None
+        for _ in range(args.repeats):
+            v = volumeFromFile(args.infile, dtype=args.dtype)
+            starttime = time.perf_counter()
+            v.loadData(workers=workers)
+            elapsed = time.perf_counter() - starttime
+            v.closeVolume()
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print("%7d  %7.3f  %6.2fx" % (workers, best, baseline / best))
+
+
+def bench_headers(args):
+    """files per second for a full open versus a header only open"""
+    files = args.infiles * args.repeats
+    starttime = time.perf_counter()
+    for f in files:
+        v = volumeFromFile(f)
+        v.history
+        v.closeVolume()
+    full = time.perf_counter() - starttime
+    starttime = time.perf_counter()
+    for f in files:
+        peek_header(f)
+    peek = time.perf_counter() - starttime
+    print("volumeFromFile:  %8.1f files/s" % (len(files) / full))
+    print("peek_header:     %8.1f files/s" % (len(files) / peek))
+
+
+def bench_cohort(args):
+    """a loop of volumeFromFile(...).data.ravel() and numpy.stack versus load_cohort"""
+    starttime = time.perf_counter()
+    rows = []
+    for f in args.infiles:
+        v = volumeFromFile(f)
+        rows.append(v.data.ravel().astype(args.dtype))
+        v.closeVolume()
+    numpy.stack(rows)
+    loop = time.perf_counter() - starttime
+    print("volumeFromFile loop:       %7.3f s" % loop)
+    for workers in sorted(set([1, args.workers or os.cpu_count()])):
+        starttime = time.perf_counter()
+        load_cohort(args.infiles, dtype=args.dtype, workers=workers)
+        elapsed = time.perf_counter() - starttime
+        print("load_cohort (%2d workers): %7.3f s  %6.2fx" % (workers, elapsed, loop / elapsed))
+
+
+def bench_lm(args):
+    """voxel_lm versus fitting voxels one at a time with numpy.linalg.lstsq"""
+    rng = numpy.random.default_rng(0)
+    design = numpy.column_stack([numpy.ones(len(args.infiles))] +
+                                [rng.normal(size=len(args.infiles)) for _ in range(args.covariates)])
+    starttime = time.perf_counter()
+    voxel_lm(args.infiles, design, slab_size=args.slab_size, workers=args.workers)
+    engine = time.perf_counter() - starttime
+    # the per-voxel loop is timed on the first slab only and extrapolated
+    sizes = peek_header(args.infiles[0])["sizes"]
+    rows = []
+    for f in args.infiles:
+        v = volumeFromFile(f)
+        rows.append(numpy.asarray(v.getHyperslab([0] * len(sizes), [1] + sizes[1:])).ravel())
+        v.closeVolume()
+    data = numpy.stack(rows)
+    starttime = time.perf_counter()
+    for voxel in range(data.shape[1]):
+        numpy.linalg.lstsq(design, data[:, voxel], rcond=None)
+    loop = (time.perf_counter() - starttime) * sizes[0]
+    print("per-voxel loop (estimated): %8.3f s" % loop)
+    print("voxel_lm:                   %8.3f s  %6.1fx" % (engine, loop / engine))
+
+
+def bench_write(args):
+    """write throughput and file size for a range of compression settings"""
+    settings = [("default", None),
+                ("uncompressed", VolumeProps(compression=None)),
+                ("zlib 1", VolumeProps(zlib_level=1)),
+                ("zlib 4", VolumeProps(zlib_level=4)),
+                ("zlib 9", VolumeProps(zlib_level=9))]
+    if args.chunk:
+        settings.append(("zlib 1, chunks %d" % args.chunk, VolumeProps(zlib_level=1, chunks=[args.chunk] * 3)))
+    source = volumeFromFile(args.infile)
+    data = numpy.array(source.data)
+    volume_type = args.volume_type or source.volumeType
+    # throughput in terms of the (uncompressed) stored image
+    megabytes = data.size * numpy.dtype(mincSizes[volume_type]["numpy"]).itemsize / 2**20
+    print("setting                      MB/s   size (MB)")
+    for name, props in settings:
+        output = os.path.join(args.tmpdir, "pyminc-bench-write.mnc")
+        starttime = time.perf_counter()
+        v = volumeFromInstance(source, output, volumeType=volume_type, props=props)
+        v.data = data
+        v.writeFile()
+        elapsed = time.perf_counter() - starttime
+        size = os.path.getsize(output) / 2**20
+        os.remove(output)
+        print("%-24s %9.1f %11.1f" % (name, megabytes / elapsed, size))
+    source.closeVolume()
+
+
+def main():
+    p = ArgumentParser(description="Benchmark pyminc I/O paths.")
+    sub = p.add_subparsers(dest="benchmark", required=True)
+
+    load = sub.add_parser("load", help="parallel whole-volume load, 1 to N worker processes")
+    load.add_argument("infile")
+    load.add_argument("--workers", type=int, default=None, help="maximum number of workers (default: all cores)")
+    load.add_argument("--dtype", default="double")
+    load.add_argument("--repeats", type=int, default=3)
+    load.set_defaults(func=bench_load)
+
+    headers = sub.add_parser("headers", help="files/second reading geometry only")
+    headers.add_argument("infiles", nargs="+")
+    headers.add_argument("--repeats", type=int, default=1)
+    headers.set_defaults(func=bench_headers)
+
+    cohort = sub.add_parser("cohort", help="many volumes into one subjects-by-voxels matrix")
+    cohort.add_argument("infiles", nargs="+")
+    cohort.add_argument("--workers", type=int, default=None, help="number of workers (default: all cores)")
+    cohort.add_argument("--dtype", default="float32")
+    cohort.set_defaults(func=bench_cohort)
+
+    lm = sub.add_parser("lm", help="mass-univariate linear model against a per-voxel loop")
+    lm.add_argument("infiles", nargs="+")
+    lm.add_argument("--covariates", type=int, default=2, help="random covariates besides the intercept")
+    lm.add_argument("--slab-size", type=int, default=None, help="slices per block (default: automatic)")
+    lm.add_argument("--workers", type=int, default=None)
+    lm.set_defaults(func=bench_lm)
+
+    write = sub.add_parser("write", help="write throughput and file size per compression setting")
+    write.add_argument("infile")
+    write.add_argument("--volume-type", default=None, help="type of the written volume (default: that of infile)")
+    write.add_argument("--chunk", type=int, default=None, help="also try chunks of this edge length")
+    write.add_argument("--tmpdir", default=tempfile.gettempdir())
+    write.set_defaults(func=bench_write)
+
+    args = p.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
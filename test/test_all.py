@@ -1,12 +1,31 @@
-from pyminc.volumes.volumes import (mincException, mincVolume, transform_xyz_coordinates_using_xfm, NoDataException)
+from pyminc.volumes.volumes import (mincException, mincVolume, transform_xyz_coordinates_using_xfm, NoDataException,
+                                    transform_multiple_xyz_coordinates_using_xfm, XfmTransform)
+from pyminc.volumes.hyperslab import HyperslabPool
+from pyminc.volumes.libpyminc2 import mincSizes, libminc, GeneralTransform, hdf5_available, hdf5_threadsafe
 from pyminc.volumes.factory import (volumeFromData,
                                     volumeFromDescription,
                                     volumeFromFile,
                                     volumeFromInstance,
-                                    volumeLikeFile)
-
+                                    volumeLikeFile,
+                                    peek_header,
+                                    scan_headers)
+from pyminc.volumes.headercache import HeaderCache, default_cache
+from pyminc.volumes.cohort import load_cohort
+from pyminc.volumes.stats import RunningMoments, voxel_stats
+from pyminc.volumes.lm import LinearModel, voxel_lm
+from pyminc.volumes.writer import VolumeWriter
+from pyminc.volumes.props import VolumeProps
+from pyminc.volumes.chunks import ReadStats, chunk_aligned
+from pyminc.volumes.parallel import partition
+from pyminc.volumes.volumes import GeometryMismatchException, IncorrectDimsException, _minMax
+
+from ctypes import byref, c_double
+import gc
+import pyminc.volumes.factory
+import pyminc.volumes.stats
 import numpy as np
 import os
+import shutil
 import subprocess
 import tempfile
 
@@ -61,6 +80,15 @@ subprocess.check_call(['rawtominc', inputFile_ushort, '-ounsigned', '-oshort', '
 inputFile_uint = tempfile.NamedTemporaryFile(prefix="test-", suffix=".mnc").name
 subprocess.check_call(['rawtominc', inputFile_uint, '-ounsigned', '-oint', '-input', '/dev/urandom', '100', '150', '125'])
 
+# uncompressed, contiguous images can be memory mapped
+uncompressed_env = dict(os.environ, MINC_COMPRESS="0")
+inputFile_float_uncompressed = tempfile.NamedTemporaryFile(prefix="test-uncompressed-", suffix=".mnc").name
+subprocess.check_call(['rawtominc', inputFile_float_uncompressed, '-ofloat', '-input', '/dev/urandom',
+                       '100', '150', '125'], env=uncompressed_env)
+inputFile_double_uncompressed = tempfile.NamedTemporaryFile(prefix="test-uncompressed-", suffix=".mnc").name
+subprocess.check_call(['rawtominc', inputFile_double_uncompressed, '-odouble', '-input', '/dev/urandom',
+                       '100', '150', '125'], env=uncompressed_env)
+
 
 
 inputVector = tempfile.NamedTemporaryFile(prefix="test-vector-", suffix=".mnc").name
@@ -108,6 +136,8 @@ def tearDownModule():
     os.remove(inputFile_ubyte)
     os.remove(inputFile_ushort)
     os.remove(inputFile_uint)
+    os.remove(inputFile_float_uncompressed)
+    os.remove(inputFile_double_uncompressed)
     os.remove(inputVector)
     os.remove(newFilename)
     os.remove(input3DdirectionCosines)
@@ -748,3 +778,1231 @@ class TestXfmsAppliedToCoordinates:
         new_xyz_coords = transform_xyz_coordinates_using_xfm(outputXfmFilename3,
                                                              6.68, 3.14, 7.00, use_inverse=True)
         assert new_xyz_coords == approx((-119.559994975925, -2.72634880128239, 0.0509524723840147))
+
+class TestSlabs:
+    """test streaming a volume slab by slab"""
+    @pytest.mark.parametrize("axis", [0, 1, 2])
+    def testIterSlabsCoversVolume(self, axis):
+        """concatenated slabs should reproduce the full data array"""
+        v = volumeFromFile(inputFile_ushort)
+        slabs = list(v.iter_slabs(axis=axis, slab_size=7))
+        full = v.data
+        v.closeVolume()
+        assert len(slabs) == -(-full.shape[axis] // 7)
+        np.testing.assert_allclose(np.concatenate(slabs, axis=axis), full)
+
+    def testIterSlabsMetadata(self):
+        """slabs should carry the start and count they were read from"""
+        v = volumeFromFile(inputFile_ushort)
+        slabs = list(v.iter_slabs(axis=0, slab_size=30))
+        v.closeVolume()
+        assert [s.start[0] for s in slabs] == [0, 30, 60, 90]
+        assert [s.count[0] for s in slabs] == [30, 30, 30, 10]
+        assert list(slabs[-1].shape) == [10, 150, 125]
+
+    def testWriteSlabs(self, outputFilename):
+        """slabs written through write_slabs should end up in the output file"""
+        v = volumeFromFile(inputFile_ushort)
+        o = volumeFromInstance(v, outputFilename, volumeType="float")
+        o.write_slabs(s * 2 for s in v.iter_slabs(axis=1, slab_size=40))
+        o.writeFile()
+        o.closeVolume()
+        o_back_in = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(o_back_in.data, v.data * 2, rtol=1e-6)
+        o_back_in.closeVolume()
+        v.closeVolume()
+
+    def testWriteSlabsInteger(self, outputFilename):
+        """integer volumes can't be written slab by slab through setHyperslab"""
+        v = volumeFromFile(inputFile_ushort)
+        o = volumeFromInstance(v, outputFilename, volumeType="ushort")
+        with pytest.raises(ValueError):
+            o.write_slabs(v.iter_slabs(axis=0, slab_size=40))
+        o.closeVolume()
+        v.closeVolume()
+
+    def testPrefetchedSlabs(self):
+        """prefetched slabs should match slabs read synchronously"""
+        v = volumeFromFile(inputFile_ushort)
+        expected = [s.copy() for s in v.iter_slabs(axis=0, slab_size=16)]
+        prefetcher = v.iter_slabs(axis=0, slab_size=16, prefetch=3)
+        slabs = list(prefetcher)
+        v.closeVolume()
+        assert prefetcher.slabs == len(expected)
+        assert 0.0 <= prefetcher.overlap <= 1.0
+        for s, e in zip(slabs, expected):
+            assert list(s.start) == list(e.start)
+            np.testing.assert_allclose(s, e)
+
+    def testClosingStopsPrefetching(self):
+        """closing the volume stops the reading thread before the handle is freed"""
+        v = volumeFromFile(inputFile_ushort)
+        prefetcher = v.iter_slabs(axis=0, slab_size=4, prefetch=2)
+        next(prefetcher)
+        v.closeVolume()
+        assert not prefetcher._thread.is_alive()
+        with pytest.raises(StopIteration):
+            next(prefetcher)
+
+    def testAbandonedPrefetcherStops(self):
+        """breaking out of a prefetching loop stops the reading thread"""
+        v = volumeFromFile(inputFile_ushort)
+        prefetcher = v.iter_slabs(axis=0, slab_size=4, prefetch=2)
+        for _ in prefetcher:
+            break
+        thread = prefetcher._thread
+        del prefetcher
+        gc.collect()
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+        assert len(v._prefetchers) == 0
+        v.closeVolume()
+
+class TestParallelLoad:
+    """test loading a volume with several worker processes"""
+    @pytest.mark.parametrize("workers", [2, 3, 7])
+    @pytest.mark.parametrize("dtype,input_file", input_files_and_dtypes)
+    def testParallelLoadMatchesSerial(self, dtype, input_file, workers):
+        """data loaded in parallel should be identical to data loaded serially"""
+        v = volumeFromFile(input_file, dtype=dtype)
+        v.loadData(workers=workers)
+        parallel = np.array(v.data)
+        v.closeVolume()
+        v = volumeFromFile(input_file, dtype=dtype)
+        serial = np.array(v.data)
+        v.closeVolume()
+        assert parallel.dtype == serial.dtype
+        np.testing.assert_array_equal(parallel, serial)
+
+class TestMemoryMapping:
+    """test the memory mapped read path"""
+    @pytest.mark.parametrize("dtype,input_file", input_files_and_dtypes)
+    def testMappedDataMatchesLibminc(self, dtype, input_file):
+        """mmap=True should give the same values as reading through libminc"""
+        v = volumeFromFile(input_file, dtype=dtype, mmap=True)
+        if v.dataLoaded:
+            assert isinstance(v.data, np.memmap)
+            assert not v.data.flags.writeable
+        a = np.array(v.data)
+        v.closeVolume()
+        v = volumeFromFile(input_file, dtype=dtype)
+        b = np.array(v.data)
+        v.closeVolume()
+        np.testing.assert_array_equal(a, b)
+
+    @pytest.mark.skipif(not hdf5_available, reason="libminc doesn't make the HDF5 functions available")
+    @pytest.mark.parametrize("dtype,input_file", [("float", inputFile_float_uncompressed),
+                                                  ("double", inputFile_double_uncompressed)])
+    def testUncompressedDataIsMapped(self, dtype, input_file):
+        """uncompressed images are mapped, with the values libminc reads"""
+        v = volumeFromFile(input_file, dtype=dtype, mmap=True)
+        assert v.dataLoaded
+        assert isinstance(v.data, np.memmap)
+        assert not v.data.flags.writeable
+        a = np.array(v.data)
+        v.closeVolume()
+        v = volumeFromFile(input_file, dtype=dtype)
+        b = np.array(v.data)
+        v.closeVolume()
+        np.testing.assert_array_equal(a, b)
+
+    def testCompressedDataIsNotMapped(self):
+        """rawtominc compresses by default, and compressed images are read through libminc"""
+        v = volumeFromFile(inputFile_float, dtype="float", mmap=True)
+        assert not v.dataLoaded
+        v.closeVolume()
+
+    def testNoMappingForDifferentDtype(self):
+        """the data can't be mapped if it would need converting"""
+        v = volumeFromFile(inputFile_float, dtype="double", mmap=True)
+        assert not v.dataLoaded
+        v.closeVolume()
+
+class TestLazyIndexing:
+    """test that indexing an unloaded volume only reads what it needs"""
+    @pytest.mark.parametrize("index", [20, -1, (slice(None), slice(50, 60), 10),
+                                       (Ellipsis, 3), (slice(90, 10, -7), slice(None, None, 4))])
+    def testIndexMatchesData(self, index):
+        """lazily read selections should equal the same selection from the data array"""
+        v = volumeFromFile(inputFile_ushort)
+        selection = v[index]
+        assert not v.dataLoaded
+        expected = v.data[index]
+        v.closeVolume()
+        np.testing.assert_allclose(selection, expected)
+
+    def testIndexMetadata(self):
+        """the HyperSlab returned should describe the selected voxels"""
+        v = volumeFromFile(inputFile_ushort)
+        selection = v[20:30:2, 5]
+        v.closeVolume()
+        assert list(selection.start) == [20, 5, 0]
+        assert list(selection.count) == [5, 1, 125]
+        assert selection.shape == (5, 125)
+
+class TestInMemoryHyperslabs:
+    """test getting hyperslabs from volumes that are already loaded"""
+    @pytest.mark.parametrize("dtype", ["byte", "short", "int", "ubyte", "ushort", "uint"])
+    @pytest.mark.parametrize("input_file", [inputFile_ubyte, inputFile_short, inputFile_float])
+    def testIntegerHyperslabFromMemory(self, dtype, input_file):
+        """integer hyperslabs from memory should equal those read from disk"""
+        start, count = (10, 20, 30), (5, 40, 50)
+        v = volumeFromFile(input_file)
+        from_disk = v.getHyperslab(start, count, dtype=dtype)
+        v.loadData()
+        from_memory = v.getHyperslab(start, count, dtype=dtype)
+        v.closeVolume()
+        assert from_memory.dtype == from_disk.dtype
+        np.testing.assert_allclose(from_memory, from_disk, atol=1)
+
+class TestHyperslabBuffers:
+    """test reading hyperslabs into caller supplied buffers"""
+    def testOutParameter(self):
+        """getHyperslab should fill and return a view of the supplied buffer"""
+        v = volumeFromFile(inputFile_ushort)
+        out = np.empty((2, 150, 125), dtype="float64")
+        h = v.getHyperslab((10, 0, 0), (2, 150, 125), out=out)
+        expected = v.getHyperslab((10, 0, 0), (2, 150, 125))
+        v.closeVolume()
+        assert np.shares_memory(h, out)
+        np.testing.assert_array_equal(out, expected)
+
+    @pytest.mark.parametrize("out", [np.empty((2, 150, 124)),
+                                     np.empty((2, 150, 125), dtype="float32"),
+                                     np.empty((125, 150, 2)).T])
+    def testOutParameterValidation(self, out):
+        """buffers of the wrong shape, dtype or layout should be rejected"""
+        v = volumeFromFile(inputFile_ushort)
+        with pytest.raises(ValueError):
+            v.getHyperslab((10, 0, 0), (2, 150, 125), out=out)
+        v.closeVolume()
+
+    def testPool(self):
+        """hyperslabs of the same shape and dtype should reuse one pooled buffer"""
+        pool = HyperslabPool()
+        v = volumeFromFile(inputFile_ushort)
+        a = v.getHyperslab((10, 0, 0), (1, 150, 125), pool=pool)
+        b = v.getHyperslab((11, 0, 0), (1, 150, 125), pool=pool)
+        c = v.getHyperslab((11, 0, 0), (1, 150, 125), dtype="float", pool=pool)
+        expected = v.getHyperslab((11, 0, 0), (1, 150, 125))
+        v.closeVolume()
+        assert np.shares_memory(a, b)
+        assert not np.shares_memory(b, c)
+        assert len(pool) == 2
+        np.testing.assert_array_equal(b, expected)
+
+class TestNativeReads:
+    """test reading stored voxel values with dtype="native" """
+    @pytest.mark.parametrize("dtype,input_file", input_files_and_dtypes)
+    def testNativeType(self, dtype, input_file):
+        """native data should have the type stored on disk and scale to the real values"""
+        v = volumeFromFile(input_file, dtype="native")
+        native = v.data
+        v.closeVolume()
+        v = volumeFromFile(input_file)
+        real = v.data
+        v.closeVolume()
+        assert v.volumeType == dtype
+        assert native.dtype == np.dtype(mincSizes[dtype]["numpy"])
+        np.testing.assert_allclose(native.real_values(), real, rtol=1e-6)
+
+    def testDerivedArraysAreNotScaled(self):
+        """arithmetic on native data gives new values that real_values leaves alone"""
+        v = volumeFromFile(inputFile_short, dtype="native")
+        native = v.data
+        v.closeVolume()
+        real = native.real_values()
+        for derived in [native * 2, native.astype(float), native + native, native.copy()]:
+            assert derived.scale is None
+            np.testing.assert_array_equal(derived.real_values(), derived)
+        np.testing.assert_allclose((native * 2).real_values(), np.asarray(native) * 2)
+        np.testing.assert_allclose(native[10:20].real_values(), real[10:20])
+        np.testing.assert_allclose(native[[3, 7]].real_values(), real[[3, 7]])
+
+    def testNativeHyperslab(self):
+        """native hyperslabs from disk and from memory should agree"""
+        v = volumeFromFile(inputFile_short)
+        from_disk = v.getHyperslab((10, 0, 0), (3, 150, 125), dtype="native")
+        v.loadData()
+        from_memory = v.getHyperslab((10, 0, 0), (3, 150, 125), dtype="native")
+        v.closeVolume()
+        assert from_disk.dtype == np.int16
+        assert (from_disk.scale, from_disk.offset) == approx((from_memory.scale, from_memory.offset))
+        np.testing.assert_allclose(from_memory, from_disk, atol=1)
+
+    def testWriteNative(self, outputFilename):
+        """writing native data keeps the stored values and the range that scales them"""
+        shutil.copy(inputFile_ushort, outputFilename)
+        original = volumeFromFile(inputFile_ushort)
+        volume_range = original.getVolumeRange()
+        real = original.data
+        original.closeVolume()
+        v = volumeFromFile(outputFilename, dtype="native", readonly=False)
+        v.data
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        assert v.getVolumeRange() == approx(volume_range)
+        np.testing.assert_allclose(v.data, real, rtol=1e-6)
+        v.closeVolume()
+
+    def testCopyNative(self, outputFilename):
+        """copying a native volume copies its real values"""
+        source = volumeFromFile(inputFile_short, dtype="native")
+        v = volumeFromInstance(source, outputFilename, data=True, volumeType="double")
+        v.writeFile()
+        source.closeVolume()
+        real = volumeFromFile(inputFile_short)
+        v = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(v.data, real.data, rtol=1e-6)
+        v.closeVolume()
+        real.closeVolume()
+
+class TestSliceScaling:
+    """test reading and writing slice scaled volumes"""
+    def testWriteAndReadSliceScaled(self, outputFilename):
+        """per-slice ranges should keep small and large valued slices precise"""
+        data = np.random.rand(10, 20, 30) * (10.0 ** np.arange(10))[:, None, None]
+        v = volumeFromData(outputFilename, data, volumeType="ushort", dtype="double", sliceScaled=True)
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        assert v.isSliceScaled()
+        assert v.getVolumeRange() == approx((data.min(), data.max()))
+        np.testing.assert_allclose(v.data, data, rtol=1e-4, atol=0)
+        native = v.getHyperslab((2, 0, 0), (5, 20, 30), dtype="native")
+        v.closeVolume()
+        assert native.dtype == np.uint16
+        np.testing.assert_allclose(native.real_values(), data[2:7], rtol=1e-4, atol=0)
+
+    def testIndexNativeSliceScaled(self, outputFilename):
+        """indexing native slice scaled data keeps the scaling of the selected slices"""
+        data = np.random.rand(10, 20, 30) * (10.0 ** np.arange(10))[:, None, None]
+        v = volumeFromData(outputFilename, data, volumeType="ushort", dtype="double", sliceScaled=True)
+        v.writeFile()
+        v = volumeFromFile(outputFilename, dtype="native")
+        lazy = v[4]
+        lazy_block = v[2:7, 5, ::3]
+        loaded = v.data
+        v.closeVolume()
+        assert lazy.shape == (20, 30)
+        np.testing.assert_allclose(lazy.real_values(), data[4], rtol=1e-4, atol=0)
+        np.testing.assert_allclose(lazy_block.real_values(), data[2:7, 5, ::3], rtol=1e-4, atol=0)
+        np.testing.assert_allclose(loaded[4].real_values(), data[4], rtol=1e-4, atol=0)
+        np.testing.assert_allclose(loaded[:, 3].real_values(), data[:, 3], rtol=1e-4, atol=0)
+        with pytest.raises(ValueError):
+            loaded.T.real_values()
+
+    def testSliceScaledHyperslabs(self, outputFilename):
+        """hyperslabs covering whole slices can be written one by one"""
+        data = np.random.rand(10, 20, 30) * np.arange(1, 11)[:, None, None]
+        v = volumeFromDescription(outputFilename, ("xspace", "yspace", "zspace"), (10, 20, 30),
+                                  (0, 0, 0), (1, 1, 1), volumeType="short", sliceScaled=True)
+        for i in range(0, 10, 3):
+            v.setHyperslab(data[i:i+3], (i, 0, 0), (min(3, 10 - i), 20, 30))
+        with pytest.raises(ValueError):
+            v.setHyperslab(data[0, :10], (0, 0, 0), (1, 10, 30))
+        v.writeFile()
+        v.closeVolume()
+        v = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(v.data, data, rtol=1e-3, atol=0)
+        v.closeVolume()
+
+class TestVolumeRange:
+    """test determining the range of a volume"""
+    @pytest.mark.parametrize("input_file", input_files)
+    @pytest.mark.parametrize("workers", [None, 3])
+    def testExactRange(self, input_file, workers):
+        """the streamed range should equal the extrema of the data"""
+        v = volumeFromFile(input_file)
+        streamed = v.getVolumeRange(exact=True, slab_size=17, workers=workers)
+        assert not v.dataLoaded
+        expected = (v.data.min(), v.data.max())
+        v.closeVolume()
+        assert streamed == approx(expected)
+
+    @pytest.mark.parametrize("input_file", input_files)
+    def testHeaderRangeBoundsData(self, input_file):
+        """the header range should contain the data without loading it"""
+        v = volumeFromFile(input_file)
+        lo, hi = v.getVolumeRange()
+        assert not v.dataLoaded
+        data_lo, data_hi = v.getVolumeRange(exact=True)
+        v.closeVolume()
+        assert lo <= data_lo + 1e-6 * abs(data_lo) and data_hi - 1e-6 * abs(data_hi) <= hi
+
+    def testLoadedRange(self, outputFilename):
+        """the range of loaded data is taken from memory, also after it has changed"""
+        v = volumeFromFile(inputFile_ushort)
+        v.data[10] = 1e6
+        assert v.getVolumeRange() == approx((v.data.min(), 1e6))
+        v.closeVolume()
+        data = np.random.random((10, 20, 30)) - 5
+        v = volumeFromData(outputFilename, data, volumeType="short")
+        assert v.getVolumeRange() == approx((data.min(), data.max()))
+        v.closeVolume()
+
+class TestHeaderOnly:
+    """test reading only the header of a file"""
+    def testHeaderOnlyGeometry(self):
+        """a header only volume should have the same geometry as a fully opened one"""
+        h = volumeFromFile(input3DdirectionCosines, header_only=True)
+        v = volumeFromFile(input3DdirectionCosines)
+        assert h.getHeader() == v.getHeader()
+        assert h.getHeader() == peek_header(input3DdirectionCosines)
+        assert not h.dataLoadable
+        with pytest.raises(NoDataException):
+            h.data
+        v.closeVolume()
+
+    def testLazyHistory(self):
+        """the history should be read on first access, even after the file was closed"""
+        h = volumeFromFile(inputFile_ushort, header_only=True)
+        v = volumeFromFile(inputFile_ushort)
+        assert h.history.value == v.history.value
+        assert b"rawtominc" in h.history.value
+        v.closeVolume()
+
+
+class TestHeaderCache:
+    """test the persistent header cache"""
+    def testCacheHit(self, tmp_path):
+        """a cached header only volume should not open the file"""
+        cache = HeaderCache(str(tmp_path / "headers.sqlite"))
+        h = volumeFromFile(input3DdirectionCosines, header_only=True, cache=cache)
+        assert len(cache) == 1
+        c = volumeFromFile(input3DdirectionCosines, header_only=True, cache=cache)
+        assert c.getHeader() == h.getHeader()
+        assert c.volPointer is None
+        assert c.dtype == h.dtype
+        assert c.history.value == h.history.value
+        cache.close()
+
+    def testScanHeaders(self, tmp_path):
+        """scan_headers should return the same headers with and without the cache"""
+        files = [inputFile_ubyte, inputFile_ushort, input3DdirectionCosines]
+        cache = HeaderCache(str(tmp_path / "headers.sqlite"))
+        uncached = scan_headers(files)
+        assert scan_headers(files, cache=cache) == uncached
+        assert scan_headers(files, cache=cache) == uncached
+        assert len(cache) == 3
+        cache.close()
+
+    def testStaleEntry(self, tmp_path):
+        """a file that changed on disk should not be served from the cache"""
+        f = str(tmp_path / "copy.mnc")
+        subprocess.check_call(["cp", inputFile_ushort, f])
+        cache = HeaderCache(str(tmp_path / "headers.sqlite"))
+        cache.put(f, dict(peek_header(f), volumeType="ubyte"))
+        assert cache.get(f)["volumeType"] == "ubyte"
+        os.utime(f, ns=(0, 0))
+        assert cache.get(f) is None
+        assert len(cache) == 0
+        assert peek_header(f, cache=cache)["volumeType"] == "ushort"
+        cache.close()
+
+    def testInvalidateAndEvict(self, tmp_path):
+        """entries can be removed explicitly, and the least recently used are evicted"""
+        files = [inputFile_ubyte, inputFile_ushort, input3DdirectionCosines]
+        cache = HeaderCache(str(tmp_path / "headers.sqlite"), max_entries=2)
+        scan_headers(files, cache=cache)
+        assert len(cache) == 2
+        assert cache.get(inputFile_ubyte) is None
+        cache.invalidate(inputFile_ushort)
+        assert cache.get(inputFile_ushort) is None
+        cache.invalidate()
+        assert len(cache) == 0
+        cache.close()
+
+    def testBatch(self, tmp_path):
+        """puts made in a batch are committed together, and evicted once, at its end"""
+        path = str(tmp_path / "headers.sqlite")
+        cache = HeaderCache(path, max_entries=2)
+        other = HeaderCache(path)
+        files = [inputFile_ubyte, inputFile_ushort, input3DdirectionCosines]
+        with cache.batch():
+            for f in files:
+                cache.put(f, peek_header(f))
+            assert cache.get(inputFile_ubyte) is not None
+            assert len(other) == 0
+            # nothing is locked while the batch is open
+            other.put(inputFile_float, peek_header(inputFile_float))
+        assert len(cache) == 2
+        assert len(other) == 2
+        cache.close()
+        other.close()
+
+    def testDefaultCache(self, tmp_path, monkeypatch):
+        """cache=True uses one shared cache"""
+        monkeypatch.setenv("PYMINC_HEADER_CACHE", str(tmp_path / "headers.sqlite"))
+        cache = default_cache()
+        peek_header(inputFile_ubyte, cache=True)
+        scan_headers([inputFile_ushort], cache=True)
+        assert default_cache() is cache
+        assert len(cache) == 2
+        cache.close()
+
+
+class TestCohort:
+    """test loading many volumes into one subjects-by-voxels matrix"""
+    cohort = [inputFile_ubyte, inputFile_short, inputFile_float, inputFile_double]
+
+    def serialMatrix(self, dtype="float32"):
+        rows = []
+        for f in self.cohort:
+            v = volumeFromFile(f)
+            rows.append(np.array(v.data, dtype=dtype).ravel())
+            v.closeVolume()
+        return np.stack(rows)
+
+    @pytest.mark.parametrize("workers", [None, 3])
+    def testLoadCohort(self, workers):
+        """the cohort matrix should hold the flattened volumes as rows"""
+        matrix, header = load_cohort(self.cohort, workers=workers)
+        assert matrix.dtype == np.float32
+        assert header["sizes"] == [100, 150, 125]
+        np.testing.assert_allclose(matrix, self.serialMatrix(), rtol=1e-6)
+
+    @pytest.mark.parametrize("workers", [None, 2])
+    def testMaskedCohort(self, workers):
+        """with a mask only the voxels inside the mask should be returned"""
+        mask = np.zeros((100, 150, 125), dtype=bool)
+        mask[20:70, 30:90, 40:60] = True
+        mask[25, 35, 45] = False
+        matrix, _ = load_cohort(self.cohort, mask=mask, dtype="double", workers=workers)
+        assert matrix.shape == (len(self.cohort), mask.sum())
+        expected = self.serialMatrix("float64")[:, mask.ravel()]
+        np.testing.assert_array_equal(matrix, expected)
+
+    @pytest.mark.parametrize("workers", [None, 2])
+    def testCohortOnDisk(self, tmp_path, workers):
+        """out=path should write the matrix to a .npy file"""
+        out = str(tmp_path / "cohort.npy")
+        matrix, _ = load_cohort(self.cohort, out=out, workers=workers)
+        assert isinstance(matrix, np.memmap)
+        del matrix
+        np.testing.assert_allclose(np.load(out), self.serialMatrix(), rtol=1e-6)
+
+    def testGeometryMismatch(self):
+        """files with different geometries can't be loaded together"""
+        with pytest.raises(GeometryMismatchException):
+            load_cohort([inputFile_ubyte, input3DdirectionCosines])
+
+
+class TestMaskedIO:
+    """test reading and writing only the voxels inside a mask"""
+    mask = np.zeros((100, 150, 125), dtype=bool)
+    mask[30:60, 20:100, 50:90] = np.random.random((30, 80, 40)) > 0.3
+
+    @pytest.mark.parametrize("dtype,input_file", input_files_and_dtypes)
+    def testReadMasked(self, dtype, input_file):
+        """read_masked should equal indexing the full data with the mask"""
+        v = volumeFromFile(input_file, dtype=dtype)
+        masked = v.read_masked(self.mask)
+        assert not v.dataLoaded
+        expected = np.array(v.data)[self.mask]
+        v.closeVolume()
+        assert masked.dtype == expected.dtype
+        np.testing.assert_array_equal(masked, expected)
+
+    def testReadEmptyMask(self):
+        """an empty mask gives an empty vector"""
+        v = volumeFromFile(inputFile_double)
+        assert v.read_masked(np.zeros((100, 150, 125))).shape == (0,)
+        v.closeVolume()
+
+    def testMaskShape(self):
+        """the mask needs the shape of the volume"""
+        v = volumeFromFile(inputFile_double)
+        with pytest.raises(IncorrectDimsException):
+            v.read_masked(np.ones((100, 150, 124), dtype=bool))
+        v.closeVolume()
+
+    @pytest.mark.parametrize("volumeType", ["double", "float", "ushort"])
+    def testWriteMasked(self, outputFilename, volumeType):
+        """values written with write_masked should be read back by read_masked"""
+        v = volumeFromFile(inputFile_ubyte)
+        values = v.read_masked(self.mask)
+        o = volumeLikeFile(inputFile_ubyte, outputFilename, volumeType=volumeType)
+        o.write_masked(values, self.mask)
+        o.closeVolume()
+        o = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(o.read_masked(self.mask), values, rtol=1e-4, atol=1e-4 * values.max())
+        assert np.all(np.array(o.data)[~self.mask] == approx(0, abs=1e-4 * values.max()))
+        o.closeVolume()
+        v.closeVolume()
+
+    @pytest.mark.parametrize("volumeType", ["byte", "short", "int", "ushort"])
+    def testWriteMaskedNegative(self, outputFilename, volumeType):
+        """voxels outside the mask read back as fill, also for signed types and negative values"""
+        values = np.random.uniform(-5, 5, self.mask.sum())
+        o = volumeLikeFile(inputFile_ubyte, outputFilename, volumeType=volumeType)
+        o.write_masked(values, self.mask)
+        o.closeVolume()
+        o = volumeFromFile(outputFilename)
+        step = 10.0 / (mincSizes[volumeType]["max"] - mincSizes[volumeType]["min"])
+        np.testing.assert_allclose(o.read_masked(self.mask), values, atol=step)
+        assert np.all(np.abs(np.array(o.data)[~self.mask]) <= step)
+        o.closeVolume()
+
+    @pytest.mark.parametrize("volumeType", ["short", "float"])
+    def testWriteMaskedFill(self, outputFilename, volumeType):
+        """a non-zero fill is written everywhere outside the mask"""
+        values = np.linspace(0, 100, self.mask.sum())
+        o = volumeLikeFile(inputFile_ubyte, outputFilename, volumeType=volumeType)
+        o.write_masked(values, self.mask, fill=-1)
+        o.closeVolume()
+        o = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(np.array(o.data)[~self.mask], -1, atol=101.0 / 65535)
+        o.closeVolume()
+
+    def testWriteMaskedInMemory(self, outputFilename):
+        """with the data loaded the values are scattered into memory"""
+        o = volumeLikeFile(inputFile_double, outputFilename)
+        o.data = np.full((100, 150, 125), -1.0)
+        values = np.arange(self.mask.sum(), dtype=np.float64)
+        o.write_masked(values, self.mask)
+        np.testing.assert_array_equal(np.array(o.data)[self.mask], values)
+        assert np.all(np.array(o.data)[~self.mask] == -1)
+        o.writeFile()
+        o.closeVolume()
+
+
+class TestVoxelStats:
+    """test the streaming voxel-wise statistics"""
+    cohort = [inputFile_byte, inputFile_short, inputFile_ubyte, inputFile_ushort, inputFile_int]
+
+    def cohortData(self):
+        return np.stack([np.array(volumeFromFile(f).data) for f in self.cohort])
+
+    @pytest.mark.parametrize("workers", [None, 3])
+    @pytest.mark.parametrize("slab_size", [None, 7])
+    def testMeanAndSd(self, tmp_path, workers, slab_size):
+        """streamed mean and sd should match numpy over the stacked volumes"""
+        mean_file = str(tmp_path / "mean.mnc")
+        sd_file = str(tmp_path / "sd.mnc")
+        count_file = str(tmp_path / "count.mnc")
+        mean, sd, count = voxel_stats(self.cohort, mean=mean_file, sd=sd_file, count=count_file,
+                                      volumeType="double", slab_size=slab_size, workers=workers)
+        data = self.cohortData()
+        np.testing.assert_allclose(mean, data.mean(axis=0), rtol=1e-10, atol=1e-10)
+        np.testing.assert_allclose(sd, data.std(axis=0, ddof=1), rtol=1e-8, atol=1e-8)
+        assert np.all(count == len(self.cohort))
+        for f, expected in [(mean_file, mean), (sd_file, sd), (count_file, count)]:
+            v = volumeFromFile(f)
+            np.testing.assert_allclose(np.array(v.data), expected, rtol=1e-10, atol=1e-10)
+            v.closeVolume()
+
+    def testWeighted(self):
+        """weights act as frequency weights"""
+        weights = [1, 3, 0, 2, 1]
+        mean, sd, count = voxel_stats(self.cohort, weights=weights, slab_size=20)
+        data = self.cohortData()
+        np.testing.assert_allclose(mean, np.average(data, axis=0, weights=weights), rtol=1e-10)
+        w = np.array(weights, dtype=float).reshape(-1, 1, 1, 1)
+        expected_sd = np.sqrt((w * (data - mean) ** 2).sum(axis=0) / (sum(weights) - 1))
+        np.testing.assert_allclose(sd, expected_sd, rtol=1e-8)
+        assert np.all(count == 4)
+
+    def testMergeMoments(self):
+        """merging two accumulators gives the moments of all the data"""
+        data = np.random.normal(1000, 5, (12, 4, 5))
+        whole, first, second = RunningMoments((4, 5)), RunningMoments((4, 5)), RunningMoments((4, 5))
+        for i, x in enumerate(data):
+            whole.update(x)
+            (first if i < 5 else second).update(x)
+        first.merge(second)
+        np.testing.assert_allclose(first.mean, data.mean(axis=0))
+        np.testing.assert_allclose(first.variance(), data.var(axis=0, ddof=1))
+        np.testing.assert_allclose(whole.variance(), data.var(axis=0, ddof=1))
+        assert np.all(first.count == 12)
+
+    def testNonFiniteSkipped(self):
+        """nan values don't contribute"""
+        moments = RunningMoments(2)
+        for x in [[1.0, np.nan], [3.0, 4.0], [5.0, 6.0]]:
+            moments.update(x)
+        np.testing.assert_array_equal(moments.count, [3, 2])
+        np.testing.assert_allclose(moments.mean, [3.0, 5.0])
+
+
+class TestLinearModel:
+    """test the mass-univariate linear model"""
+    cohort = [inputFile_byte, inputFile_short, inputFile_ubyte, inputFile_ushort, inputFile_int]
+    design = np.column_stack([np.ones(5), [1.5, -2.0, 0.3, 4.1, 2.2]])
+
+    def testMatchesPerVoxelFit(self):
+        """the block fit should match a least squares fit of single voxels"""
+        results = voxel_lm(self.cohort, self.design, slab_size=13)
+        data = np.stack([np.array(volumeFromFile(f).data) for f in self.cohort])
+        for voxel in [(0, 0, 0), (57, 101, 3), (99, 149, 124)]:
+            y = data[(slice(None),) + voxel]
+            beta = np.linalg.lstsq(self.design, y, rcond=None)[0]
+            residuals = y - self.design @ beta
+            sigma2 = residuals @ residuals / 3
+            se = np.sqrt(sigma2 * np.diag(np.linalg.inv(self.design.T @ self.design)))
+            sst = ((y - y.mean()) ** 2).sum()
+            r2 = 1 - residuals @ residuals / sst
+            np.testing.assert_allclose(results["beta"][(slice(None),) + voxel], beta, atol=1e-10)
+            np.testing.assert_allclose(results["tvalue"][(slice(None),) + voxel], beta / se, rtol=1e-8)
+            assert results["R2"][voxel] == approx(r2)
+            assert results["F"][voxel] == approx(r2 / (1 - r2) * 3)
+
+    def testParallelAndOutputs(self, tmp_path):
+        """a parallel fit gives the same results, which are written to file"""
+        prefix = str(tmp_path / "lm")
+        serial = voxel_lm(self.cohort, self.design)
+        parallel = voxel_lm(self.cohort, self.design, output_prefix=prefix, names=["intercept", "age"],
+                            volumeType="double", workers=3)
+        for name in serial:
+            np.testing.assert_allclose(parallel[name], serial[name])
+        for f, expected in [("lm_R2.mnc", serial["R2"]), ("lm_F.mnc", serial["F"]),
+                            ("lm_beta-age.mnc", serial["beta"][1]),
+                            ("lm_tvalue-intercept.mnc", serial["tvalue"][0])]:
+            v = volumeFromFile(str(tmp_path / f))
+            np.testing.assert_allclose(np.array(v.data), expected, rtol=1e-8, atol=1e-8)
+            v.closeVolume()
+
+    def testUndefinedStatistics(self):
+        """constant voxels give 0 instead of nan"""
+        results = LinearModel(self.design).fit(np.ones((5, 3)))
+        np.testing.assert_allclose(results["beta"][0], 1)
+        assert np.all(results["tvalue"] == 0)
+        assert np.all(results["R2"] == 0)
+
+    def testRankDeficientDesign(self):
+        """a design without residual degrees of freedom is rejected"""
+        with pytest.raises(ValueError):
+            LinearModel(np.eye(3))
+
+
+class TestVolumeWriter:
+    """test writing volumes of any type slab by slab"""
+    def sourceSlabs(self):
+        # increasing values, so a range widened while writing would misquantise the first slabs
+        for i in range(0, 100, 13):
+            count = min(13, 100 - i)
+            yield i, count, np.arange(count * 150 * 125, dtype=np.float64).reshape(count, 150, 125) * 0.5 + i * 1000
+
+    def expected(self):
+        return np.concatenate([slab for _, _, slab in self.sourceSlabs()])
+
+    def writeAndRead(self, outputFilename, volumeType, sliceScaled=False, **kwargs):
+        v = volumeLikeFile(inputFile_ushort, outputFilename, volumeType=volumeType, sliceScaled=sliceScaled)
+        with VolumeWriter(v, **kwargs) as writer:
+            for i, count, slab in self.sourceSlabs():
+                writer.write(slab, [i, 0, 0], [count, 150, 125])
+        v = volumeFromFile(outputFilename)
+        data = np.array(v.data)
+        v.closeVolume()
+        return data
+
+    @pytest.mark.parametrize("volumeType", ["ubyte", "short", "ushort", "int", "uint"])
+    def testDeclaredRange(self, outputFilename, volumeType):
+        """integer volumes written with a declared range"""
+        expected = self.expected()
+        data = self.writeAndRead(outputFilename, volumeType, range=(expected.min(), expected.max()))
+        step = (expected.max() - expected.min()) / (mincSizes[volumeType]["max"] - mincSizes[volumeType]["min"])
+        np.testing.assert_allclose(data, expected, atol=step)
+
+    @pytest.mark.parametrize("volumeType", ["ubyte", "ushort"])
+    def testTwoPass(self, outputFilename, volumeType):
+        """integer volumes written in two passes get the range of the data"""
+        expected = self.expected()
+        data = self.writeAndRead(outputFilename, volumeType, two_pass=True, slab_size=17)
+        step = (expected.max() - expected.min()) / (mincSizes[volumeType]["max"] - mincSizes[volumeType]["min"])
+        np.testing.assert_allclose(data, expected, atol=step)
+        assert data.min() == approx(expected.min())
+        assert data.max() == approx(expected.max())
+
+    @pytest.mark.parametrize("volumeType", ["float", "double"])
+    def testRealTypes(self, outputFilename, volumeType):
+        """float and double volumes don't need a range"""
+        data = self.writeAndRead(outputFilename, volumeType)
+        np.testing.assert_allclose(data, self.expected(), rtol=1e-6)
+
+    def testSliceScaled(self, outputFilename):
+        """slice scaled volumes get a range per slice"""
+        expected = self.expected()
+        data = self.writeAndRead(outputFilename, "ushort", sliceScaled=True)
+        np.testing.assert_allclose(data, expected, atol=(150 * 125 * 0.5) / 65535)
+
+    def testRangeRequired(self, outputFilename):
+        """integer volumes need a declared range or two passes"""
+        v = volumeLikeFile(inputFile_ushort, outputFilename, volumeType="ushort")
+        with pytest.raises(ValueError):
+            VolumeWriter(v)
+        v.closeVolume()
+
+
+class TestQuantisedWrite:
+    """test the single pass range and chunked quantisation of writeFile"""
+    @pytest.mark.parametrize("shape", [(10,), (100, 150, 125), (30, 40, 50)])
+    def testMinMax(self, shape):
+        """_minMax should agree with numpy, also for non-contiguous arrays"""
+        a = np.random.normal(size=shape)
+        assert _minMax(a) == (a.min(), a.max())
+        assert _minMax(a.T) == (a.min(), a.max())
+
+    @pytest.mark.parametrize("shape", [(10,), (100, 150, 125)])
+    @pytest.mark.parametrize("position", [0, -1, "middle"])
+    def testMinMaxNaN(self, shape, position):
+        """a NaN gives a NaN range wherever it is, as with numpy"""
+        a = np.random.normal(size=shape)
+        a.reshape(-1)[a.size // 2 if position == "middle" else position] = np.nan
+        for b in (a, a.T):
+            data_min, data_max = _minMax(b)
+            assert np.isnan(data_min) and np.isnan(data_max)
+
+    @pytest.mark.parametrize("volumeType", ["byte", "short", "int", "float", "double", "ubyte", "ushort", "uint"])
+    def testWriteFile(self, outputFilename, volumeType):
+        """written data should be read back within the quantisation step of the type"""
+        data = np.random.uniform(-3.5, 250.0, size=(100, 150, 125))
+        v = volumeLikeFile(inputFile_ushort, outputFilename, volumeType=volumeType)
+        v.data = data
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        step = (data.max() - data.min()) / (mincSizes[volumeType]["max"] - mincSizes[volumeType]["min"])
+        np.testing.assert_allclose(np.array(v.data), data, atol=step, rtol=1e-6)
+        assert v.getVolumeRange() == approx((data.min(), data.max()))
+        v.closeVolume()
+
+    def testWriteLabels(self, outputFilename):
+        """label volumes are written without any rescaling"""
+        labels = np.random.randint(0, 300, size=(100, 150, 125)).astype(np.uint16)
+        v = volumeLikeFile(inputFile_ushort, outputFilename, dtype="ushort", volumeType="ushort", labels=True)
+        v.data = labels
+        v.writeFile()
+        v = volumeFromFile(outputFilename, labels=True)
+        np.testing.assert_array_equal(np.array(v.data), labels)
+        v.closeVolume()
+
+
+class TestDataAdoption:
+    """test assigning data with and without copying"""
+    def testCopyByDefault(self, outputFilename):
+        """assigning data makes a copy"""
+        data = np.random.random((100, 150, 125))
+        v = volumeLikeFile(inputFile_double, outputFilename)
+        v.data = data
+        assert not np.shares_memory(v.data, data)
+        v.closeVolume()
+
+    def testNoCopy(self, outputFilename):
+        """with copy=False a matching array is used as it is"""
+        data = np.random.random((100, 150, 125))
+        v = volumeLikeFile(inputFile_double, outputFilename, volumeType="double")
+        v.setdata(data, copy=False)
+        assert np.shares_memory(v.data, data)
+        data[0, 0, 0] = 42
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        assert v.data[0, 0, 0] == 42
+        np.testing.assert_array_equal(np.array(v.data), data)
+        v.closeVolume()
+
+    @pytest.mark.parametrize("data", [np.random.random((100, 150, 125)).astype(np.float32),
+                                      np.asfortranarray(np.random.random((100, 150, 125)))])
+    def testNoCopyConverts(self, outputFilename, data):
+        """arrays of another dtype or memory layout are still converted"""
+        v = volumeLikeFile(inputFile_double, outputFilename)
+        v.setdata(data, copy=False)
+        assert not np.shares_memory(v.data, data)
+        assert v.data.dtype == np.float64 and v.data.flags["C_CONTIGUOUS"]
+        np.testing.assert_array_equal(v.data, data)
+        v.closeVolume()
+
+    def testVolumeFromDataNoCopy(self, outputFilename):
+        """volumeFromData can adopt the array"""
+        data = np.random.random((20, 30, 40))
+        v = volumeFromData(outputFilename, data, volumeType="double", copy=False)
+        assert np.shares_memory(v.data, data)
+        v.closeVolume()
+
+
+class TestStreamingCopy:
+    """test copying volumes slab by slab"""
+    @pytest.mark.parametrize("volumeType", [None, "ubyte", "short", "float", "double"])
+    @pytest.mark.parametrize("dtype,input_file", input_files_and_dtypes)
+    def testStreamedCopy(self, outputFilename, dtype, input_file, volumeType):
+        """a streamed copy should match one made in memory"""
+        v = volumeLikeFile(input_file, outputFilename, volumeType=volumeType, data=True,
+                           stream=True, slab_size=7)
+        assert v.volPointer is None
+        source = volumeFromFile(input_file)
+        copy = volumeFromFile(outputFilename)
+        expected = np.array(source.data)
+        step = (expected.max() - expected.min()) / (mincSizes[copy.volumeType]["max"] - mincSizes[copy.volumeType]["min"])
+        np.testing.assert_allclose(np.array(copy.data), expected, atol=step, rtol=1e-6)
+        assert copy.volumeType == (volumeType or source.volumeType)
+        source.closeVolume()
+        copy.closeVolume()
+
+    def testStreamModifiedData(self, outputFilename):
+        """data changed in memory is copied with its new range"""
+        source = volumeFromFile(inputFile_ushort)
+        source.data[10:20] = 1e6
+        volumeFromInstance(source, outputFilename, volumeType="ushort", data=True, stream=True)
+        copy = volumeFromFile(outputFilename)
+        assert copy.data[15, 0, 0] == approx(1e6)
+        np.testing.assert_allclose(np.array(copy.data), np.array(source.data), atol=1e6 / 65535)
+        copy.closeVolume()
+        source.closeVolume()
+
+    def testStreamSliceScaled(self, outputFilename):
+        """slice scaled copies get their slice ranges from the streamed data"""
+        volumeLikeFile(inputFile_double, outputFilename, volumeType="ushort", sliceScaled=True,
+                       data=True, stream=True)
+        copy = volumeFromFile(outputFilename)
+        source = volumeFromFile(inputFile_double)
+        for i in [0, 50, 99]:
+            expected = np.array(source.data[i])
+            np.testing.assert_allclose(np.array(copy.data[i]), expected,
+                                       atol=(expected.max() - expected.min()) / 65535)
+        copy.closeVolume()
+        source.closeVolume()
+
+    @pytest.mark.parametrize("threadsafe", [False, pytest.param(True, marks=pytest.mark.skipif(
+        not hdf5_threadsafe, reason="reading ahead while writing needs a thread-safe HDF5"))])
+    def testStreamPrefetch(self, outputFilename, monkeypatch, threadsafe):
+        """slabs are only read ahead in a second thread if HDF5 is thread-safe"""
+        monkeypatch.setattr(pyminc.volumes.factory, "hdf5_threadsafe", threadsafe)
+        depths = []
+        iter_slabs = mincVolume.iter_slabs
+        def recordingIterSlabs(self, *args, **kwargs):
+            depths.append(kwargs.get("prefetch", 0))
+            return iter_slabs(self, *args, **kwargs)
+        monkeypatch.setattr(mincVolume, "iter_slabs", recordingIterSlabs)
+        volumeLikeFile(inputFile_ushort, outputFilename, data=True, stream=True, slab_size=7, prefetch=2)
+        assert depths == [2 if threadsafe else 0]
+        source = volumeFromFile(inputFile_ushort)
+        copy = volumeFromFile(outputFilename)
+        expected = np.array(source.data)
+        np.testing.assert_allclose(np.array(copy.data), expected,
+                                   atol=(expected.max() - expected.min()) / 65535)
+        copy.closeVolume()
+        source.closeVolume()
+
+
+class TestVolumeProps:
+    """test creating volumes with given compression and chunking"""
+    @pytest.mark.parametrize("props", [VolumeProps(compression=None),
+                                       VolumeProps(zlib_level=1),
+                                       VolumeProps(zlib_level=9, chunks=(10, 20, 25))])
+    def testRoundTrip(self, outputFilename, props):
+        """data should be read back the same whatever the properties"""
+        source = volumeFromFile(inputFile_ushort)
+        v = volumeLikeFile(inputFile_ushort, outputFilename, props=props)
+        v.data = source.data
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        np.testing.assert_allclose(np.array(v.data), np.array(source.data), rtol=1e-6)
+        v.closeVolume()
+        source.closeVolume()
+
+    def testUncompressedCanBeMapped(self, outputFilename):
+        """an uncompressed file can be memory mapped, a compressed one can't"""
+        data = np.random.random((20, 30, 40))
+        v = volumeFromData(outputFilename, data, volumeType="double", props=VolumeProps(compression=None))
+        v.writeFile()
+        v = volumeFromFile(outputFilename, mmap=True)
+        assert isinstance(v.data, np.memmap)
+        np.testing.assert_array_equal(np.array(v.data), data)
+        v.closeVolume()
+        v = volumeFromData(outputFilename, data, volumeType="double", props=VolumeProps(zlib_level=4))
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        assert v._contiguousImageOffset() is None
+        v.closeVolume()
+
+    def testCompressionShrinksFiles(self, tmp_path):
+        """higher zlib levels shouldn't make smooth data larger than no compression"""
+        data = np.add.outer(np.arange(60.0), np.add.outer(np.arange(70.0), np.arange(80.0)))
+        sizes = []
+        for i, props in enumerate([VolumeProps(compression=None), VolumeProps(zlib_level=9)]):
+            f = str(tmp_path / ("props-%d.mnc" % i))
+            v = volumeFromData(f, data, volumeType="ushort", props=props)
+            v.writeFile()
+            sizes.append(os.path.getsize(f))
+        assert sizes[1] < sizes[0]
+
+    def testInvalidProps(self):
+        """unknown compression types and levels are rejected"""
+        with pytest.raises(ValueError):
+            VolumeProps(compression="gzip")
+        with pytest.raises(ValueError):
+            VolumeProps(zlib_level=12)
+        with pytest.raises(ValueError):
+            VolumeProps(compression=None, zlib_level=3)
+
+
+class TestChunkAlignedReads:
+    """test planning reads in whole chunks of the image"""
+    @pytest.fixture
+    def chunkedFile(self, outputFilename):
+        data = np.random.random((60, 70, 80))
+        v = volumeFromData(outputFilename, data, volumeType="ushort",
+                           props=VolumeProps(zlib_level=1, chunks=(10, 20, 25)))
+        v.writeFile()
+        return outputFilename
+
+    def testChunkShape(self, chunkedFile):
+        """the chunk shape is read on open, and unknown for header only opens"""
+        v = volumeFromFile(chunkedFile)
+        assert v.chunkShape == (10, 20, 25)
+        v.closeVolume()
+        v = volumeFromFile(chunkedFile, header_only=True)
+        assert v.chunkShape is None
+        v.closeVolume()
+
+    def testCohortPartitionsAligned(self, chunkedFile, monkeypatch):
+        """parallel voxel statistics split the cohort on the first file's chunk boundaries"""
+        blocks = []
+        def recordingPartition(*args):
+            result = partition(*args)
+            blocks.extend(result)
+            return result
+        monkeypatch.setattr(pyminc.volumes.stats, "partition", recordingPartition)
+        serial = voxel_stats([chunkedFile, chunkedFile])
+        parallel = voxel_stats([chunkedFile, chunkedFile], workers=4)
+        assert blocks and all(offset % 10 == 0 for offset, length in blocks)
+        for s, p in zip(serial, parallel):
+            np.testing.assert_allclose(p, s)
+
+    def testUncompressedIsNotChunked(self, outputFilename):
+        """a contiguous image has no chunk shape"""
+        v = volumeFromData(outputFilename, np.random.random((20, 30, 40)), volumeType="double",
+                           props=VolumeProps(compression=None))
+        v.writeFile()
+        v = volumeFromFile(outputFilename)
+        assert v.chunkShape is None
+        v.closeVolume()
+
+    def testAutomaticSlabsDecodeEachChunkOnce(self, chunkedFile):
+        """automatically sized slabs are whole chunks and don't decode anything twice"""
+        v = volumeFromFile(chunkedFile, dtype="ushort")
+        v.readStats.reset()
+        slabs = list(v.iter_slabs(slab_size=None))
+        assert all(s.start[0] % 10 == 0 for s in slabs)
+        assert v.readStats.requested_bytes == 60 * 70 * 80 * 2
+        assert v.readStats.amplification == 1.0
+        v.closeVolume()
+
+    def testMisalignedSlabsDecodeMore(self, chunkedFile):
+        """slabs that cut through chunks decode them more than once"""
+        v = volumeFromFile(chunkedFile, dtype="ushort")
+        v.readStats.reset()
+        for _ in v.iter_slabs(slab_size=3):
+            pass
+        assert v.readStats.decoded_bytes > v.readStats.requested_bytes
+        assert v.readStats.amplification > 1.0
+        v.closeVolume()
+
+    def testReadStats(self):
+        """decoded bytes are those of the chunks a hyperslab overlaps"""
+        stats = ReadStats()
+        stats.add([5, 0], [10, 7], 2, chunk_shape=(10, 10), sizes=[30, 15])
+        assert stats.requested_bytes == 140
+        assert stats.decoded_bytes == 20 * 10 * 2
+        stats.add([0, 0], [4, 4], 1)
+        assert stats.decoded_bytes == 400 + 16
+        assert stats.reads == 2
+        assert chunk_aligned([5, 12], [10, 3], (10, 10), [30, 15]) == ([0, 10], [20, 5])
+
+    @pytest.mark.parametrize("size, parts, align", [(60, 4, 10), (65, 3, 10), (7, 4, 1), (5, 4, 10)])
+    def testPartitionAlignment(self, size, parts, align):
+        """partitions cover the range in blocks starting at multiples of align"""
+        blocks = partition(size, parts, align)
+        assert len(blocks) <= parts
+        assert sum(length for _, length in blocks) == size
+        assert all(offset % align == 0 for offset, _ in blocks)
+        assert all(offset + length == next_offset
+                   for (offset, length), (next_offset, _) in zip(blocks, blocks[1:]))
+
+
+def blockMean(data, f):
+    """the mean of blocks of f voxels along every dimension, dropping incomplete blocks"""
+    shape = [n // f for n in data.shape]
+    data = data[tuple(slice(0, n * f) for n in shape)]
+    return data.reshape([x for n in shape for x in (n, f)]).mean(axis=tuple(range(1, 2 * len(shape), 2)))
+
+
+class TestResolutionLevels:
+    """test building and reading lower resolution levels"""
+    @pytest.fixture
+    def pyramidFile(self, outputFilename):
+        data = np.random.random((64, 50, 33))
+        v = volumeFromData(outputFilename, data, volumeType="double",
+                           starts=(-10.0, 5.0, 2.5), steps=(0.5, 1.0, 2.0))
+        v.build_pyramid(2)
+        v.closeVolume()
+        return outputFilename, data
+
+    @pytest.mark.parametrize("level", [1, 2])
+    def testLevelData(self, pyramidFile, level):
+        """level k holds the means of blocks of 2**k voxels"""
+        f, data = pyramidFile
+        v = volumeFromFile(f, resolution=level)
+        assert v.getSizes() == [n // 2 ** level for n in data.shape]
+        np.testing.assert_allclose(np.array(v.data), blockMean(data, 2 ** level), rtol=1e-6)
+        v.closeVolume()
+
+    def testLevelGeometry(self, pyramidFile):
+        """voxels of a level are centred on the blocks they average"""
+        f, _ = pyramidFile
+        full = volumeFromFile(f)
+        coarse = volumeFromFile(f, resolution=1)
+        assert coarse.separations == approx([2 * s for s in full.separations])
+        centre = (full.convertVoxelToWorld([0, 0, 0]) + full.convertVoxelToWorld([1, 1, 1])) / 2
+        np.testing.assert_allclose(coarse.convertVoxelToWorld([0, 0, 0]), centre)
+        np.testing.assert_allclose(coarse.convertWorldToVoxel(centre), [0, 0, 0], atol=1e-9)
+        np.testing.assert_allclose(coarse.starts, [s + d / 2 for s, d in zip(full.starts, full.separations)])
+        full.closeVolume()
+        coarse.closeVolume()
+
+    def testCopyLevel(self, pyramidFile, tmp_path):
+        """a copy of a lower resolution level has the level's geometry and data"""
+        f, data = pyramidFile
+        coarse = volumeFromFile(f, resolution=1)
+        copy_file = str(tmp_path / "level1.mnc")
+        out = volumeFromInstance(coarse, copy_file, volumeType="double", data=True)
+        out.writeFile()
+        out.closeVolume()
+        copy = volumeFromFile(copy_file)
+        assert copy.getSizes() == coarse.getSizes()
+        assert copy.starts == approx(coarse.starts)
+        assert copy.separations == approx(coarse.separations)
+        np.testing.assert_allclose(np.array(copy.data), blockMean(data, 2), rtol=1e-6)
+        copy.closeVolume()
+        coarse.closeVolume()
+
+    def testInvalidPyramids(self, pyramidFile):
+        """levels can't be built in read-only volumes, nor beyond the volume's size"""
+        f, _ = pyramidFile
+        v = volumeFromFile(f)
+        with pytest.raises(IOError):
+            v.build_pyramid(1)
+        v.closeVolume()
+        v = volumeFromFile(f, readonly=False)
+        with pytest.raises(ValueError):
+            v.build_pyramid(6)
+        v.closeVolume()
+        with pytest.raises(ValueError):
+            volumeFromFile(f, readonly=False, resolution=1)
+
+
+class TestVoxelWorldArrays:
+    """test converting arrays of points between voxel and world coordinates"""
+    @pytest.mark.parametrize("input_file", [inputFile_ushort, input3DdirectionCosines, inputVector])
+    def testVoxelsToWorld(self, input_file):
+        """the vectorised conversion agrees with libminc point by point"""
+        v = volumeFromFile(input_file)
+        voxels = np.random.random((50, v.ndims)) * np.array(v.getSizes())
+        expected = np.array([v.convertVoxelToWorld(voxel) for voxel in voxels])
+        np.testing.assert_allclose(v.convertVoxelsToWorld(voxels), expected, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(v.convertVoxelsToWorld(voxels[0]), expected[0], rtol=1e-9, atol=1e-9)
+        v.closeVolume()
+
+    @pytest.mark.parametrize("input_file", [inputFile_ushort, input3DdirectionCosines])
+    def testWorldToVoxels(self, input_file):
+        """world coordinates are mapped back to the voxels they came from, as by libminc"""
+        v = volumeFromFile(input_file)
+        voxels = np.random.random((50, 3)) * np.array(v.getSizes())
+        world = v.convertVoxelsToWorld(voxels)
+        expected = np.array([v.convertWorldToVoxel(w) for w in world])
+        np.testing.assert_allclose(v.convertWorldToVoxels(world), expected, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(v.convertWorldToVoxels(world), voxels, rtol=1e-9, atol=1e-9)
+        v.closeVolume()
+
+    def testNewVolumeGeometry(self, outputFilename):
+        """a new volume converts with the geometry it was described with"""
+        v = volumeFromDescription(outputFilename, ("zspace", "yspace", "xspace"), (10, 20, 30),
+                                  (-5.0, 2.0, 7.5), (2.0, 1.0, 0.5))
+        assert v.starts == [-5.0, 2.0, 7.5]
+        np.testing.assert_allclose(v.convertVoxelsToWorld([[1, 2, 3]]), [[7.5 + 1.5, 2.0 + 2, -5.0 + 2]])
+        v.closeVolume()
+
+    def testWrongShape(self):
+        """points need one coordinate per dimension"""
+        v = volumeFromFile(inputFile_ushort)
+        with pytest.raises(IncorrectDimsException):
+            v.convertVoxelsToWorld(np.zeros((5, 2)))
+        with pytest.raises(IncorrectDimsException):
+            v.convertWorldToVoxels(np.zeros((5, 4)))
+        v.closeVolume()
+
+
+def libmincTransform(xfm_filename, points, inverse=False):
+    """transforms points one at a time with libminc, as a reference"""
+    transform = GeneralTransform()
+    assert libminc.input_transform_file(xfm_filename, transform) >= 0
+    apply_point = libminc.general_inverse_transform_point if inverse else libminc.general_transform_point
+    x, y, z = c_double(), c_double(), c_double()
+    result = []
+    for point in points:
+        assert apply_point(transform, *[c_double(c) for c in point], byref(x), byref(y), byref(z)) >= 0
+        result.append((x.value, y.value, z.value))
+    libminc.delete_general_transform(transform)
+    return np.array(result)
+
+
+class TestXfmTransform:
+    """test transforming arrays of points with transformations read once"""
+    @pytest.fixture
+    def nonlinearXfm(self, tmp_path):
+        grid = str(tmp_path / "grid.mnc")
+        v = volumeFromDescription(grid, ("zspace", "yspace", "xspace", "vector_dimension"), (10, 10, 10, 3),
+                                  (-50.0, -50.0, -50.0, 0.0), (10.0, 10.0, 10.0, 1.0), volumeType="float")
+        displacements = np.zeros((10, 10, 10, 3))
+        displacements[..., :] = (1.5, -2.0, 0.5)
+        displacements += np.random.random(displacements.shape)
+        v.data = displacements
+        v.writeFile()
+        xfm = str(tmp_path / "nonlinear.xfm")
+        with open(xfm, "w") as f:
+            f.write("MNI Transform File\n\n"
+                    "Transform_Type = Linear;\n"
+                    "Linear_Transform =\n 1 0 0 5\n 0 2 0 0\n 0 0 1 -3;\n"
+                    "Transform_Type = Grid_Transform;\n"
+                    "Displacement_Volume = %s;\n" % grid)
+        return xfm
+
+    @pytest.mark.parametrize("xfm_filename", [outputXfmFilename1, outputXfmFilename2, outputXfmFilename3])
+    @pytest.mark.parametrize("inverse", [False, True])
+    def testLinear(self, xfm_filename, inverse):
+        """linear and concatenated linear transformations agree with libminc"""
+        points = np.random.random((100, 3)) * 200 - 100
+        with XfmTransform(xfm_filename) as xfm:
+            assert xfm.linear
+            np.testing.assert_allclose(xfm.transform(points, inverse=inverse),
+                                       libmincTransform(xfm_filename, points, inverse), rtol=1e-9, atol=1e-9)
+
+    def testRoundTrip(self):
+        """the inverse undoes the forward transformation"""
+        points = np.random.random((10, 3)) * 50
+        with XfmTransform(outputXfmFilename3) as xfm:
+            np.testing.assert_allclose(xfm.transform(xfm.transform(points), inverse=True), points, atol=1e-6)
+            assert xfm.transform(points[0]).shape == (3,)
+
+    @pytest.mark.parametrize("inverse", [False, True])
+    def testNonlinear(self, nonlinearXfm, inverse):
+        """a linear transformation followed by a grid agrees with libminc"""
+        points = np.random.random((20, 3)) * 30 - 15
+        with XfmTransform(nonlinearXfm) as xfm:
+            assert not xfm.linear
+            assert xfm.matrix is None
+            np.testing.assert_allclose(xfm.transform(points, inverse=inverse),
+                                       libmincTransform(nonlinearXfm, points, inverse), rtol=1e-6, atol=1e-6)
+
+    def testMultipleCoordinates(self):
+        """the list based function gives the same points as the transform object"""
+        points = np.random.random((25, 3)) * 20
+        x, y, z = transform_multiple_xyz_coordinates_using_xfm(outputXfmFilename3, *points.T.tolist())
+        with XfmTransform(outputXfmFilename3) as xfm:
+            np.testing.assert_allclose(np.column_stack([x, y, z]), xfm.transform(points))
+        with pytest.raises(ValueError):
+            transform_multiple_xyz_coordinates_using_xfm(outputXfmFilename3, [1.0], [2.0, 3.0], [4.0])
+
+    def testWrongShape(self):
+        """points need 3 coordinates"""
+        with XfmTransform(outputXfmFilename1) as xfm:
+            with pytest.raises(ValueError):
+                xfm.transform(np.zeros((4, 2)))